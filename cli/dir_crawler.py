@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+#
+# Parallel directory crawler used by image-monitor and image-verifyer.
+# On NFS every stat and scandir is a network round trip, walking a share one dir
+# at a time is latency bound, so up to max_workers dirs are listed concurrently
+#
+
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+import fs_watcher
+
+IMAGE_EXTENSIONS = (".tif", ".tiff", ".png", ".jpg", ".jpeg", ".bmp")
+
+
+def get_max_workers(path, network_workers, local_workers):
+    """
+    Concurrency for crawling path, local disks gain little from many parallel listings
+    """
+    try:
+        is_network = fs_watcher.is_network_fs(path)
+    except OSError:
+        is_network = True
+    workers = network_workers if is_network else local_workers
+    return max(1, int(workers))
+
+
+def crawl(roots, visit, max_workers):
+    """
+    Calls visit(path) for roots and, recursively, for the subdirs it returns, max_workers at a time.
+    visit runs in pool threads and returns (subdirs, results), results are yielded in the calling thread.
+    Dirs are yielded in completion order, not walk order
+    """
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='crawler')
+    try:
+        pending = {executor.submit(visit, root) for root in roots}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                subdirs, results = future.result()
+                for subdir in subdirs:
+                    pending.add(executor.submit(visit, subdir))
+                yield from results
+    finally:
+        # stopped early (exception or generator closed), don't list the rest of the tree
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def list_dir(path, image_extensions=IMAGE_EXTENSIONS, excluded_extensions=()):
+    """
+    Lists dir (not starting with '.') and stops at first image file.
+    Returns dict with subdirs, is_img_dir, has_single_images and entry_count (entries listed)
+    """
+    subdirs = []
+    is_img_dir = False
+    has_single_images = False
+    entry_count = 0
+    with os.scandir(path) as entries:
+        for entry in entries:
+            entry_count += 1
+            if not entry.name.startswith('.') and entry.is_dir():
+                subdirs.append(entry.path)
+            if entry.is_file():
+                # parent is image dir if file is imagefile, then break scandir-loop
+                if entry.path.lower().endswith( image_extensions ) and not entry.path.lower().endswith( excluded_extensions ):
+                    is_img_dir = True
+                    # check if single_images subdir also exists, before break looking through this directory
+                    has_single_images = os.path.exists(os.path.join(path, "single_images"))
+                    break
+
+    return {'subdirs': subdirs, 'is_img_dir': is_img_dir, 'has_single_images': has_single_images, 'entry_count': entry_count}
+
+
+def img_dir_paths(path, listing):
+    """
+    Returns list of image dirs as Path from a listing of path
+    """
+    if not listing['is_img_dir']:
+        return []
+
+    img_dirs = [Path(path)]
+    # A little hack to get subdir "single_images" if it exist
+    if listing['has_single_images']:
+        img_dirs.append(Path(path) / "single_images")
+    return img_dirs
+
+
+def find_dirs_containing_img_files(roots, max_workers, image_extensions=IMAGE_EXTENSIONS, excluded_extensions=()):
+    """
+    Yield lowest level directories containing image files as Path (not starting with '.'),
+    without any scan state (every dir is listed)
+    """
+    def visit(path):
+        try:
+            listing = list_dir(path, image_extensions, excluded_extensions)
+        except FileNotFoundError:
+            logging.warning(f"dir removed while crawling: {path}")
+            return [], []
+        return listing['subdirs'], img_dir_paths(path, listing)
+
+    yield from crawl(roots, visit, max_workers)
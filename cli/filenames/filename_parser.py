@@ -1,45 +1,36 @@
 import os
 import logging
-from filenames import pharmbio_squid_filename_v1
-from filenames import pharmbio_squid_filename_v2_standard
-from filenames import pharmbio_IMX_filename_standard
-from filenames import pharmbio_IMX_filename_older
-from filenames import pharmbio_IMX_filename_relaxed
-from filenames import external_filename_christa
-from filenames import external_filename_cpjump
-from filenames import external_filename_david
-from filenames import external_filename_IMX
-from filenames import external_filename_gbm_IMX
-from filenames import external_filename_opera_rXcXfXpX_chXskXfkXflX
-from filenames import pharmbio_nikon_filename_v1
-from filenames import pharmbio_nikon_filename_v2_exported
-from filenames import pharmbio_nikon_filename_v3_multi
-from filenames import pharmbio_nikon_filename_v4_multi
-from filenames import pharmbio_nikon_filename_v5_multi
-from filenames import pharmbio_nikon_filename_v6_multi
-from filenames import pharmbio_nikon_filename_v7_single
-from filenames import pharmbio_nikon_filename_v8_single
-
+import importlib
+
+# parsers are tried in this order, the first that parses the filename is used
+PARSER_MODULES = ['pharmbio_squid_filename_v1',
+                  'pharmbio_squid_filename_v2_standard',
+                  'pharmbio_nikon_filename_v1',
+                  'pharmbio_nikon_filename_v2_exported',
+                  'pharmbio_nikon_filename_v3_multi',
+                  'pharmbio_nikon_filename_v4_multi',
+                  'pharmbio_nikon_filename_v5_multi',
+                  'pharmbio_nikon_filename_v6_multi',
+                  'pharmbio_nikon_filename_v8_single',
+                  'pharmbio_nikon_filename_v7_single',
+                  'pharmbio_IMX_filename_standard',
+                  'pharmbio_IMX_filename_older',
+                  'pharmbio_IMX_filename_relaxed',
+                  'external_filename_christa',
+                  'external_filename_gbm_IMX',
+                  'external_filename_IMX',
+                  'external_filename_cpjump',
+                  'external_filename_david',
+                  'external_filename_opera_rXcXfXpX_chXskXfkXflX']
+
+# a parser module missing in this checkout is skipped, filenames of its layout don't parse
 parsers = []
-parsers.append(pharmbio_squid_filename_v1)
-parsers.append(pharmbio_squid_filename_v2_standard)
-parsers.append(pharmbio_nikon_filename_v1)
-parsers.append(pharmbio_nikon_filename_v2_exported)
-parsers.append(pharmbio_nikon_filename_v3_multi)
-parsers.append(pharmbio_nikon_filename_v4_multi)
-parsers.append(pharmbio_nikon_filename_v5_multi)
-parsers.append(pharmbio_nikon_filename_v6_multi)
-parsers.append(pharmbio_nikon_filename_v8_single)
-parsers.append(pharmbio_nikon_filename_v7_single)
-parsers.append(pharmbio_IMX_filename_standard)
-parsers.append(pharmbio_IMX_filename_older)
-parsers.append(pharmbio_IMX_filename_relaxed)
-parsers.append(external_filename_christa)
-parsers.append(external_filename_gbm_IMX)
-parsers.append(external_filename_IMX)
-parsers.append(external_filename_cpjump)
-parsers.append(external_filename_david)
-parsers.append(external_filename_opera_rXcXfXpX_chXskXfkXflX)
+for module_name in PARSER_MODULES:
+    try:
+        parsers.append(importlib.import_module('filenames.' + module_name))
+    except ImportError:
+        # module logger, logging.warning would configure the root logger before the script does
+        logging.getLogger(__name__).warning(f"filename parser not available, skipped: {module_name}")
 
 def parse_path_and_file(filename):
 
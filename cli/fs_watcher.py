@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+import logging
+import os
+from inotify_simple import INotify, flags
+
+# inotify only sees writes made through the local kernel, files written to these
+# by other hosts are never reported so they have to be polled
+NETWORK_FS_TYPES = ("nfs", "nfs4", "cifs", "smb3", "smbfs", "fuse.sshfs", "ceph", "glusterfs", "lustre")
+
+WATCH_FLAGS = flags.CREATE | flags.CLOSE_WRITE | flags.MOVED_TO | flags.MOVED_FROM | flags.DELETE_SELF
+
+
+def get_fs_type(path):
+    """
+    Returns filesystem type (as in /proc/mounts) of the mount that path is on
+    """
+    path = os.path.realpath(path)
+    best_mount = ""
+    best_type = None
+    with open("/proc/mounts") as mounts:
+        for line in mounts:
+            fields = line.split()
+            if len(fields) < 3:
+                continue
+            # spaces in mount points are octal-escaped in /proc/mounts
+            mount_point = fields[1].replace("\\040", " ")
+            is_parent = path == mount_point or path.startswith(mount_point.rstrip("/") + "/")
+            if is_parent and len(mount_point) >= len(best_mount):
+                best_mount = mount_point
+                best_type = fields[2]
+    return best_type
+
+
+def is_network_fs(path):
+    return get_fs_type(path) in NETWORK_FS_TYPES
+
+
+class ImageDirWatcher:
+    """
+    Recursive inotify watch of directory trees, reports image files when they are
+    completely written (closed after write, or moved into a watched dir).
+    If the kernel event queue overflowed, events are lost and the trees have to be walked
+    again by the caller (see take_overflow)
+    """
+
+    def __init__(self, image_extensions, excluded_extensions):
+        self.image_extensions = image_extensions
+        self.excluded_extensions = excluded_extensions
+        self.inotify = INotify()
+        self.dirs = dict() # watch descriptor -> dir path
+        self.overflowed = False
+
+    def add_tree(self, root):
+        """
+        Adds watch on root and all subdirs (not starting with '.')
+        Raises OSError if out of inotify watches (fs.inotify.max_user_watches)
+        """
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            self._add_watch(dirpath)
+
+    def _add_watch(self, path):
+        wd = self.inotify.add_watch(path, WATCH_FLAGS)
+        self.dirs[wd] = path
+
+    def _remove_tree_watches(self, path):
+        # dir moved away (or renamed), its watches would report the old paths
+        for wd, dir_path in list(self.dirs.items()):
+            if dir_path == path or dir_path.startswith(path + os.sep):
+                del self.dirs[wd]
+                try:
+                    self.inotify.rm_watch(wd)
+                except OSError:
+                    pass # already removed by the kernel
+
+    def take_overflow(self):
+        """
+        Returns True if events were lost (queue overflow) since last call
+        """
+        overflowed = self.overflowed
+        self.overflowed = False
+        return overflowed
+
+    def _is_image(self, name):
+        name = name.lower()
+        return name.endswith(self.image_extensions) and not name.endswith(self.excluded_extensions)
+
+    def read_new_images(self, timeout_sec):
+        """
+        Waits max timeout_sec for events.
+        Returns dict with dir as key and list of new image files in that dir as value
+        """
+        return self.new_images_from_events(self.inotify.read(timeout=int(timeout_sec * 1000)))
+
+    def new_images_from_events(self, events):
+        """
+        Returns dict with dir as key and list of new image files in that dir as value from inotify events,
+        new dirs are watched
+        """
+        new_images = dict()
+        for event in events:
+
+            if event.mask & flags.Q_OVERFLOW:
+                logging.warning("inotify event queue overflow, events are lost until watched dirs are walked again")
+                self.overflowed = True
+                continue
+
+            if event.mask & flags.IGNORED or event.mask & flags.DELETE_SELF:
+                self.dirs.pop(event.wd, None)
+                continue
+
+            parent = self.dirs.get(event.wd)
+            if parent is None:
+                continue
+
+            path = os.path.join(parent, event.name)
+
+            if event.mask & flags.MOVED_FROM:
+                if event.mask & flags.ISDIR:
+                    self._remove_tree_watches(path)
+                continue
+
+            if event.mask & flags.ISDIR:
+                # new acquisition dir, watch it and pick up files written before the watch was added
+                if not event.name.startswith('.'):
+                    try:
+                        self.add_tree(path)
+                        for dirpath, dirnames, filenames in os.walk(path):
+                            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+                            for filename in filenames:
+                                if self._is_image(filename):
+                                    new_images.setdefault(dirpath, set()).add(os.path.join(dirpath, filename))
+                    except OSError as e:
+                        logging.error(f"Could not watch new dir: {path}, error: {e}")
+                continue
+
+            if event.mask & (flags.CLOSE_WRITE | flags.MOVED_TO) and self._is_image(event.name):
+                new_images.setdefault(parent, set()).add(path)
+
+        # a file can be reported both by the walk of a new dir and by its own event
+        return {img_dir: sorted(images) for img_dir, images in new_images.items()}
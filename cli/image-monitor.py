@@ -6,17 +6,28 @@ import os
 from pathlib import Path
 import re
 import time
+import socket
 import traceback
 import glob
+import threading
 from typing import Dict, List
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from unittest import result
 import psycopg2
 from psycopg2 import pool
+import psycopg2.extras
 import json
 from datetime import datetime, timedelta
 
 import filenames.filename_parser
+import dir_crawler
+import fs_watcher
 import image_tools
+import io_budget
+import metrics
+import pipeline
+import tiff_info
 import settings as imgdb_settings
 
 __connection_pool = None
@@ -24,11 +35,20 @@ __connection_pool = None
 IMAGE_EXTENSIONS = (".tif", ".tiff", ".png", ".jpg", ".jpeg", ".bmp")
 EXCLUDED_EXTENSIONS = (".ome.tiff.not.used.anymore")
 
+# directories that doesn't have images, the crawler doesn't go into these
+EXCLUDED_DIRS = {'/share/mikro/IMX/MDC_pharmbio/trash',
+                 '/share/mikro2/nikon/trash',
+                 '/share/mikro2/squid/trash'}
+
 def get_connection():
 
     global __connection_pool
     if __connection_pool is None:
-        __connection_pool = pool.SimpleConnectionPool(1, 2, user=imgdb_settings.DB_USER,
+        # threaded pool, import pipeline stages query from their own threads: one connection per
+        # parse and tiff meta worker, plus the polling thread and the discovery thread
+        # (getconn raises PoolError instead of waiting when all are taken)
+        maxconn = imgdb_settings.IMPORT_PARSE_WORKERS + imgdb_settings.IMPORT_META_WORKERS + 2
+        __connection_pool = pool.ThreadedConnectionPool(1, maxconn, user=imgdb_settings.DB_USER,
                                                                password=imgdb_settings.DB_PASS,
                                                                host=imgdb_settings.DB_HOSTNAME,
                                                                port=imgdb_settings.DB_PORT,
@@ -87,21 +107,6 @@ def get_last_modified(path):
     return
 
 
-def make_thumb_path(image, thumbdir):
-    # need to strip / otherwise path can not be joined
-    image_subpath = image.strip("/")
-    thumb_path = os.path.join(thumbdir, image_subpath)
-    return thumb_path
-
-
-def insert_meta_into_db(img_meta):
-
-    # First select plate acquisition id, or insert it if not there
-    plate_acq_id = select_or_insert_plate_acq(img_meta)
-    # Insert into images table
-    insert_meta_into_table_images(img_meta, plate_acq_id)
-
-
 def getPlateBarcodeFromPlateAcquisitionName(acquisition_name):
     
     # extract barcode from acquisition_name (if there is one)
@@ -119,42 +124,24 @@ def getPlateBarcodeFromPlateAcquisitionName(acquisition_name):
     return barcode
 
 
-def insert_meta_into_table_images(img_meta, plate_acq_id):
-
-    conn = None
-    try:
+def select_or_insert_plate_acq(img_meta):
 
-        insert_query = "INSERT INTO images(plate_acquisition_id, plate_barcode, timepoint, well, site, channel, z, path, file_meta, metadata) VALUES(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"
-        conn = get_connection()
-        insert_cursor = conn.cursor()
-        insert_cursor.execute(insert_query, (plate_acq_id,
-                                             getPlateBarcodeFromPlateAcquisitionName(img_meta['plate']),
-                                             img_meta['timepoint'],
-                                             img_meta['well'],
-                                             img_meta['wellsample'],
-                                             img_meta['channel'],
-                                             img_meta.get('z', 0),
-                                             img_meta['path'],
-                                             json.dumps(img_meta['file_meta']),
-                                             json.dumps(img_meta)
-                                             ))
-        insert_cursor.close()
-        conn.commit()
-    except Exception as err:
-        logging.exception("Message")
-        raise err
-    finally:
-        put_connection(conn)
+    global plate_acq_ids
 
+    folder = os.path.dirname(img_meta['path'])
 
-def select_or_insert_plate_acq(img_meta):
+    # Known acquisitions are resolved from memory without any db round trip
+    plate_acq_id = plate_acq_ids.get(folder)
 
-    # First select to see if plate_acq already exists
-    plate_acq_id = select_plate_acq_id(img_meta['path'])
+    if plate_acq_id is None:
+        # Could be a finished acquisition (not preloaded) or inserted by another monitor
+        plate_acq_id = select_plate_acq_id(img_meta['path'])
 
     if plate_acq_id is None:
         plate_acq_id = insert_plate_acq(img_meta)
 
+    plate_acq_ids[folder] = plate_acq_id
+
     return plate_acq_id
 
 
@@ -173,9 +160,14 @@ def select_plate_acq_id(image_path):
         conn = get_connection()
         cursor = conn.cursor()
         cursor.execute(query, (folder,))
-        plate_acq_id = cursor.fetchone()
+        result = cursor.fetchone()
         cursor.close()
 
+        if result:
+            plate_acq_id = result[0]
+        else:
+            plate_acq_id = None
+
         return plate_acq_id
 
     except Exception as err:
@@ -184,34 +176,84 @@ def select_plate_acq_id(image_path):
     finally:
         put_connection(conn)
 
-def getChannelMapIDFromMapping(project, plate_acq_name):
-    conn = None
 
+def select_unfinished_plate_acq_ids():
+    """
+    Returns dict with folder as key and plate_acquisition id as value for all unfinished acquisitions,
+    used to preload the plate_acq_ids cache with one query
+    """
+
+    conn = None
     try:
+        query = ("SELECT folder, id "
+                 "FROM plate_acquisition "
+                 "WHERE finished IS NULL")
+
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(query)
+
+        result = {r[0]: r[1] for r in cursor.fetchall()}
+
+        cursor.close()
+
+        return result
+
+    except Exception as err:
+        logging.exception("Message")
+        raise err
+    finally:
+        put_connection(conn)
+
+
+def select_channel_map_mappings():
+    """
+    Returns whole channel_map_mapping table as dict with (project, plate_acquisition_name) as key
+    and channel_map as value
+    """
 
-        query = (
-                 "SELECT channel_map "
-                 "FROM channel_map_mapping "
-                 "WHERE project = %s "
-                 "AND "
-                 "( plate_acquisition_name = %s OR plate_acquisition_name = '*')"
-                 )
+    conn = None
+    try:
+        query = ("SELECT project, plate_acquisition_name, channel_map "
+                 "FROM channel_map_mapping")
 
         conn = get_connection()
         cursor = conn.cursor()
-        cursor.execute(query, (project, plate_acq_name))
-        result = cursor.fetchone()
+        cursor.execute(query)
+
+        result = {(r[0], r[1]): r[2] for r in cursor.fetchall()}
+
         cursor.close()
 
-        # set default if nothing speciffic for this plate or plate_acquisition
-        if result:
-            channel_map_id = result[0]
-        else:
-            channel_map_id = None
+        return result
+
+    except Exception as err:
+        logging.exception("Message")
+        raise err
+    finally:
+        put_connection(conn)
+
+
+def select_acquisition_protocols():
+    """
+    Returns whole acquisition_protocol table as dict with (project, plate_acquisition_name) as key
+    and dict with sites_per_well and z_planes as value
+    """
+
+    conn = None
+    try:
+        query = ("SELECT project, plate_acquisition_name, sites_per_well, z_planes "
+                 "FROM acquisition_protocol")
+
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(query)
+
+        result = {(r[0], r[1]): {'sites_per_well': r[2], 'z_planes': r[3]} for r in cursor.fetchall()}
 
-        logging.info(f"channel_map_id = {channel_map_id}")
+        cursor.close()
 
-        return channel_map_id
+        return result
 
     except Exception as err:
         logging.exception("Message")
@@ -220,7 +262,23 @@ def getChannelMapIDFromMapping(project, plate_acq_name):
         put_connection(conn)
 
 
+def getChannelMapIDFromMapping(project, plate_acq_name):
+
+    # mapping for this speciffic plate_acquisition first, then wildcard for whole project
+    channel_map_id = channel_map_mappings.get((project, plate_acq_name))
+    if channel_map_id is None:
+        channel_map_id = channel_map_mappings.get((project, '*'))
+
+    logging.info(f"channel_map_id = {channel_map_id}")
+
+    return channel_map_id
+
+
 def insert_plate_acq(img_meta):
+    """
+    Inserts plate_acquisition, if another monitor inserted same folder in the meantime
+    (unique folder) the id of that one is returned instead
+    """
 
     conn = None
     try:
@@ -234,7 +292,10 @@ def insert_plate_acq(img_meta):
         if specific_ch_map:
             img_meta['channel_map_id'] = specific_ch_map
 
-        query = "INSERT INTO plate_acquisition(plate_barcode, name, project, imaged, microscope, channel_map_id, timepoint, folder) VALUES(%s, %s, %s, %s, %s, %s, %s, %s) RETURNING id"
+        query = ("INSERT INTO plate_acquisition(plate_barcode, name, project, imaged, microscope, channel_map_id, timepoint, folder) "
+                 "VALUES(%s, %s, %s, %s, %s, %s, %s, %s) "
+                 "ON CONFLICT (folder) DO NOTHING "
+                 "RETURNING id")
         conn = get_connection()
         cursor = conn.cursor()
         cursor.execute(query, (getPlateBarcodeFromPlateAcquisitionName(img_meta['plate']),
@@ -247,9 +308,20 @@ def insert_plate_acq(img_meta):
                                folder
                                ))
 
-        plate_acq_id = cursor.fetchone()[0]
+        result = cursor.fetchone()
         cursor.close()
 
+        if result is None:
+            # lost race against other monitor, use the acquisition it inserted
+            cursor = conn.cursor()
+            cursor.execute("SELECT id FROM plate_acquisition WHERE folder = %s", (folder,))
+            plate_acq_id = cursor.fetchone()[0]
+            cursor.close()
+            conn.commit()
+            return plate_acq_id
+
+        plate_acq_id = result[0]
+
         # Also add to New acquisitions table
         query = "INSERT INTO new_plate_acquisition(id, folder) VALUES(%s, %s)"
         cursor2 = conn.cursor()
@@ -268,19 +340,93 @@ def insert_plate_acq(img_meta):
         put_connection(conn)
 
 
-def image_exists_in_db(image_path):
+def without_file_meta(img_meta):
+    """
+    img_meta for the metadata column, file_meta is only stored in file_meta_id/file_meta columns
+    """
+    return {key: value for key, value in img_meta.items() if key != 'file_meta'}
+
+
+def intern_file_meta(plate_acq_id, file_meta):
+    """
+    Returns (file_meta_id, override) for an image: the id of the interned tiff header set of the
+    acquisition closest to file_meta, and the fields of file_meta that differ from it (None if none).
+    A header set with more than half of the fields differing from all known ones is interned as a new one
+    """
+    global acq_file_metas
+
+    # not a tiff or unreadable, nothing to intern
+    if not file_meta:
+        return None, file_meta or None
+
+    if plate_acq_id not in acq_file_metas:
+        acq_file_metas[plate_acq_id] = select_file_metas(plate_acq_id)
+
+    best_id, best_diff = None, None
+    for file_meta_id, base in acq_file_metas[plate_acq_id]:
+        diff = tiff_info.diff_file_meta(base, file_meta)
+        if best_diff is None or len(diff) < len(best_diff):
+            best_id, best_diff = file_meta_id, diff
+            if len(diff) == 0:
+                break
+
+    if best_diff is None or len(best_diff) > len(file_meta) / 2:
+        best_id, best_diff = insert_file_meta(plate_acq_id, file_meta), dict()
+        acq_file_metas[plate_acq_id].append((best_id, file_meta))
+
+    return best_id, best_diff or None
+
+
+def select_file_metas(plate_acq_id):
+    """
+    Returns list of (id, file_meta) of the interned tiff header sets of an acquisition
+    """
 
     conn = None
     try:
+
+        query = ("SELECT id, file_meta "
+                 "FROM image_file_meta "
+                 "WHERE plate_acquisition_id = %s "
+                 "ORDER BY id")
+
         conn = get_connection()
         cursor = conn.cursor()
+        cursor.execute(query, (plate_acq_id,))
+        file_metas = [(row[0], row[1]) for row in cursor.fetchall()]
+        cursor.close()
 
-        exists_path_query = "SELECT EXISTS (SELECT 1 FROM images WHERE path = %s)"
-        cursor.execute(exists_path_query, (image_path,))
+        return file_metas
 
-        path_exists = cursor.fetchone()[0]
+    except Exception as err:
+        logging.exception("Message")
+        raise err
+    finally:
+        put_connection(conn)
+
+
+def insert_file_meta(plate_acq_id, file_meta):
+    """
+    Interns a tiff header set of an acquisition and returns its id,
+    the id of the existing row if another monitor already interned the same one
+    """
+
+    conn = None
+    try:
+
+        query = ("INSERT INTO image_file_meta(plate_acquisition_id, hash, file_meta) "
+                 "VALUES(%s, %s, %s) "
+                 "ON CONFLICT (plate_acquisition_id, hash) DO UPDATE SET hash = EXCLUDED.hash "
+                 "RETURNING id")
+
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(query, (plate_acq_id, tiff_info.file_meta_hash(file_meta), json.dumps(file_meta)))
+        file_meta_id = cursor.fetchone()[0]
         cursor.close()
-        return path_exists
+        conn.commit()
+
+        return file_meta_id
 
     except Exception as err:
         logging.exception("Message")
@@ -288,6 +434,18 @@ def image_exists_in_db(image_path):
     finally:
         put_connection(conn)
 
+
+def enqueue_thumb_jobs(conn, image_ids_and_paths):
+    """
+    Adds one thumb_job per (image_id, path) tuple, the thumbnails are made by thumb-worker.
+    Does not commit, caller commits together with the image insert
+    """
+    query = "INSERT INTO thumb_job(image_id, path) VALUES %s"
+    cursor = conn.cursor()
+    psycopg2.extras.execute_values(cursor, query, image_ids_and_paths, page_size=1000)
+    cursor.close()
+
+
 def make_compressed_copy_filename(img_meta, ORIG_ROOT_PATH, COMPRESSED_ROOT_PATH):
     filename, suffix = os.path.splitext(img_meta['path'])
     out_filename = img_meta['path'].replace(ORIG_ROOT_PATH, COMPRESSED_ROOT_PATH).replace(suffix, '.png')
@@ -298,55 +456,116 @@ def make_compressed_copy(img_meta):
     if not os.path.isfile(img_meta['path_compressed_copy']):
         image_tools.any2png(img_meta['path'], img_meta['path_compressed_copy'], COMPRESSION_LEVEL)
 
-def addImageToImagedb(img_meta):
-    # read tiff-meta-tags
-    # make inside try-catch so a corrupted image doesn't stop it all
-    tiff_meta = ""
+def select_existing_image_paths(image_paths):
+    """
+    Returns the subset of image_paths that already exist in the images table,
+    fetched with one query instead of one EXISTS-query per image
+    """
+
+    conn = None
     try:
-        tiff_meta = image_tools.read_tiff_info(img_meta['path'])
-    except Exception as e:
-        logging.error("Exception reading tiff meta: %s", e)
-        logging.error("image: " + str(img_meta['path']))
-        logging.error( "Continuing since we don't want to break on a single bad image")
+        conn = get_connection()
+        cursor = conn.cursor()
+
+        query = "SELECT path FROM images WHERE path = ANY(%s)"
+        cursor.execute(query, (list(image_paths),))
+
+        # get result as set instead of tuples
+        existing_paths = set(r[0] for r in cursor.fetchall())
+        cursor.close()
+        return existing_paths
 
-    img_meta['file_meta'] = tiff_meta
+    except Exception as err:
+        logging.exception("Message")
+        raise err
+    finally:
+        put_connection(conn)
 
-    # insert into db
-    insert_meta_into_db(img_meta)
 
-    # create thumb image
-    thumb_path = make_thumb_path(img_meta['path'],
-                                 imgdb_settings.IMAGES_THUMB_FOLDER)
-    logging.debug(thumb_path)
+def insert_meta_into_table_images_bulk(img_metas, folder_plate_acq_ids):
+    """
+    Inserts all img_metas into the images table in one transaction.
+    folder_plate_acq_ids is a dict with image folder as key and plate_acquisition id as value.
+    Paths that are already in the table are skipped (ON CONFLICT DO NOTHING) so that
+    re-polling the same directory is idempotent.
+    A thumb_job is enqueued for every inserted image in the same transaction.
+    file_meta is interned per acquisition, images only store the fields that differ (see intern_file_meta).
+    Returns set of the paths that were actually inserted
+    """
 
-    # Only create thumb if not exists already
-    # make inside try-catch so a corrupted image doesn't stop it all
-    # also try 3 times with some sleep in between to allow for images that are not
-    # completely uploaded
-    if not os.path.exists(thumb_path):
+    conn = None
+    try:
 
-        #logging.debug(f'makethumb: {thumb_path}')
-        attempts = 0
-        while attempts < 3:
-            try:
-                image_tools.makeThumb(img_meta['path'], thumb_path, False)
-                break
-            except Exception as e:
-                logging.error("Exception making thumb image: %s", e)
-                logging.error("image: " + str(img_meta['path']))
-                logging.error("thumb_path: " + str(thumb_path))
-                logging.error(f'will retry x times in x seconds, attempt {attempts}')
-                logging.error("After that Continuing since we don't want to break on a single bad image")
-                attempts += 1
-                time.sleep(10)
+        rows = []
+        for img_meta in img_metas:
+            plate_acq_id = folder_plate_acq_ids[os.path.dirname(img_meta['path'])]
+            file_meta_id, file_meta = intern_file_meta(plate_acq_id, img_meta['file_meta'])
+            rows.append((plate_acq_id,
+                         getPlateBarcodeFromPlateAcquisitionName(img_meta['plate']),
+                         img_meta['timepoint'],
+                         img_meta['well'],
+                         img_meta['wellsample'],
+                         img_meta['channel'],
+                         img_meta.get('z', 0),
+                         img_meta['path'],
+                         file_meta_id,
+                         json.dumps(file_meta) if file_meta else None,
+                         json.dumps(without_file_meta(img_meta))
+                         ))
+
+        insert_query = ("INSERT INTO images(plate_acquisition_id, plate_barcode, timepoint, well, site, channel, z, path, file_meta_id, file_meta, metadata) "
+                        "VALUES %s "
+                        "ON CONFLICT (path) DO NOTHING "
+                        "RETURNING id, path")
+        conn = get_connection()
+        insert_cursor = conn.cursor()
+        inserted = psycopg2.extras.execute_values(insert_cursor, insert_query, rows, page_size=1000, fetch=True)
+        insert_cursor.close()
 
-def add_plate_to_db(images):
-    global processed
+        if len(inserted) > 0:
+            enqueue_thumb_jobs(conn, inserted)
+
+        start_commit = time.time()
+        conn.commit()
+        ingest_budget.observe_commit(time.time() - start_commit)
+
+        return set(r[1] for r in inserted)
+
+    except Exception as err:
+        if conn is not None:
+            conn.rollback()
+        logging.exception("Message")
+        raise err
+    finally:
+        put_connection(conn)
+
+
+def add_plate_to_db(images, backfill=False):
+    """
+    Bulk import of all images in one directory:
+    one query to find which images are already in db, then all new rows are
+    inserted with execute_values in a single transaction.
+    Tiff meta of backfill images is read within the io budget.
+    The steps are also the stages of the import pipeline (see import_img_dirs_pipelined)
+    """
 
     logging.info(f"start add_plate_metadata to db, len(images)(including thumbs): {len(images)}")
 
-    # Loop all Images
-    for idx, image in enumerate(images):
+    new_img_metas = parse_new_images(images)
+    read_file_metas(new_img_metas, backfill)
+    write_images(new_img_metas, images)
+
+    logging.info("done add_plate_metadata to db")
+
+
+def parse_new_images(images):
+    """
+    Parses images (skips thumbnails) and returns img_metas of the ones not already in db
+    """
+
+    # Parse all images first, skip thumbnails
+    img_metas = []
+    for image in images:
 
         img_meta = filenames.filename_parser.parse_path_and_file(image)
 
@@ -356,42 +575,88 @@ def add_plate_to_db(images):
 
         logging.debug(img_meta)
 
-        # Skip thumbnails
         if not img_meta['is_thumbnail']:
+            img_metas.append(img_meta)
 
-            # Check if image already exists in db
-            image_exists = image_exists_in_db(img_meta['path'])
+    if len(img_metas) == 0:
+        return []
 
-            # Insert image if not in db (no result)
-            if image_exists == False:
-                addImageToImagedb(img_meta)
-            else:
-                logging.debug("image exists already in db")
+    # One query for all paths in this dir instead of one per image
+    with metrics.DB_EXISTING_SECONDS.time():
+        existing_paths = select_existing_image_paths([img_meta['path'] for img_meta in img_metas])
+    new_img_metas = [img_meta for img_meta in img_metas if img_meta['path'] not in existing_paths]
 
-        if idx % 100 == 1:
-                logging.info("images processed (including thubs):" + str(idx))
-                logging.info("images total to process(including thumbs):" + str(len(images)))
+    logging.info(f"images already in db: {len(existing_paths)}, new images: {len(new_img_metas)}")
 
-        # Add image to processed images (path as key and timestamp as value)
-        processed[ img_meta['path'] ] = time.time()
+    return new_img_metas
 
-    logging.info("done add_plate_metadata to db")
 
+def read_file_metas(new_img_metas, backfill=False):
+    """
+    Reads tiff-meta-tags of all new images in one batch into img_meta['file_meta'] (in-process, no pixel data is read)
+    """
+
+    # a corrupted image gets empty meta, we don't want to break on a single bad image
+    # backfill reads wait for io budget, images of live acquisitions are never throttled
+    with metrics.TIFF_META_SECONDS.time():
+        if backfill:
+            file_metas = tiff_info.read_tiff_info_many([img_meta['path'] for img_meta in new_img_metas],
+                                                       ingest_budget.max_concurrent_decodes, ingest_budget.acquire)
+        else:
+            file_metas = tiff_info.read_tiff_info_many([img_meta['path'] for img_meta in new_img_metas])
+    for img_meta in new_img_metas:
+        img_meta['file_meta'] = file_metas[img_meta['path']]
+
+
+def write_images(new_img_metas, images):
+    """
+    Inserts new_img_metas (with file_meta) and marks all images as seen,
+    updates monitor state so only called from polling thread
+    """
+    global images_inserted_count
+
+    # plate acquisition is the same for all images in a folder, only resolve once per folder
+    folder_plate_acq_ids = dict()
+    for img_meta in new_img_metas:
+
+        folder = os.path.dirname(img_meta['path'])
+        if folder not in folder_plate_acq_ids:
+            folder_plate_acq_ids[folder] = select_or_insert_plate_acq(img_meta)
+
+    inserted_paths = set()
+    if len(new_img_metas) > 0:
+        with metrics.DB_INSERT_SECONDS.time():
+            inserted_paths = insert_meta_into_table_images_bulk(new_img_metas, folder_plate_acq_ids)
+        metrics.IMAGES_INSERTED.inc(len(inserted_paths))
+        images_inserted_count += len(inserted_paths)
+
+    logging.info(f"images inserted (and thumb jobs enqueued): {len(inserted_paths)}")
+
+    # Add images to seen images of their acquisition
+    mark_images_seen(images, time.time())
 
-def select_finished_plate_acq_folder():
+
+def select_finished_plate_acq_folder(finished_after: datetime = None):
+    """
+    Returns list of (folder, finished) of finished acquisitions,
+    only the ones finished after finished_after if specified
+    """
 
     conn = None
     try:
-        query = ("SELECT folder "
+        query = ("SELECT folder, finished "
                  "FROM plate_acquisition "
                  "WHERE finished IS NOT NULL")
+        params = ()
+        if finished_after is not None:
+            query += " AND finished > %s"
+            params = (finished_after,)
 
         conn = get_connection()
         cursor = conn.cursor()
-        cursor.execute(query)
+        cursor.execute(query, params)
 
-        # get result as list instead of tuples
-        result = [r[0] for r in cursor.fetchall()]
+        result = cursor.fetchall()
 
         cursor.close()
 
@@ -403,6 +668,42 @@ def select_finished_plate_acq_folder():
     finally:
         put_connection(conn)
 
+def refresh_finished_acq_folders(scan_margin: float):
+    """
+    Adds acquisitions finished since the watermark (latest finished loaded) to finished_acq_folders.
+    finished is set to a cutoff time in the past (and by any monitor), so the query overlaps a day
+    and the whole set is reloaded every FINISHED_FULL_RELOAD_INTERVAL (also drops acquisitions that were un-finished).
+    Acquisitions finished less than scan_margin sec ago are still crawled, a finish from the expected
+    image count (computed from plate layout and protocol, can be wrong) must not lose late images
+    """
+    global finished_acq_folders, finished_acq_watermark, finished_acq_last_full_reload
+
+    full_reload = (finished_acq_watermark is None or
+                   time.time() - finished_acq_last_full_reload > FINISHED_FULL_RELOAD_INTERVAL)
+
+    if full_reload:
+        rows = select_finished_plate_acq_folder()
+        folders = set()
+        finished_acq_last_full_reload = time.time()
+    else:
+        rows = select_finished_plate_acq_folder(finished_acq_watermark - timedelta(days=1))
+        folders = set(finished_acq_folders)
+
+    # recently finished are newer than the watermark, so they are loaded again next refresh
+    scan_cutoff = datetime.utcfromtimestamp(time.time() - scan_margin)
+    for folder, finished in rows:
+        if finished > scan_cutoff:
+            continue
+        folders.add(folder)
+        if finished_acq_watermark is None or finished > finished_acq_watermark:
+            finished_acq_watermark = finished
+
+    # crawler threads of roots still being crawled read the set, it is swapped and never changed in place
+    finished_acq_folders = folders
+
+    logging.info(f"finished acquisitions loaded: {len(rows)}, full reload: {full_reload}, len(finished_acq_folders): {len(finished_acq_folders)}")
+
+
 def select_unfinished_plate_acq_folder():
 
     conn = None
@@ -429,229 +730,1663 @@ def select_unfinished_plate_acq_folder():
         put_connection(conn)
 
 
-def find_dirs_containing_img_files_recursive_from_list_of_paths(path_list: List[str]):
+def find_dirs_containing_img_files_recursive_from_list_of_paths(path_list: List[str], crawl_concurrency: int = imgdb_settings.CRAWL_CONCURRENCY):
     for path in path_list:
         if not os.path.exists(path):
             logging.exception(f"Path does not exist: {path}")
         else:
-            yield from find_dirs_containing_img_files_recursive(path)
+            max_workers = dir_crawler.get_max_workers(path, crawl_concurrency, imgdb_settings.CRAWL_CONCURRENCY_LOCAL)
+            yield from find_dirs_containing_img_files_recursive(os.path.normpath(path), max_workers)
 
-def find_dirs_containing_img_files_recursive(path: str):
+def find_dirs_containing_img_files_recursive(path: str, max_workers: int = 1):
     """
     Yield lowest level directories containing image files as Path (not starting with '.')
-    the method is called recursively to find all subdirs
-    It breaks the recursion when it finds an image file to avoid looking through all files (long operation)
-    """
-
-    for entry in os.scandir(path):
-        # recurse directories
-        if not entry.name.startswith('.') and entry.is_dir():
-            yield from find_dirs_containing_img_files_recursive(entry.path)
-        if entry.is_file():
-            # return parent path if file is imagefile, then break scandir-loop
-            if entry.path.lower().endswith( IMAGE_EXTENSIONS ) and not entry.path.lower().endswith( EXCLUDED_EXTENSIONS ):
+    Dirs are stat:ed and listed by up to max_workers crawler threads (see dir_crawler.crawl)
+    Listing a dir stops when it finds an image file to avoid looking through all files (long operation)
 
-                parent = Path(entry.path).parent
-                yield(parent)
+    A dir with same mtime as last poll is not listed again, the result of the last listing is
+    reused from scan_state. The mtime of a dir only changes when its own entries change,
+    so subdirs are still checked (stat) but not listed
 
-                # A little hack to get subdir "single_images" if it exist, before break looking through this directory
-                # check if single_images subdir also exists, if so add that one to
-                single_images_dir = parent / "single_images"
-                if os.path.exists(single_images_dir):
-                    yield single_images_dir
+    scan_state is only updated here in the calling thread, crawler threads just read it
+    """
 
-                break
+    for path, mtime, listing in dir_crawler.crawl([path], scan_dir, max_workers):
+        yield from apply_scan_result(path, mtime, listing)
 
-def update_finished_plate_acquisitions(cutoff_time):
-    global processed
 
-    # first get unfinished acq from database
-    unfinished = select_unfinished_plate_acq_folder()
+def crawl_root_dir(root_dir: str, crawl_concurrency: int):
+    """
+    Crawls root_dir and returns the crawl results as list of (path, mtime, listing), to be applied
+    to scan_state with apply_scan_result, or None if root_dir does not exist (e.g. unmounted share).
+    Runs in a root scan thread and only reads scan_state, so a slow mount is crawled while images
+    of other roots are imported
+    """
+    if not os.path.exists(root_dir):
+        logging.error(f"Path does not exist: {root_dir}")
+        return None
 
-    for plate_acq_folder in unfinished:
+    start_scan = time.time()
+    max_workers = dir_crawler.get_max_workers(root_dir, crawl_concurrency, imgdb_settings.CRAWL_CONCURRENCY_LOCAL)
+    crawl_results = list(dir_crawler.crawl([os.path.normpath(root_dir)], scan_dir, max_workers))
+    # only the crawl, not the wait for imports of other roots before its results are applied
+    metrics.SCAN_DURATION.observe(time.time() - start_scan)
+    return crawl_results
 
-        # loop processed images in reverse to see when last file was processed for this unfinished folder
-        for img_path in reversed(processed):
-            if plate_acq_folder in img_path:
-                proc_time = processed[img_path]
-                logging.info("proc_time=" + str(proc_time))
-                logging.info("cutoff_time=" + str(cutoff_time))
-                if proc_time < cutoff_time:
-                    folder = os.path.dirname(img_path)
-                    update_acquisition_finished(folder, cutoff_time)
 
-                # latest proc_time for this acquisition is found, time to break
-                break
+def apply_scan_result(path: str, mtime: float, listing: dict):
+    """
+    Updates scan_state with crawl result of one dir (see scan_dir) and returns its image dirs as list of Path
+    """
 
-def update_acquisition_finished(folder: str, timestamp: float):
+    global scan_state, scan_state_changed, scan_state_deleted, scan_state_visited
 
-    logging.info("inside update_acquisition_finished, folder: " + folder)
+    if mtime is None:
+        if path in scan_state:
+            del scan_state[path]
+            scan_state_changed.discard(path)
+            scan_state_deleted.add(path)
+        return []
 
-    conn = None
-    try:
+    if listing is not None:
+        scan_state[path] = new_dir_scan_state(path, mtime, listing)
+        scan_state_changed.add(path)
+        scan_state_deleted.discard(path)
 
-        query = (" UPDATE plate_acquisition "
-                 " SET finished = %s "
-                 " WHERE folder = %s")
+    scan_state_visited.add(path)
 
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute(query, (datetime.utcfromtimestamp(timestamp), folder) )
-        assert cursor.rowcount == 1, "rowcount should always be 1 for this update query"
-        cursor.close()
-        conn.commit()
-    except Exception as err:
-        logging.exception("Message")
-        raise err
-    finally:
-        put_connection(conn)
+    return dir_crawler.img_dir_paths(path, scan_state[path])
 
 
-#
-# Main import function
-#
-def import_plate_images_and_meta(plate_dir: str):
+def scan_dir(path: str):
     """
-    Main import function
+    Crawler visit of one dir (runs in crawler thread), stat and list if mtime changed since last scan.
+    Returns (subdirs, [(path, mtime, listing)]), mtime is None if dir is gone and listing None if not listed
     """
 
-    global processed
+    # finished acquisitions get no new images, don't stat or go into them
+    if path in EXCLUDED_DIRS or path in finished_acq_folders:
+        return [], []
 
-    logging.info("start import_plate_images_and_meta: " + str(plate_dir))
-
-    all_images = get_all_image_files(plate_dir)
+    try:
+        mtime = os.stat(path).st_mtime
+    except FileNotFoundError:
+        return [], [(path, None, None)]
 
-    # create a new list with only images not in processed dict
-    new_images = [img for img in all_images if img not in processed]
+    state = scan_state.get(path)
+    if state is not None and state['mtime'] == mtime:
+        return state['subdirs'], [(path, mtime, None)]
 
-    # import images (if later than latest_import_filedate)
-    if len(new_images) > 0:
-        add_plate_to_db(new_images)
+    metrics.DIRS_LISTED.inc()
+    try:
+        listing = dir_crawler.list_dir(path, IMAGE_EXTENSIONS, EXCLUDED_EXTENSIONS)
+    except FileNotFoundError:
+        return [], [(path, None, None)]
 
-    logging.info("done import_plate_images_and_meta: " + str(plate_dir))
+    return listing['subdirs'], [(path, mtime, listing)]
 
 
-# directories that doesn't have images or is throwing error when processed
-blacklist: list[str] = []
-blacklist.append('/share/mikro/IMX/MDC_pharmbio/trash/')
-blacklist.append('/share/mikro2/nikon/trash/')
-blacklist.append('/share/mikro2/squid/trash/')
+def new_dir_scan_state(path: str, mtime: float, listing: dict):
+    """
+    Returns new scan state for dir from a new listing,
+    import state from previous scan state of the dir is kept
+    """
 
+    state = dict(scan_state.get(path, {'imported_mtime': None, 'imported': None}))
+    state['mtime'] = mtime
+    state['subdirs'] = listing['subdirs']
+    state['is_img_dir'] = listing['is_img_dir']
+    state['has_single_images'] = listing['has_single_images']
+    # image dirs are not listed to the end here, their entry_count is set when imported
+    if not listing['is_img_dir']:
+        state['entry_count'] = listing['entry_count']
 
+    return state
 
-# processed filenames and timestamp when processed
-processed: dict[str, float]= dict()
 
+def get_dir_mtime(path: str):
+    # dirs visited by scanner this poll already have fresh mtime in scan_state, avoid another stat
+    if path in scan_state_visited:
+        return scan_state[path]['mtime']
+    return os.stat(path).st_mtime
 
-def polling_loop(poll_dirs_margin_days, latest_file_change_margin, sleep_time, proj_root_dirs, exhaustive_initial_poll, continuous_polling):
 
-    global processed, blacklist
+def set_dir_imported(path: str, dir_mtime: float, image_count: int, list_time: float):
+    """
+    Remember that all images in dir were imported when dir had dir_mtime
+    """
 
-    is_initial_poll = True
+    global scan_state, scan_state_changed
 
-    logging.info("proj_root_dirs: " + str(proj_root_dirs))
+    # Only trust mtime if it is some seconds older than the listing, otherwise a file
+    # could have been added after listing within same mtime tick
+    if dir_mtime > list_time - 2:
+        return
 
-    while True:
+    state = scan_state.setdefault(path, {'mtime': None, 'subdirs': [], 'is_img_dir': True, 'has_single_images': False})
+    state['imported_mtime'] = dir_mtime
+    state['imported'] = list_time
+    state['entry_count'] = image_count
+    scan_state_changed.add(path)
 
-        logging.info("***")
-        logging.info("")
-        logging.info("Staring new poll: " + str(datetime.today()))
-        logging.info("")
-        logging.info("***")
-        logging.info("")
 
-        start_loop = time.time()
+def is_dir_unchanged_since_import(path: str):
+    state = scan_state.get(path)
+    if state is None or state.get('imported_mtime') is None:
+        return False
+    return get_dir_mtime(path) == state['imported_mtime']
 
-        # create new cutoff time
-        cutoff_time = time.time() - latest_file_change_margin
 
-        # get all image dirs within root dirs
-        img_dirs = set(find_dirs_containing_img_files_recursive_from_list_of_paths(proj_root_dirs))
+def select_scan_state():
 
-        logging.info(f"len(img_dirs): {len(img_dirs)}")
+    conn = None
+    try:
+        query = ("SELECT path, mtime, entry_count, subdirs, is_img_dir, has_single_images, imported_mtime, imported "
+                 "FROM dir_scan_state")
 
-        # remove finished acquisitions
-        finished_acq_folders = select_finished_plate_acq_folder()
-        for path in set(img_dirs):
-            if str(path) in finished_acq_folders:
-                img_dirs.remove(path)
-                #logging.info("removed because finished: " + str(path))
+        conn = get_connection()
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cursor.execute(query)
 
-        logging.info(f"len(img_dirs): {len(img_dirs)}")
+        result = dict()
+        for row in cursor:
+            result[row['path']] = dict(row)
 
-        # remove old dirs
-        if is_initial_poll:
-            old_dir_cuttoff = 0 # 1970-01-01
-        else:
-            old_dir_cuttoff = (3600 * 24 * poll_dirs_margin_days)
-        for path in set(img_dirs):
-            if path.stat().st_mtime < old_dir_cuttoff:
-                img_dirs.remove(path)
-                #logging.info("removed because old: " + str(path))
+        cursor.close()
+
+        return result
+
+    except Exception as err:
+        logging.exception("Message")
+        raise err
+    finally:
+        put_connection(conn)
+
+
+def save_scan_state_changes():
+    """
+    Writes only the dirs that changed since last save
+    """
+
+    global scan_state, scan_state_changed, scan_state_deleted
+
+    if len(scan_state_changed) == 0 and len(scan_state_deleted) == 0:
+        return
+
+    conn = None
+    try:
+        rows = []
+        for path in scan_state_changed:
+            state = scan_state[path]
+            rows.append((path,
+                         state['mtime'],
+                         state.get('entry_count'),
+                         state['subdirs'],
+                         state['is_img_dir'],
+                         state['has_single_images'],
+                         state.get('imported_mtime'),
+                         state.get('imported')))
+
+        upsert_query = ("INSERT INTO dir_scan_state(path, mtime, entry_count, subdirs, is_img_dir, has_single_images, imported_mtime, imported) "
+                        "VALUES %s "
+                        "ON CONFLICT (path) DO UPDATE SET "
+                        "mtime = EXCLUDED.mtime, entry_count = EXCLUDED.entry_count, subdirs = EXCLUDED.subdirs, "
+                        "is_img_dir = EXCLUDED.is_img_dir, has_single_images = EXCLUDED.has_single_images, "
+                        "imported_mtime = EXCLUDED.imported_mtime, imported = EXCLUDED.imported, updated = now()")
+
+        conn = get_connection()
+        cursor = conn.cursor()
+        if len(rows) > 0:
+            psycopg2.extras.execute_values(cursor, upsert_query, rows, page_size=1000)
+        if len(scan_state_deleted) > 0:
+            cursor.execute("DELETE FROM dir_scan_state WHERE path = ANY(%s)", (list(scan_state_deleted),))
+        cursor.close()
+        conn.commit()
+
+        logging.info(f"scan state saved, changed: {len(scan_state_changed)}, deleted: {len(scan_state_deleted)}")
+
+        scan_state_changed.clear()
+        scan_state_deleted.clear()
+
+    except Exception as err:
+        if conn is not None:
+            conn.rollback()
+        logging.exception("Message")
+        raise err
+    finally:
+        put_connection(conn)
+
+
+def select_quarantine():
+
+    conn = None
+    try:
+        query = ("SELECT path, reason, attempts, next_retry "
+                 "FROM dir_quarantine")
+
+        conn = get_connection()
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cursor.execute(query)
+
+        result = dict()
+        for row in cursor:
+            result[row['path']] = dict(row)
+
+        cursor.close()
+
+        return result
+
+    except Exception as err:
+        logging.exception("Message")
+        raise err
+    finally:
+        put_connection(conn)
+
+
+def save_quarantine_changes():
+    """
+    Writes only the dirs that were quarantined or released since last save
+    """
+
+    global quarantine, quarantine_changed, quarantine_deleted
+
+    if len(quarantine_changed) == 0 and len(quarantine_deleted) == 0:
+        return
+
+    conn = None
+    try:
+        rows = []
+        for path in quarantine_changed:
+            entry = quarantine[path]
+            rows.append((path, entry['reason'], entry['attempts'], entry['next_retry']))
+
+        upsert_query = ("INSERT INTO dir_quarantine(path, reason, attempts, next_retry) "
+                        "VALUES %s "
+                        "ON CONFLICT (path) DO UPDATE SET "
+                        "reason = EXCLUDED.reason, attempts = EXCLUDED.attempts, "
+                        "next_retry = EXCLUDED.next_retry, last_failed = now()")
+
+        conn = get_connection()
+        cursor = conn.cursor()
+        if len(rows) > 0:
+            psycopg2.extras.execute_values(cursor, upsert_query, rows)
+        if len(quarantine_deleted) > 0:
+            cursor.execute("DELETE FROM dir_quarantine WHERE path = ANY(%s)", (list(quarantine_deleted),))
+        cursor.close()
+        conn.commit()
+
+        logging.info(f"quarantine saved, changed: {len(quarantine_changed)}, released: {len(quarantine_deleted)}")
+
+        quarantine_changed.clear()
+        quarantine_deleted.clear()
+
+    except Exception as err:
+        if conn is not None:
+            conn.rollback()
+        logging.exception("Message")
+        raise err
+    finally:
+        put_connection(conn)
+
+
+def quarantine_dir(path: str, reason: str):
+    """
+    Dir is not imported again until next_retry, the delay doubles every failed attempt
+    (a transient NFS error recovers soon, a broken dir is only retried rarely)
+    """
+    global quarantine, quarantine_changed, quarantine_deleted
+
+    entry = quarantine.get(path)
+    attempts = 1 if entry is None else entry['attempts'] + 1
+    delay = min(imgdb_settings.QUARANTINE_BASE_DELAY * 2 ** (attempts - 1), imgdb_settings.QUARANTINE_MAX_DELAY)
+
+    quarantine[path] = {'path': path,
+                        'reason': reason,
+                        'attempts': attempts,
+                        'next_retry': time.time() + delay}
+    quarantine_changed.add(path)
+    quarantine_deleted.discard(path)
+
+    logging.info(f"quarantined img_dir: {path}, attempts: {attempts}, retry in: {delay} sek")
+
+
+def release_from_quarantine(path: str):
+    global quarantine, quarantine_changed, quarantine_deleted
+
+    if quarantine.pop(path, None) is not None:
+        quarantine_changed.discard(path)
+        quarantine_deleted.add(path)
+        logging.info("released from quarantine: " + path)
+
+
+def is_quarantined(path: str):
+    entry = quarantine.get(path)
+    return entry is not None and time.time() < entry['next_retry']
+
+
+def mark_images_seen(images: List[str], timestamp: float):
+    global acq_activity
+
+    for image in images:
+        folder, filename = os.path.split(image)
+        activity = acq_activity.get(folder)
+        if activity is None:
+            activity = acq_activity[folder] = {'last_seen': timestamp, 'image_count': 0, 'filenames': set()}
+        activity['filenames'].add(filename)
+        activity['image_count'] = len(activity['filenames'])
+        activity['last_seen'] = max(activity['last_seen'], timestamp)
+
+
+def is_image_seen(image: str):
+    folder, filename = os.path.split(image)
+    activity = acq_activity.get(folder)
+    return activity is not None and filename in activity['filenames']
+
+
+def select_poll_checkpoints():
+    """
+    Returns dict with root dir as key and start time of last completed poll of that root as value
+    """
+
+    conn = None
+    try:
+        query = ("SELECT root_dir, last_poll "
+                 "FROM poll_checkpoint")
+
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(query)
+
+        result = {r[0]: r[1] for r in cursor.fetchall()}
+
+        cursor.close()
+
+        return result
+
+    except Exception as err:
+        logging.exception("Message")
+        raise err
+    finally:
+        put_connection(conn)
+
+
+def save_poll_checkpoints(root_dirs: List[str], poll_start: float):
+
+    global poll_checkpoints
+
+    conn = None
+    try:
+        rows = [(os.path.normpath(root_dir), poll_start) for root_dir in root_dirs]
+
+        query = ("INSERT INTO poll_checkpoint(root_dir, last_poll) "
+                 "VALUES %s "
+                 "ON CONFLICT (root_dir) DO UPDATE "
+                 "SET last_poll = EXCLUDED.last_poll, updated = now()")
+
+        conn = get_connection()
+        cursor = conn.cursor()
+        psycopg2.extras.execute_values(cursor, query, rows)
+        cursor.close()
+        conn.commit()
+
+        poll_checkpoints.update(rows)
+
+    except Exception as err:
+        logging.exception("Message")
+        raise err
+    finally:
+        put_connection(conn)
+
+
+def get_old_dir_cutoff(root_dir: str, is_initial_poll: bool, exhaustive_initial_poll: bool, poll_dirs_margin_days):
+    """
+    Dirs with mtime before this cutoff are not imported.
+    Initial poll of a root without checkpoint (or exhaustive initial poll) has no cutoff, after a
+    restart the cutoff is counted from the last completed poll before the restart
+    """
+    margin = 3600 * 24 * float(poll_dirs_margin_days)
+
+    if not is_initial_poll:
+        return time.time() - margin
+
+    checkpoint = poll_checkpoints.get(os.path.normpath(root_dir))
+    if checkpoint is None or exhaustive_initial_poll:
+        return 0 # 1970-01-01
+
+    return checkpoint - margin
+
+
+def select_thumb_job_counts():
+    """
+    Returns dict with state as key and number of jobs in thumb_job as value
+    """
+
+    conn = None
+    try:
+        query = ("SELECT state, count(*) "
+                 "FROM thumb_job "
+                 "GROUP BY state")
+
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(query)
+
+        result = {r[0]: r[1] for r in cursor.fetchall()}
+
+        cursor.close()
+
+        return result
+
+    except Exception as err:
+        logging.exception("Message")
+        raise err
+    finally:
+        put_connection(conn)
+
+
+def update_queue_metrics():
+
+    thumb_job_counts = select_thumb_job_counts()
+    for state in set(thumb_job_counts) | {'queued', 'running', 'failed'}:
+        metrics.THUMB_QUEUE_DEPTH.labels(state).set(thumb_job_counts.get(state, 0))
+
+
+def update_finished_plate_acquisitions(cutoff_time):
+    """
+    Acquisitions that are complete (expected number of images in db, or end marker written by
+    the microscope) are set to finished right away. Acquisitions without new images since
+    cutoff_time are set to finished as fallback. Finished and idle folders are evicted from
+    acq_activity, only folders in acq_activity are checked (no scan over all images seen)
+    """
+    global acq_activity
+
+    if len(acq_activity) == 0:
+        return
+
+    # get unfinished acq from database
+    unfinished = set(select_unfinished_plate_acq_folder())
+
+    with pending_images_lock:
+        pending_folders = set(os.path.dirname(image) for image in pending_images)
+
+    complete_folders = dict()
+    idle_folders = []
+    for folder, activity in acq_activity.items():
+        if activity['last_seen'] < cutoff_time:
+            idle_folders.append(folder)
+        elif folder in unfinished and folder not in pending_folders:
+            reason = get_acquisition_complete_reason(folder, activity)
+            if reason is not None:
+                complete_folders[folder] = reason
+
+    for folder, reason in complete_folders.items():
+        logging.info(f"acquisition complete ({reason}): {folder}")
+        update_acquisition_finished(folder, time.time())
+        metrics.ACQUISITIONS_FINISHED.labels(reason).inc()
+
+    for folder in idle_folders:
+
+        if folder in unfinished:
+            logging.info("last_seen=" + str(acq_activity[folder]['last_seen']))
+            logging.info("cutoff_time=" + str(cutoff_time))
+            update_acquisition_finished(folder, cutoff_time)
+            metrics.ACQUISITIONS_FINISHED.labels('idle').inc()
+
+    # evict both finished acquisitions and folders that are not unfinished acquisitions
+    # (e.g. only thumbnails or finished by other monitor)
+    for folder in list(complete_folders) + idle_folders:
+        del acq_activity[folder]
+        expected_image_counts.pop(folder, None)
+
+    # idle folders can be taken over by any monitor
+    release_folder_leases(list(complete_folders) + idle_folders)
+
+
+def get_acquisition_complete_reason(folder: str, activity: dict):
+    """
+    Returns 'end_marker' or 'expected_count' if the acquisition in folder is complete, otherwise None.
+    The end marker only counts when the dir is unchanged since it was imported (all images before the
+    marker are in db). The image count in db is only queried when new images were seen since last check
+    """
+
+    if has_end_marker(folder) and is_dir_unchanged_since_import(folder):
+        return 'end_marker'
+
+    if activity['image_count'] == activity.get('checked_count'):
+        return None
+    activity['checked_count'] = activity['image_count']
+
+    # images in db can be fewer than seen (thumbnails), but never more than expected for a complete acquisition
+    expected = get_expected_image_count(folder)
+    plate_acq_id = plate_acq_ids.get(folder)
+    if expected is None or plate_acq_id is None or activity['image_count'] < expected:
+        return None
+
+    if select_image_count(plate_acq_id) >= expected:
+        return 'expected_count'
+
+    return None
+
+
+def has_end_marker(folder: str):
+    return any(os.path.exists(os.path.join(folder, marker)) for marker in imgdb_settings.ACQ_END_MARKERS)
+
+
+def get_expected_image_count(folder: str):
+    """
+    Returns expected number of images of the acquisition in folder (cached), None if unknown
+    """
+    expected = expected_image_counts.get(folder)
+    if expected is None:
+        expected = select_expected_image_count(folder)
+        # unknown counts are not cached, layout or protocol can be added while imaging
+        if expected is not None:
+            expected_image_counts[folder] = expected
+    return expected
+
+
+def select_expected_image_count(folder: str):
+    """
+    Expected images of acquisition is plate_acquisition.expected_images if set, otherwise
+    wells (plate layout of plate barcode) x sites x channels (channel_map) x z from acquisition_protocol
+    """
+
+    conn = None
+    try:
+        query = ("SELECT pa.expected_images, pa.project, pa.name, "
+                 "  (SELECT count(*) FROM plate p JOIN plate_layout pl ON pl.layout_id = p.layout_id WHERE p.barcode = pa.plate_barcode), "
+                 "  (SELECT count(*) FROM channel_map cm WHERE cm.map_id = pa.channel_map_id) "
+                 "FROM plate_acquisition pa "
+                 "WHERE pa.folder = %s")
+
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(query, (folder,))
+        result = cursor.fetchone()
+        cursor.close()
+
+    except Exception as err:
+        logging.exception("Message")
+        raise err
+    finally:
+        put_connection(conn)
+
+    if result is None:
+        return None
+
+    expected_images, project, name, wells, channels = result
+    if expected_images:
+        return expected_images
+
+    # protocol for this speciffic plate_acquisition first, then wildcard for whole project
+    protocol = acquisition_protocols.get((project, name))
+    if protocol is None:
+        protocol = acquisition_protocols.get((project, '*'))
+
+    if protocol is None or not protocol['sites_per_well'] or wells == 0 or channels == 0:
+        return None
+
+    return wells * protocol['sites_per_well'] * channels * (protocol['z_planes'] or 1)
+
+
+def select_image_count(plate_acq_id: int):
+
+    conn = None
+    try:
+        query = ("SELECT count(*) "
+                 "FROM images "
+                 "WHERE plate_acquisition_id = %s")
+
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(query, (plate_acq_id,))
+        count = cursor.fetchone()[0]
+        cursor.close()
+
+        return count
+
+    except Exception as err:
+        logging.exception("Message")
+        raise err
+    finally:
+        put_connection(conn)
+
+def update_acquisition_finished(folder: str, timestamp: float):
+
+    logging.info("inside update_acquisition_finished, folder: " + folder)
+
+    conn = None
+    try:
+
+        query = (" UPDATE plate_acquisition "
+                 " SET finished = %s "
+                 " WHERE folder = %s")
+
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(query, (datetime.utcfromtimestamp(timestamp), folder) )
+        assert cursor.rowcount == 1, "rowcount should always be 1 for this update query"
+        cursor.close()
+        conn.commit()
+
+        # finished acquisitions get no more images, no need to keep them in memory
+        # (the folder is left out of crawling by refresh_finished_acq_folders when no late images are expected)
+        acq_file_metas.pop(plate_acq_ids.pop(folder, None), None)
+    except Exception as err:
+        logging.exception("Message")
+        raise err
+    finally:
+        put_connection(conn)
+
+
+#
+# Main import function
+#
+def import_plate_images_and_meta(plate_dir: str, images: List[str] = None):
+    """
+    Main import function
+    If images is None all image files in plate_dir are listed, otherwise only the
+    specified images (e.g. from fs_watcher events) are imported
+    """
+    for _ in iter_import_plate_images_and_meta(plate_dir, images):
+        pass
+
+
+def iter_import_plate_images_and_meta(plate_dir: str, images: List[str] = None, batch_size: int = None):
+    """
+    Same as import_plate_images_and_meta but imports max batch_size images at a time
+    and yields after each batch, so the caller can switch to another dir in between
+    """
+
+    logging.info("start import_plate_images_and_meta: " + str(plate_dir))
+
+    # images from watcher or pending queue are always live
+    backfill = False
+    if images is None:
+        # stat before listing, so files added while listing always give a new mtime
+        dir_mtime = os.stat(plate_dir).st_mtime
+        list_time = time.time()
+        all_images = get_all_image_files(plate_dir)
+        backfill = io_budget.is_backfill(dir_mtime, imgdb_settings.BACKFILL_MIN_AGE)
+    else:
+        all_images = images
+
+    # create a new list with only images not seen before
+    new_images = [img for img in all_images if not is_image_seen(img)]
+
+    # images still being written are left in pending_images and imported later
+    ready_images = select_stable_images(new_images)
+
+    if batch_size is None:
+        batch_size = max(len(ready_images), 1)
+
+    # import images (if later than latest_import_filedate)
+    for i in range(0, len(ready_images), batch_size):
+        # images can have been imported from watcher or pending queue while other dirs had their turn
+        batch = [img for img in ready_images[i:i + batch_size] if not is_image_seen(img)]
+        if len(batch) > 0:
+            add_plate_to_db(batch, backfill)
+        if i + batch_size < len(ready_images):
+            yield
+
+    # only a complete listing of dir, with all images imported, can mark it as imported
+    if images is None and len(ready_images) == len(new_images):
+        set_dir_imported(plate_dir, dir_mtime, len(all_images), list_time)
+
+    logging.info("done import_plate_images_and_meta: " + str(plate_dir))
+
+
+def select_stable_images(images: List[str]):
+    """
+    Returns the images that are completely written. An image is written when its mtime is older than
+    IMAGE_STABLE_AGE, or when size and mtime are unchanged since it was checked last time.
+    The other images are put in pending_images and checked again after a delay that doubles
+    every check, this function never waits.
+    Called from both the polling thread and the discovery stage of the import pipeline,
+    images are stat:ed outside pending_images_lock
+    """
+    global pending_images
+
+    now = time.time()
+    stable_images = []
+    for image in images:
+
+        try:
+            start_stat = time.time()
+            stat = os.stat(image)
+            # stat is a round trip to the file server, latency tells how loaded it is
+            ingest_budget.observe_read(time.time() - start_stat)
+        except FileNotFoundError:
+            # removed or renamed while uploading
+            with pending_images_lock:
+                pending_images.pop(image, None)
+            continue
+
+        size_and_mtime = (stat.st_size, stat.st_mtime)
+
+        with pending_images_lock:
+            pending = pending_images.get(image)
+
+            if pending is not None and now < pending['next_check']:
+                continue
+
+            if now - stat.st_mtime > imgdb_settings.IMAGE_STABLE_AGE or (pending is not None and pending['size_and_mtime'] == size_and_mtime):
+                pending_images.pop(image, None)
+                stable_images.append(image)
+                continue
+
+            checks = 1 if pending is None else pending['checks'] + 1
+            pending_images[image] = {'size_and_mtime': size_and_mtime,
+                                     'checks': checks,
+                                     'next_check': now + min(2 ** checks, 60)}
+
+    if len(stable_images) < len(images):
+        logging.info(f"images not completely written yet: {len(images) - len(stable_images)}")
+
+    return stable_images
+
+
+def import_due_pending_images():
+    """
+    Imports pending images that are due for a new check, grouped by dir
+    """
+    global pending_images
+
+    now = time.time()
+    due_images = dict()
+    # pending_images is also updated by the discovery stage of the import pipeline
+    with pending_images_lock:
+        for image, pending in pending_images.items():
+            if pending['next_check'] <= now:
+                due_images.setdefault(os.path.dirname(image), []).append(image)
+
+    for img_dir, images in due_images.items():
+        if is_quarantined(img_dir):
+            continue
+        import_plate_images_and_meta_or_quarantine(img_dir, images)
+
+
+def claim_folder_lease(folder: str):
+    """
+    Claims (or renews) lease on folder for this monitor, several monitors can run on the same share
+    and only the one holding the lease imports the folder. A lease that is not renewed within
+    FOLDER_LEASE_TIMEOUT (monitor died) can be claimed by any monitor.
+    Returns True if this monitor holds the lease
+    """
+    return folder in claim_folder_leases([folder])
+
+
+def claim_folder_leases(folders: List[str]):
+    """
+    Claims (or renews) leases on folders with one query, see claim_folder_lease.
+    Lease state is only changed in the polling thread.
+    Returns set of the folders this monitor holds the lease on
+    """
+
+    renew_folder_leases_if_due()
+
+    conn = None
+    try:
+        query = ("INSERT INTO folder_lease(folder, owner, expires) "
+                 "SELECT unnest(%s::text[]), %s, now() + %s * interval '1 second' "
+                 "ON CONFLICT (folder) DO UPDATE "
+                 "SET owner = EXCLUDED.owner, expires = EXCLUDED.expires "
+                 "WHERE folder_lease.owner = EXCLUDED.owner OR folder_lease.expires < now() "
+                 "RETURNING folder")
+
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(query, (list(folders), monitor_id, imgdb_settings.FOLDER_LEASE_TIMEOUT))
+        claimed = set(r[0] for r in cursor.fetchall())
+        cursor.close()
+        conn.commit()
+
+        return claimed
+
+    except Exception as err:
+        logging.exception("Message")
+        raise err
+    finally:
+        put_connection(conn)
+
+
+def renew_folder_leases_if_due():
+    """
+    Renews leases of the folders this monitor is importing or has active acquisitions in with one query,
+    at most every third of FOLDER_LEASE_TIMEOUT so leases don't expire during a long poll.
+    Any other lease of this monitor (e.g. one that failed to release) is left to expire
+    """
+    global last_lease_renewal
+
+    if time.time() - last_lease_renewal < imgdb_settings.FOLDER_LEASE_TIMEOUT / 3:
+        return
+
+    folders = list(importing_folders | set(acq_activity))
+
+    conn = None
+    try:
+        query = ("UPDATE folder_lease "
+                 "SET expires = now() + %s * interval '1 second' "
+                 "WHERE owner = %s AND folder = ANY(%s)")
+
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(query, (imgdb_settings.FOLDER_LEASE_TIMEOUT, monitor_id, folders))
+        cursor.close()
+        conn.commit()
+
+        last_lease_renewal = time.time()
+
+    except Exception as err:
+        logging.exception("Message")
+        raise err
+    finally:
+        put_connection(conn)
+
+
+def release_folder_leases(folders: List[str]):
+
+    conn = None
+    try:
+        query = ("DELETE FROM folder_lease "
+                 "WHERE folder = ANY(%s) AND owner = %s")
+
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(query, (list(folders), monitor_id))
+        cursor.close()
+        conn.commit()
+
+    except Exception as err:
+        logging.exception("Message")
+        raise err
+    finally:
+        put_connection(conn)
+
+
+def end_folder_import(folder: str):
+    """
+    Import of folder is done, its lease is only kept while the acquisition is active (in acq_activity)
+    so other monitors can take over folders this monitor has nothing left to do in
+    """
+    importing_folders.discard(folder)
+    if folder not in acq_activity:
+        release_folder_leases([folder])
+
+
+def import_plate_images_and_meta_or_quarantine(img_dir, images: List[str] = None):
+    for _ in iter_import_plate_images_and_meta_or_quarantine(img_dir, images):
+        pass
+
+
+def iter_import_plate_images_and_meta_or_quarantine(img_dir, images: List[str] = None, batch_size: int = None):
+
+    # folder is imported by other monitor
+    if not claim_folder_lease(str(img_dir)):
+        logging.debug("leased by other monitor: " + str(img_dir))
+        metrics.DIRS_PRUNED.labels('leased').inc()
+        return
+
+    metrics.DIRS_IMPORTED.inc()
+    importing_folders.add(str(img_dir))
+
+    try:
+        yield from iter_import_plate_images_and_meta(str(img_dir), images, batch_size)
+    except Exception as e:
+            logging.exception("Exception in img_dir")
+            quarantine_dir_with_exception(str(img_dir), e, traceback.format_exc())
+    else:
+        # a complete import of the dir worked, e.g. the NFS error that quarantined it is gone
+        if images is None:
+            release_from_quarantine(str(img_dir))
+        end_folder_import(str(img_dir))
+
+
+def quarantine_dir_with_exception(img_dir: str, e: Exception, traceback_text: str):
+    quarantine_dir(img_dir, f"{type(e).__name__}: {e}")
+    # any monitor can retry the dir when the quarantine is over
+    importing_folders.discard(img_dir)
+    release_folder_leases([img_dir])
+    exception_file = os.path.join(imgdb_settings.ERROR_LOG_DIR, "exceptions-last-poll.log")
+    with open(exception_file, 'a') as exc_file:
+        exc_file.write("Exception, time:" +
+                       str(datetime.today()) + "\n")
+        exc_file.write("img_dir:" + str(img_dir) + "\n")
+        exc_file.write(traceback_text)
+
+
+def iter_dir_batches(img_dir: str, batch_size: int, dir_import: dict):
+    """
+    Lists img_dir and yields import batches of max batch_size ready images (an empty batch if nothing
+    to import, so the dir is still set imported). Progress of the dir is kept in dir_import, shared
+    with the db write stage. A listing error is passed on in the batch
+    """
+
+    metrics.DIRS_IMPORTED.inc()
+
+    try:
+        # stat before listing, so files added while listing always give a new mtime
+        dir_mtime = os.stat(img_dir).st_mtime
+        list_time = time.time()
+        all_images = get_all_image_files(img_dir)
+
+        # create a new list with only images not seen before
+        new_images = [img for img in all_images if not is_image_seen(img)]
+
+        # images still being written are left in pending_images and imported later
+        ready_images = select_stable_images(new_images)
+    except Exception as e:
+        logging.exception("Exception in img_dir")
+        dir_import['batches'] = 1
+        dir_import['done'] = True
+        yield {'dir_import': dir_import, 'images': [], 'backfill': False, 'error': e, 'traceback': traceback.format_exc()}
+        return
+
+    # only a complete listing of dir, with all images imported, can mark it as imported
+    dir_import['complete_listing'] = len(ready_images) == len(new_images)
+    dir_import['dir_mtime'] = dir_mtime
+    dir_import['list_time'] = list_time
+    dir_import['image_count'] = len(all_images)
+    backfill = io_budget.is_backfill(dir_mtime, imgdb_settings.BACKFILL_MIN_AGE)
+
+    batches = [ready_images[i:i + batch_size] for i in range(0, len(ready_images), batch_size)]
+    if len(batches) == 0:
+        batches = [[]]
+
+    for i, batch in enumerate(batches):
+        if dir_import['failed']:
+            return
+        # images can have been imported from watcher or pending queue while other dirs had their turn
+        batch = [img for img in batch if not is_image_seen(img)]
+        dir_import['batches'] += 1
+        dir_import['done'] = i == len(batches) - 1
+        yield {'dir_import': dir_import, 'images': batch, 'backfill': backfill, 'error': None}
+
+
+def iter_import_batches(ordered_dirs, batch_size: int, dir_imports: dict):
+    """
+    Discovery stage of the import pipeline (pipeline source thread):
+    batches of the dirs in ordered_dirs, round robin with one batch per dir and turn.
+    Dirs leased by other monitors (skipped in dir_imports) are not listed
+    """
+    dir_batches = deque()
+    for img_dir in ordered_dirs:
+        if not dir_imports[img_dir]['skipped']:
+            dir_batches.append(iter_dir_batches(str(img_dir), batch_size, dir_imports[img_dir]))
+
+    while len(dir_batches) > 0:
+        batches = dir_batches.popleft()
+        try:
+            batch = next(batches)
+        except StopIteration:
+            continue
+        # more batches left in this dir, back of the line
+        dir_batches.append(batches)
+        yield batch
+
+
+def parse_import_batch(batch: dict):
+    # parse stage of import pipeline
+    if batch['error'] is None and len(batch['images']) > 0:
+        batch['new_img_metas'] = parse_new_images(batch['images'])
+    else:
+        batch['new_img_metas'] = []
+    return batch
+
+
+def read_import_batch_file_metas(batch: dict):
+    # tiff meta stage of import pipeline
+    read_file_metas(batch['new_img_metas'], batch['backfill'])
+    return batch
+
+
+def write_import_batch(batch: dict, error: Exception = None, traceback_text: str = None):
+    """
+    DB write stage of import pipeline (polling thread), a failed batch quarantines its dir.
+    When all batches of a dir are written, the dir is set imported
+    """
+    dir_import = batch['dir_import']
+    img_dir = dir_import['img_dir']
+
+    if dir_import['failed']:
+        return
+
+    if error is None:
+        error = batch['error']
+        traceback_text = batch.get('traceback')
+
+    if error is None:
+        try:
+            write_images(batch['new_img_metas'], batch['images'])
+        except Exception as e:
+            logging.exception("Exception in img_dir")
+            error = e
+            traceback_text = traceback.format_exc()
+
+    if error is not None:
+        dir_import['failed'] = True
+        quarantine_dir_with_exception(img_dir, error, traceback_text)
+        return
+
+    dir_import['written'] += 1
+    if dir_import['done'] and dir_import['written'] == dir_import['batches']:
+        if dir_import['complete_listing']:
+            set_dir_imported(img_dir, dir_import['dir_mtime'], dir_import['image_count'], dir_import['list_time'])
+        # a complete import of the dir worked, e.g. the NFS error that quarantined it is gone
+        release_from_quarantine(img_dir)
+        end_folder_import(img_dir)
+        logging.info("done import_plate_images_and_meta: " + img_dir)
+
+
+def import_img_dirs_pipelined(img_dirs, batch_size: int, time_budget: float, watcher=None):
+    """
+    Imports img_dirs newest (dir mtime) first, round robin with max batch_size images per dir and turn,
+    so a backfill of a large dir can't hold back images of live acquisitions.
+    The import is a pipeline with bounded queues: discovery (dir listing) -> filename parsing -> tiff meta -> db write,
+    so listings, tiff meta reads and db writes of different batches overlap.
+    Between batches images from watched dirs and due pending images are imported.
+    Stops taking new batches after time_budget sec.
+    Leases are claimed and the db write stage changes monitor state in this thread, the discovery
+    stage only updates pending_images (with pending_images_lock) and the dir_import of its dirs.
+    Returns the dirs that are not completely imported and the dirs leased by other monitors (both continued next poll)
+    """
+
+    def dir_mtime_no_raise(path):
+        try:
+            return get_dir_mtime(str(path))
+        except OSError:
+            return 0
+
+    ordered_dirs = sorted(img_dirs, key=dir_mtime_no_raise, reverse=True)
+    if len(ordered_dirs) == 0:
+        return set(), set()
+
+    import_pipeline = pipeline.Pipeline('import',
+                                        [pipeline.Stage('parse', parse_import_batch, imgdb_settings.IMPORT_PARSE_WORKERS, imgdb_settings.IMPORT_QUEUE_SIZE),
+                                         pipeline.Stage('tiff_meta', read_import_batch_file_metas, imgdb_settings.IMPORT_META_WORKERS, imgdb_settings.IMPORT_QUEUE_SIZE)],
+                                        source_name='discovery',
+                                        sink_name='db_write',
+                                        weight=lambda batch: len(batch['images']),
+                                        output_queue_size=imgdb_settings.IMPORT_QUEUE_SIZE)
+
+    # folders are imported by other monitors if they hold the lease
+    claimed_dirs = claim_folder_leases([str(img_dir) for img_dir in ordered_dirs])
+    importing_folders.update(claimed_dirs)
+
+    dir_imports = dict()
+    for img_dir in ordered_dirs:
+        skipped = str(img_dir) not in claimed_dirs
+        if skipped:
+            logging.debug("leased by other monitor: " + str(img_dir))
+            metrics.DIRS_PRUNED.labels('leased').inc()
+        dir_imports[img_dir] = {'img_dir': str(img_dir), 'batches': 0, 'written': 0, 'done': False, 'failed': False, 'skipped': skipped}
+
+    deadline = time.time() + time_budget
+    for batch in import_pipeline.run(iter_import_batches(ordered_dirs, batch_size, dir_imports), idle_timeout=1):
+
+        if isinstance(batch, pipeline.StageFailure):
+            if batch.item is None:
+                # discovery itself failed, dirs not started are continued next poll
+                continue
+            start = time.time()
+            write_import_batch(batch.item, batch.error, batch.traceback)
+            import_pipeline.sink_done(batch.item, time.time() - start)
+        elif batch is not None:
+            start = time.time()
+            write_import_batch(batch)
+            import_pipeline.sink_done(batch, time.time() - start)
+
+        # Between batches (or while waiting for one) images from watched dirs and due pending images are imported
+        if watcher is not None:
+            import_watched_images(watcher, 0)
+        import_due_pending_images()
+
+        # leases claimed before the pipeline started must not expire during a long import
+        renew_folder_leases_if_due()
+
+        # batches already in the pipeline are still written
+        if time.time() > deadline and not import_pipeline.is_stopped():
+            import_pipeline.stop()
+
+    deferred_dirs = set()
+    leased_dirs = set()
+    for img_dir in ordered_dirs:
+        dir_import = dir_imports[img_dir]
+        if dir_import['skipped']:
+            # imported by the monitor holding the lease, retried in case that monitor dies
+            leased_dirs.add(img_dir)
+        elif not (dir_import['failed'] or (dir_import['done'] and dir_import['written'] == dir_import['batches'])):
+            deferred_dirs.add(img_dir)
+            # lease is claimed again when the dir is continued
+            end_folder_import(str(img_dir))
+
+    if len(deferred_dirs) > 0:
+        logging.info(f"import time budget used, dirs continued next poll: {len(deferred_dirs)}")
+    if len(leased_dirs) > 0:
+        logging.info(f"dirs leased by other monitors, retried next poll: {len(leased_dirs)}")
+
+    return deferred_dirs, leased_dirs
+
+
+def create_watcher(proj_root_dirs: List[str]):
+    """
+    Sets up inotify watches on all root dirs on local filesystems.
+    Returns the watcher and list of root dirs that still have to be polled
+    (network filesystems, where inotify doesn't see writes from other hosts)
+    """
+    watcher = fs_watcher.ImageDirWatcher(IMAGE_EXTENSIONS, EXCLUDED_EXTENSIONS)
+    polled_root_dirs = []
+    for root_dir in proj_root_dirs:
+
+        if not os.path.exists(root_dir) or fs_watcher.is_network_fs(root_dir):
+            logging.info("Root dir will be polled: " + str(root_dir))
+            polled_root_dirs.append(root_dir)
+            continue
+
+        try:
+            watcher.add_tree(root_dir)
+            logging.info("Root dir watched with inotify: " + str(root_dir))
+        except OSError as e:
+            # most likely out of watches (fs.inotify.max_user_watches)
+            logging.error(f"Could not watch root dir, will be polled instead: {root_dir}, error: {e}")
+            polled_root_dirs.append(root_dir)
+
+    return watcher, polled_root_dirs
+
+
+def wait_for_watched_images(watcher, wait_time):
+    """
+    Instead of sleeping between polls, import images from watched dirs as soon as they are written
+    """
+    deadline = time.time() + wait_time
+    while time.time() < deadline:
+        import_watched_images(watcher, min(deadline - time.time(), 1))
+        import_due_pending_images()
+
+
+def import_watched_images(watcher, timeout):
+    """
+    Imports images reported by watcher within timeout sec (0 = only already queued events)
+    """
+    new_images = watcher.read_new_images(timeout)
+
+    for img_dir, images in new_images.items():
+        if is_quarantined(img_dir):
+            continue
+        images = [img for img in images if not is_image_seen(img)]
+        if len(images) > 0:
+            import_plate_images_and_meta_or_quarantine(img_dir, images)
+
+
+def wait_for_pending_images(wait_time):
+    """
+    Sleeps wait_time, pending images are imported when they are due instead of at next poll
+    """
+    deadline = time.time() + wait_time
+    while time.time() < deadline:
+        time.sleep(max(min(deadline - time.time(), 1), 0))
+        import_due_pending_images()
+
+
+# folders of finished acquisitions, refreshed every poll from finished_acq_watermark (see refresh_finished_acq_folders)
+finished_acq_folders: set[str] = set()
+finished_acq_watermark: datetime = None
+finished_acq_last_full_reload = 0.0
+FINISHED_FULL_RELOAD_INTERVAL = 3600 # sec
+
+# directories throwing error when processed with path as key, persisted in table dir_quarantine
+quarantine: dict[str, dict] = dict()
+quarantine_changed: set[str] = set()
+quarantine_deleted: set[str] = set()
+
+# start time of last completed poll with root dir as key, persisted in table poll_checkpoint
+poll_checkpoints: dict[str, float] = dict()
+
+# images inserted since start
+images_inserted_count = 0
+
+# rate limits and latency backoff of backfill reads
+ingest_budget = io_budget.from_settings(imgdb_settings)
+
+# unique per process, owner of folder leases in db
+monitor_id = f"{socket.gethostname()}:{os.getpid()}"
+last_lease_renewal = 0.0
+# folders with a lease claimed by this monitor and an import in progress
+importing_folders: set[str] = set()
+
+# Activity of acquisitions with images seen by this monitor, folder as key and
+# dict with last_seen timestamp, image_count and set of seen filenames as value
+acq_activity: dict[str, dict] = dict()
+
+# images not completely written yet, path as key and size, mtime and time of next check as value,
+# updated from both the polling thread and the import pipeline discovery thread (see select_stable_images)
+pending_images: dict[str, dict] = dict()
+pending_images_lock = threading.Lock()
+
+# plate_acquisition id with folder as key, preloaded with all unfinished acquisitions
+plate_acq_ids: dict[str, int] = dict()
+
+# interned tiff header sets, list of (image_file_meta id, file_meta) with plate_acquisition id as key,
+# loaded from db the first time an acquisition gets images
+acq_file_metas: dict[int, list] = dict()
+
+# channel_map_mapping table with (project, plate_acquisition_name) as key, reloaded every poll
+channel_map_mappings: dict[tuple, int] = dict()
+
+# acquisition_protocol table with (project, plate_acquisition_name) as key, reloaded every poll
+acquisition_protocols: dict[tuple, dict] = dict()
+
+# expected number of images with folder of unfinished acquisition as key (only known counts)
+expected_image_counts: dict[str, int] = dict()
 
-        logging.info(f"len(img_dirs): {len(img_dirs)}")
+# Directory scan state (mtime, subdirs, import state) with dir path as key, persisted in table dir_scan_state
+scan_state: dict[str, dict] = dict()
+scan_state_changed: set[str] = set()
+scan_state_deleted: set[str] = set()
+# dirs stat:ed by the scanner in current poll of a root dir
+scan_state_visited: set[str] = set()
 
-        # remove blacklisted from list(Directories with unparsable images that were found since start of program)
+
+def read_manifest(manifest_path: str):
+    """
+    Returns image entries of manifest as list of dicts with path, size and mtime (None when not in manifest).
+    The manifest has one file per line: path[<tab>size[<tab>mtime]], lines starting with # are skipped, e.g.
+    find /share/mikro/... -type f -printf '%p\\t%s\\t%T@\\n' > manifest.tsv
+    Entries are sorted by mtime when all have one (arrival order)
+    """
+    entries = []
+    with open(manifest_path) as manifest:
+        for line in manifest:
+            line = line.rstrip('\n')
+            if not line or line.startswith('#'):
+                continue
+
+            fields = line.split('\t')
+            path = os.path.abspath(fields[0])
+            if not path.lower().endswith( IMAGE_EXTENSIONS ) or path.lower().endswith( EXCLUDED_EXTENSIONS ):
+                continue
+
+            size = int(fields[1]) if len(fields) > 1 and fields[1] else None
+            mtime = float(fields[2]) if len(fields) > 2 and fields[2] else None
+            entries.append({'path': path, 'size': size, 'mtime': mtime})
+
+    if len(entries) > 0 and all(entry['mtime'] is not None for entry in entries):
+        entries.sort(key=lambda entry: entry['mtime'])
+
+    return entries
+
+
+def replay_manifest(manifest_path: str, speed: float = 0, batch_size: int = imgdb_settings.IMPORT_BATCH_SIZE, metrics_port=0):
+    """
+    Imports the images listed in a manifest instead of walking the filesystem, with the same
+    parser, bulk insert and thumb jobs as a poll. With speed > 0 images are imported at their
+    mtime relative to the first image, speeded up speed times (replay of production arrivals),
+    with speed 0 all images are imported as fast as possible (bulk registering).
+    Images are imported in batches of max batch_size images from the same dir.
+    Returns throughput as dict
+    """
+    global plate_acq_ids, channel_map_mappings, acquisition_protocols
+
+    metrics.start_metrics_server(metrics_port)
+
+    entries = read_manifest(manifest_path)
+    logging.info(f"manifest: {manifest_path}, images: {len(entries)}, speed: {speed}")
+
+    # without replay timing, all images of a dir are imported together in as few batches as possible
+    if speed <= 0:
+        entries.sort(key=lambda entry: os.path.dirname(entry['path']))
+
+    plate_acq_ids = select_unfinished_plate_acq_ids()
+    channel_map_mappings = select_channel_map_mappings()
+    acquisition_protocols = select_acquisition_protocols()
+
+    start = time.time()
+    inserted_before = images_inserted_count
+    first_mtime = entries[0]['mtime'] if len(entries) > 0 else None
+    failed_images = 0
+
+    batch = []
+    def import_batch():
+        nonlocal failed_images
+        if len(batch) == 0:
+            return
+        try:
+            # replayed images are never from a live acquisition
+            add_plate_to_db(batch, backfill=True)
+        except Exception as e:
+            # a bad dir should not stop the replay, report it at the end
+            logging.exception(f"Exception importing manifest batch of dir: {os.path.dirname(batch[0])}")
+            failed_images += len(batch)
+        batch.clear()
+
+    for entry in entries:
+
+        # wait until the image arrives in replay time
+        if speed > 0 and first_mtime is not None and entry['mtime'] is not None:
+            due = start + (entry['mtime'] - first_mtime) / speed
+            if due > time.time():
+                import_batch()
+                time.sleep(max(due - time.time(), 0))
+
+        if len(batch) >= batch_size or (len(batch) > 0 and os.path.dirname(batch[0]) != os.path.dirname(entry['path'])):
+            import_batch()
+
+        batch.append(entry['path'])
+
+    import_batch()
+
+    elapsed = time.time() - start
+    inserted = images_inserted_count - inserted_before
+    total_bytes = sum(entry['size'] for entry in entries if entry['size'] is not None)
+    throughput = {'images': len(entries),
+                  'inserted': inserted,
+                  'failed': failed_images,
+                  'elapsed_sec': round(elapsed, 3),
+                  'images_per_sec': round(len(entries) / elapsed, 1) if elapsed > 0 else None,
+                  'inserted_per_sec': round(inserted / elapsed, 1) if elapsed > 0 else None,
+                  'mb_per_sec': round(total_bytes / 1e6 / elapsed, 1) if elapsed > 0 and total_bytes > 0 else None}
+
+    metrics.IMAGES_PER_SECOND.set(throughput['inserted_per_sec'] or 0)
+    logging.info(f"manifest replay done: {json.dumps(throughput)}")
+
+    return throughput
+
+
+def get_root_policies(proj_root_dirs: List[str], root_policies: dict, poll_interval, poll_dirs_margin_days, crawl_concurrency):
+    """
+    Returns polling policy (poll_interval, poll_dirs_margin_days, crawl_concurrency and enabled)
+    with root dir as key, settings of a root in root_policies (ROOT_POLICIES) override the defaults
+    """
+    root_policies = {os.path.normpath(root_dir): policy for root_dir, policy in root_policies.items()}
+    for root_dir in set(root_policies) - set(os.path.normpath(root_dir) for root_dir in proj_root_dirs):
+        logging.warning(f"policy for root dir not in proj_root_dirs is ignored: {root_dir}")
+
+    policies = dict()
+    for root_dir in proj_root_dirs:
+        policy = {'poll_interval': float(poll_interval),
+                  'poll_dirs_margin_days': float(poll_dirs_margin_days),
+                  'crawl_concurrency': int(crawl_concurrency),
+                  'enabled': True}
+        policy.update(root_policies.get(os.path.normpath(root_dir), {}))
+        policies[root_dir] = policy
+
+    return policies
+
+
+def select_root_img_dirs(root_dir: str, policy: dict, crawl_results: list, is_initial_poll: bool, exhaustive_initial_poll: bool,
+                         deferred_img_dirs: set):
+    """
+    Applies crawl results of root_dir to scan_state.
+    Returns its image dirs that are not finished, old, unchanged since import or quarantined
+    """
+
+    # old dir cutoff is per root dir, roots can have different checkpoints after restart
+    old_dir_cutoff = get_old_dir_cutoff(root_dir, is_initial_poll, exhaustive_initial_poll, policy['poll_dirs_margin_days'])
+    img_dirs = set()
+    for path, mtime, listing in crawl_results:
+        img_dirs.update(apply_scan_result(path, mtime, listing))
+
+    # dirs not completely imported last poll (import time budget or leased by other monitor)
+    # are continued even if old or unchanged
+    img_dirs |= deferred_img_dirs
+
+    logging.info(f"root dir: {root_dir}, len(img_dirs): {len(img_dirs)}")
+
+    # remove finished acquisitions the crawler didn't stop at (single_images dirs and dirs deferred from last poll)
+    for path in set(img_dirs):
+        if str(path) in finished_acq_folders:
+            img_dirs.remove(path)
+            metrics.DIRS_PRUNED.labels('finished').inc()
+            #logging.info("removed because finished: " + str(path))
+
+    logging.info(f"len(img_dirs): {len(img_dirs)}")
+
+    # remove old dirs (cutoff is absolute time, compared to dir mtime)
+    for path in set(img_dirs):
+        if path in deferred_img_dirs:
+            continue
+        if get_dir_mtime(str(path)) < old_dir_cutoff:
+            img_dirs.remove(path)
+            metrics.DIRS_PRUNED.labels('old').inc()
+            #logging.info("removed because old: " + str(path))
+
+    logging.info(f"len(img_dirs): {len(img_dirs)}")
+
+    # remove dirs where all images are imported and no entries changed since then
+    # (unless exhaustive initial poll) to avoid listing all files in them again
+    if not (is_initial_poll and exhaustive_initial_poll):
         for path in set(img_dirs):
-            if str(path) in blacklist:
+            if path not in deferred_img_dirs and is_dir_unchanged_since_import(str(path)):
                 img_dirs.remove(path)
-                logging.info("removed because blacklisted: " + str(path))
+                metrics.DIRS_PRUNED.labels('unchanged').inc()
+                # acq_activity is empty after a restart, add dir with time of last import
+                # so finished-detection still works for the acquisition
+                state = scan_state[str(path)]
+                acq_activity.setdefault(str(path), {'last_seen': state['imported'],
+                                                    'image_count': state['entry_count'],
+                                                    'filenames': set()})
+
+    logging.info(f"len(img_dirs): {len(img_dirs)}")
+
+    # remove quarantined (Directories with unparsable images or errors), until their next retry
+    for path in set(img_dirs):
+        if is_quarantined(str(path)):
+            img_dirs.remove(path)
+            metrics.DIRS_PRUNED.labels('quarantined').inc()
+            logging.debug("removed because quarantined: " + str(path))
+
+    logging.info(f"root dir: {root_dir}, img dirs left: " + str(img_dirs))
+
+    return img_dirs
+
+
+
+def poll_root_dirs(crawls: dict, policies: dict, is_initial_poll: dict, exhaustive_initial_poll: bool,
+                   deferred_img_dirs: dict, import_batch_size: int, import_time_budget: float, watcher=None):
+    """
+    Imports the image dirs of all roots with a finished crawl in one import, newest dir first over all
+    roots, so a root with a large backlog doesn't hold back the other roots.
+    crawls has root dir as key and (crawl results, scan start, crawl failed) as value.
+    If the crawl of a root failed only its deferred dirs are imported and its poll checkpoint is kept.
+    Returns dict with root dir as key and the img dirs left for next poll of the root as value
+    (import time budget used or leased by other monitor). Dirs leased by other monitors are owned
+    by them and don't hold back the poll checkpoint
+    """
+
+    # mtimes of dirs visited in these crawls are used instead of another stat
+    scan_state_visited.clear()
+
+    root_img_dirs = dict()
+    for root_dir, (crawl_results, scan_start, crawl_failed) in crawls.items():
+        root_img_dirs[root_dir] = select_root_img_dirs(root_dir, policies[root_dir], crawl_results, is_initial_poll[root_dir],
+                                                       exhaustive_initial_poll, deferred_img_dirs[root_dir])
 
-        logging.info(f"img dirs left: " + str(img_dirs))
+    metrics.DIRS_SCANNED.inc(len(scan_state_visited))
+
+    # Import images in imagedirs, newest first and time sliced between dirs
+    images_inserted_before = images_inserted_count
+    start_import = time.time()
+    deferred_dirs, leased_dirs = import_img_dirs_pipelined(set().union(*root_img_dirs.values()), import_batch_size, import_time_budget, watcher)
+
+    save_scan_state_changes()
+    save_quarantine_changes()
+
+    root_left_img_dirs = dict()
+    for root_dir, (crawl_results, scan_start, crawl_failed) in crawls.items():
+        root_deferred_dirs = root_img_dirs[root_dir] & deferred_dirs
+        root_left_img_dirs[root_dir] = root_deferred_dirs | (root_img_dirs[root_dir] & leased_dirs)
+
+        # root is complete up to start of its scan (unless the crawl failed or some dirs are left for next poll,
+        # dirs leased by other monitors are owned by them)
+        if crawl_failed:
+            logging.warning(f"crawl of root dir failed, poll checkpoint not saved: {root_dir}")
+        elif len(root_deferred_dirs) == 0:
+            save_poll_checkpoints([root_dir], scan_start)
+
+        elapsed = time.time() - scan_start
+        metrics.POLL_DURATION.observe(elapsed)
+        logging.info(f"root dir: {root_dir}, elapsed: {elapsed} sek")
+
+    metrics.IMAGES_PER_SECOND.set((images_inserted_count - images_inserted_before) / max(time.time() - start_import, 0.001))
+
+    return root_left_img_dirs
+
+
+def polling_loop(poll_dirs_margin_days, latest_file_change_margin, sleep_time, proj_root_dirs, exhaustive_initial_poll, continuous_polling, watch_mode='poll', metrics_port=0,
+                 import_batch_size=imgdb_settings.IMPORT_BATCH_SIZE, import_time_budget=imgdb_settings.IMPORT_TIME_BUDGET,
+                 crawl_concurrency=imgdb_settings.CRAWL_CONCURRENCY, root_policies=imgdb_settings.ROOT_POLICIES):
+    """
+    Every root dir has its own schedule (policy from root_policies, default from the other args).
+    A root is crawled in its own root scan thread when it is due, so a slow mount never delays the other
+    crawls. The image dirs of all roots with a finished crawl are imported together in this thread,
+    newest dir first over all roots.
+    Finished-detection, queue metrics and pending images are handled every sleep_time in between
+    """
+
+    global acq_activity, quarantine, scan_state, plate_acq_ids, channel_map_mappings, acquisition_protocols, poll_checkpoints
+
+    logging.info("proj_root_dirs: " + str(proj_root_dirs))
+    logging.info("monitor_id: " + monitor_id)
+
+    metrics.start_metrics_server(metrics_port)
+
+    policies = get_root_policies(proj_root_dirs, root_policies, sleep_time, poll_dirs_margin_days, crawl_concurrency)
+    root_dirs = [root_dir for root_dir, policy in policies.items() if policy['enabled']]
+    logging.info(f"root dir policies: {policies}")
+
+    scan_state = select_scan_state()
+    logging.info(f"len(scan_state): {len(scan_state)}")
+
+    plate_acq_ids = select_unfinished_plate_acq_ids()
+    logging.info(f"len(plate_acq_ids): {len(plate_acq_ids)}")
+
+    quarantine = select_quarantine()
+    logging.info(f"len(quarantine): {len(quarantine)}")
+
+    poll_checkpoints = select_poll_checkpoints()
+    logging.info(f"poll_checkpoints: {poll_checkpoints}")
+
+    # gauges read current values of module globals when scraped
+    metrics.PENDING_IMAGES.set_function(lambda: len(pending_images))
+    metrics.ACTIVE_ACQUISITIONS.set_function(lambda: len(acq_activity))
+    metrics.QUARANTINED_DIRS.set_function(lambda: len(quarantine))
+
+    # With watch_mode inotify, local root dirs are only walked in initial poll, after that
+    # new images are imported from inotify events. Watches are added before initial poll
+    # so no images are missed in between
+    watcher = None
+    watched_root_dirs = []
+    if watch_mode == 'inotify':
+        watcher, polled_root_dirs = create_watcher(root_dirs)
+        watched_root_dirs = [root_dir for root_dir in root_dirs if root_dir not in polled_root_dirs]
+
+    next_poll = {root_dir: 0.0 for root_dir in root_dirs}
+    # a root stays in initial poll until it has been crawled without failure
+    is_initial_poll = {root_dir: True for root_dir in root_dirs}
+    failed_root_dirs = set()
+    # img dirs left when import time budget of last poll of root was used
+    deferred_img_dirs = {root_dir: set() for root_dir in root_dirs}
+    # root dir as key and (future, scan start) of running crawl as value
+    root_scans = dict()
+    scan_executor = ThreadPoolExecutor(max_workers=max(len(root_dirs), 1), thread_name_prefix='root-scan')
+    next_housekeeping = time.time() + float(sleep_time)
+
+    while True:
+
+        now = time.time()
+
+        # events were lost, watched roots are walked again to find the images written meanwhile
+        if watcher is not None and watcher.take_overflow():
+            for root_dir in watched_root_dirs:
+                next_poll[root_dir] = min(next_poll[root_dir], now)
+
+        # start crawl of roots that are due
+        due_root_dirs = [root_dir for root_dir in root_dirs if root_dir not in root_scans and next_poll[root_dir] <= now]
+        if len(due_root_dirs) > 0:
+            # one query per poll, so changes to the mapping are picked up without restart
+            channel_map_mappings = select_channel_map_mappings()
+            acquisition_protocols = select_acquisition_protocols()
+            # crawler stops at finished acquisitions
+            refresh_finished_acq_folders(latest_file_change_margin)
+
+        for root_dir in due_root_dirs:
+            logging.info(f"Starting new poll of root dir: {root_dir}, {datetime.today()}")
+            future = scan_executor.submit(crawl_root_dir, root_dir, policies[root_dir]['crawl_concurrency'])
+            root_scans[root_dir] = (future, now)
+
+        # roots with finished crawl are imported together
+        crawls = dict()
+        for root_dir, (future, scan_start) in list(root_scans.items()):
+            if not future.done():
+                continue
+            del root_scans[root_dir]
 
-        # Import images in imagedirs
-        for img_dir in img_dirs:
             try:
-                import_plate_images_and_meta(str(img_dir))
+                crawl_results = future.result()
             except Exception as e:
-                    logging.exception("Exception in img_dir")
-                    # add dir to blacklist
-                    logging.info("Add to blacklist img_dir: " + str(img_dir))
-                    blacklist.append(str(img_dir))
-                    exception_file = os.path.join(imgdb_settings.ERROR_LOG_DIR, "exceptions-last-poll.log")
-                    with open(exception_file, 'a') as exc_file:
-                        exc_file.write("Exception, time:" +
-                                       str(datetime.today()) + "\n")
-                        exc_file.write("img_dir:" + str(img_dir) + "\n")
-                        exc_file.write(traceback.format_exc())
-
-
-        # If time > 10 min (default cutpoff_time) since last uploaded from unfinished plate_acquisitions
-        # If so update plate_acq to finished
-        update_finished_plate_acquisitions(cutoff_time)
-
-        # If latest processed file was longer ago than cutofftime,
-        # clear processed dict (mainly to release memory)
-        clear_processed = False
-        for img_path in reversed(processed):
-            proc_time = processed[img_path]
-            if proc_time < cutoff_time:
-                logging.info("clear processed dict")
-                clear_processed = True
-            # Only check the last
-            break
-        if clear_processed:
-            processed.clear()
+                # e.g. a hanging share, other roots are still polled
+                logging.exception(f"Could not crawl root dir: {root_dir}")
+                crawl_results = None
+
+            crawls[root_dir] = (crawl_results or [], scan_start, crawl_results is None)
 
-        logging.info("elapsed: " + str(time.time() - start_loop) + " sek")
+        polled_root_dirs = []
+        if len(crawls) > 0:
+            left_img_dirs = poll_root_dirs(crawls, policies, is_initial_poll, exhaustive_initial_poll,
+                                           deferred_img_dirs, import_batch_size, import_time_budget, watcher)
+
+        for root_dir, (crawl_results, scan_start, crawl_failed) in crawls.items():
+            deferred_img_dirs[root_dir] = left_img_dirs[root_dir]
+            if crawl_failed:
+                failed_root_dirs.add(root_dir)
+            else:
+                failed_root_dirs.discard(root_dir)
+                is_initial_poll[root_dir] = False
+                polled_root_dirs.append(root_dir)
+
+            # watched roots are only walked in initial poll (unless it failed or some dirs are left)
+            if root_dir in watched_root_dirs and not crawl_failed and len(deferred_img_dirs[root_dir]) == 0:
+                next_poll[root_dir] = float('inf')
+            else:
+                next_poll[root_dir] = scan_start + policies[root_dir]['poll_interval']
+            logging.info(f"next poll of root dir: {root_dir} in {next_poll[root_dir] - time.time()} sek")
 
-        # dump blacklist in log dir
-        if blacklist:
-            logfile = os.path.join(imgdb_settings.ERROR_LOG_DIR, "blacklist.json")
-            with open(logfile, 'w') as filehandle:
-                json.dump(blacklist, filehandle)
+        if len(polled_root_dirs) > 0 or now >= next_housekeeping:
+            next_housekeeping = now + float(sleep_time)
 
-        # Sleep until next polling action
-        is_initial_poll = False
-        logging.info(f"Going to sleep for: {sleep_time} sek")
-        logging.info("")
-        time.sleep(sleep_time)
+            # watched roots are kept up to date by inotify between walks
+            up_to_date_root_dirs = [root_dir for root_dir in watched_root_dirs if next_poll[root_dir] == float('inf')]
+            if len(up_to_date_root_dirs) > 0:
+                save_poll_checkpoints(up_to_date_root_dirs, now)
 
-        # TODO could skip sleeping if images were inserted... but difficult then with 2 hour margin (all files would be tried again)
+            # If time > 10 min (default cutpoff_time) since last uploaded from unfinished plate_acquisitions
+            # If so update plate_acq to finished
+            update_finished_plate_acquisitions(time.time() - latest_file_change_margin)
 
-        if continuous_polling != True:
+            # leases of active acquisitions don't expire while no new images are imported
+            renew_folder_leases_if_due()
+
+            logging.info(f"len(acq_activity): {len(acq_activity)}")
+
+            update_queue_metrics()
+
+        # without continuous polling every root is crawled once, a failed crawl is not retried
+        if continuous_polling != True and not any(is_initial_poll[root_dir] and root_dir not in failed_root_dirs for root_dir in root_dirs):
             break
 
+        # Sleep until next root is due, while crawls are running check for finished ones every sec
+        wake_up = min([next_poll[root_dir] for root_dir in root_dirs if root_dir not in root_scans] + [next_housekeeping])
+        wait_time = max(wake_up - time.time(), 0)
+        if len(root_scans) > 0:
+            wait_time = min(wait_time, 1)
+
+        if watcher is not None:
+            wait_for_watched_images(watcher, wait_time)
+        else:
+            wait_for_pending_images(wait_time)
+
+    scan_executor.shutdown(wait=False)
+
 #
 #  Main entry for script
 #
@@ -679,6 +2414,22 @@ try:
                         default=imgdb_settings.EXHAUSTIVE_INITIAL_POLL)
     parser.add_argument('-lfcm', '--latest-file-change-margin', help='Description for xxx argument',
                         default=imgdb_settings.LATEST_FILE_CHANGE_MARGIN)
+    parser.add_argument('-wm', '--watch-mode', help='poll: walk all root dirs every poll, inotify: watch root dirs on local filesystems and only poll network filesystems',
+                        choices=['poll', 'inotify'], default=imgdb_settings.WATCH_MODE)
+    parser.add_argument('-mp', '--metrics-port', help='Port of Prometheus metrics endpoint, 0 to disable',
+                        type=int, default=imgdb_settings.METRICS_PORT)
+    parser.add_argument('-ibs', '--import-batch-size', help='Max images imported from one dir before next dir gets its turn',
+                        type=int, default=imgdb_settings.IMPORT_BATCH_SIZE)
+    parser.add_argument('-itb', '--import-time-budget', help='Max seconds of importing per poll, remaining dirs are continued next poll',
+                        type=float, default=imgdb_settings.IMPORT_TIME_BUDGET)
+    parser.add_argument('-cc', '--crawl-concurrency', help='Max dirs listed in parallel when crawling root dirs on network filesystems',
+                        type=int, default=imgdb_settings.CRAWL_CONCURRENCY)
+    parser.add_argument('-rp', '--root-policies', help='JSON with root dir as key and dict with poll_interval, poll_dirs_margin_days, crawl_concurrency and enabled as value',
+                        type=json.loads, default=imgdb_settings.ROOT_POLICIES)
+    parser.add_argument('-mf', '--manifest', help='Import the images listed in manifest file (path[<tab>size[<tab>mtime]] per line) instead of polling root dirs',
+                        default=None)
+    parser.add_argument('-rs', '--replay-speed', help='With --manifest: import images at their mtime speeded up this many times, 0 imports all at once',
+                        type=float, default=0)
     # parser.add_argument('-ll', '--log-level', help='Description for xxx argument',
     #                    default=imgdb_settings.LOG_LEVEL)
 
@@ -686,12 +2437,21 @@ try:
 
     logging.debug(args)
 
-    polling_loop(args.poll_dirs_margin_days,
-                 args.latest_file_change_margin,
-                 args.poll_interval,
-                 args.proj_root_dirs,
-                 args.exhaustive_initial_poll,
-                 args.continuous_polling)
+    if args.manifest is not None:
+        replay_manifest(args.manifest, args.replay_speed, args.import_batch_size, args.metrics_port)
+    else:
+        polling_loop(args.poll_dirs_margin_days,
+                     args.latest_file_change_margin,
+                     args.poll_interval,
+                     args.proj_root_dirs,
+                     args.exhaustive_initial_poll,
+                     args.continuous_polling,
+                     args.watch_mode,
+                     args.metrics_port,
+                     args.import_batch_size,
+                     args.import_time_budget,
+                     args.crawl_concurrency,
+                     args.root_policies)
 
 except Exception as e:
     print(traceback.format_exc())
@@ -17,6 +17,7 @@ from datetime import datetime, timedelta
 from filenames import filename_parser
 from image_tools import makeThumb
 from image_tools import read_tiff_info
+import dir_crawler
 import settings as imgdb_settings
 
 __connection_pool = None
@@ -375,17 +376,10 @@ def insert_plate_acq(plate_barcode, microscope, timepoint, imaged_timepoint, fol
 
 
 def find_dirs_containing_img_files_recursive(path):
-    """Yield lowest level directories containing image files as Path (not starting with '.')
-       the method is called recursively to find all subdirs """
-    for entry in os.scandir(path):
-        # recurse directories
-        if not entry.name.startswith('.') and entry.is_dir():
-            yield from find_dirs_containing_img_files_recursive(entry.path)
-        if entry.is_file():
-            # return parent path if file is imagefile, then break scandir-loop
-            if entry.path.lower().endswith(('.png','.tif','tiff')):
-                yield(Path(entry.path).parent)
-                break
+    """Yield lowest level directories containing image files as Path (not starting with '.'),
+       dirs are listed in parallel by the crawler threads """
+    max_workers = dir_crawler.get_max_workers(path, imgdb_settings.CRAWL_CONCURRENCY, imgdb_settings.CRAWL_CONCURRENCY_LOCAL)
+    yield from dir_crawler.find_dirs_containing_img_files([os.path.normpath(path)], max_workers)
 
 
 
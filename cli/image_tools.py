@@ -5,27 +5,23 @@ import logging
 import os
 from PIL import Image
 import cv2 as cv2
-import subprocess
+import numpy as np
+import xxhash
 import time
 import glob
 from pathlib import Path
 
-def colon_delimited_to_dict(inputString):
-  # for each line in result, split into key-val on delimiter(colon)
-  splitted = inputString.splitlines()
-  result = {}
-  for line in splitted:
-    key_val = line.split(':')
-    # only process lines with delimiter
-    if len(key_val) == 2:
-      result[key_val[0].strip()] = key_val[1].strip()
-
-  return result
+import tiff_info
 
 def read_tiff_info(path):
-  result =  subprocess.run(['tiffinfo', path, "-i"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-  output = str(result.stdout.decode())
-  return colon_delimited_to_dict(output)
+  # tags are read in-process (no tiffinfo subprocess), same dict as `tiffinfo -i` output parsed before
+  return tiff_info.read_tiff_info(path)
+
+def make_thumb_path(image, thumbdir):
+  # need to strip / otherwise path can not be joined
+  image_subpath = image.strip("/")
+  thumb_path = os.path.join(thumbdir, image_subpath)
+  return thumb_path
 
 def makeThumb(path, thumbpath, overwrite):
   return makeThumb_opencv(path, thumbpath, overwrite)
@@ -89,6 +85,125 @@ def makeThumb_opencv(path, thumbpath, overwrite):
           logging.error("Error making thumb could be that image is multi-doc-tiff?")
           raise
 
+THUMB_SIZE = (120,120)
+COMPRESSED_COPY_PNG_COMPRESSION = 4
+
+def make_derivatives(path, thumbpath, compressed_path=None, overwrite=False):
+  """
+  Reads the original file once and makes everything derived from it: content hash and size of
+  the bytes read, the 120px png thumb, optionally a compressed png copy, and intensity stats of the original.
+  Thumb and copy are the same as makeThumb_opencv and any2png made with their own decodes.
+  Returns dict with intensity_stats, content_hash and file_size
+  """
+
+  with open(path, 'rb') as f:
+    data = f.read()
+
+  # hash of the same buffer that is decoded, the file is not read again
+  content_hash = content_hash_of(data)
+
+  # imdecode asserts on empty buffer where imread returned None
+  img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED) if len(data) > 0 else None
+  if img is None:
+    raise Exception('image read returned NONE, path: ' + str(path))
+
+  # stats of the image as the viewer reads it (cv2.IMREAD_ANYDEPTH), gray at full bit depth
+  stats = intensity_stats(to_gray(img))
+
+  # replace old ext with png
+  thumbpath_with_ext = os.path.splitext(thumbpath)[0]+'.png'
+  if overwrite or (not os.path.isfile(thumbpath_with_ext)):
+
+    if "nikon" in path:
+      thumb = cv2.normalize(to_gray(img), None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+    else:
+      thumb = to_8bit_color(img)
+
+    thumb = cv2.resize(thumb, THUMB_SIZE, interpolation = cv2.INTER_AREA)
+
+    os.makedirs(os.path.dirname(thumbpath_with_ext), exist_ok=True)
+    cv2.imwrite(thumbpath_with_ext, thumb)
+
+  if compressed_path is not None and (overwrite or not os.path.isfile(compressed_path)):
+    os.makedirs(os.path.dirname(compressed_path), exist_ok=True)
+    cv2.imwrite(compressed_path, to_8bit_color(img), [cv2.IMWRITE_PNG_COMPRESSION, COMPRESSED_COPY_PNG_COMPRESSION])
+
+  return {'intensity_stats': stats,
+          'content_hash': content_hash,
+          'file_size': len(data)}
+
+def content_hash_of(data):
+  # xxh3 128 bit, fast non-cryptographic hash for integrity checks and dedup (not against tampering)
+  return xxhash.xxh3_128_hexdigest(data)
+
+# percentiles stored in intensity_stats, 0.6 and 99.4 are the ones the viewer's auto white balance uses
+INTENSITY_PERCENTILES = (0.1, 0.6, 1, 50, 99, 99.4, 99.9)
+INTENSITY_HISTOGRAM_BINS = 256
+
+def intensity_stats(img):
+  """
+  Stats of the original pixel values (full bit depth): min, max, mean, percentiles (as dict with the
+  percentile as string key) and a compact histogram. Non finite values of float images are ignored. The histogram has 256 bins over [min, max], bin i
+  is pixel value i after cv2.normalize NORM_MINMAX to 8 bit, so the viewer can use it for the normalized image.
+  8 and 16 bit images are counted in one bincount pass, all stats are derived from the counts
+  """
+  if img.dtype in (np.uint8, np.uint16):
+    counts = np.bincount(img.ravel(), minlength=np.iinfo(img.dtype).max + 1)
+    nonzero = np.flatnonzero(counts)
+    min_value, max_value = int(nonzero[0]), int(nonzero[-1])
+    values = np.arange(min_value, max_value + 1)
+    counts = counts[min_value:max_value + 1]
+    mean = float(np.dot(counts, values.astype(np.float64)) / img.size)
+
+    # value below which (or equal) the percentile of pixels are
+    cumulative = np.cumsum(counts)
+    percentiles = {str(q): float(values[np.searchsorted(cumulative, q / 100 * img.size)]) for q in INTENSITY_PERCENTILES}
+
+    histogram = np.zeros(INTENSITY_HISTOGRAM_BINS, dtype=np.int64)
+    scale = (INTENSITY_HISTOGRAM_BINS - 1) / (max_value - min_value) if max_value > min_value else 0.0
+    np.add.at(histogram, np.rint((values - min_value) * scale).astype(np.int64), counts)
+  else:
+    # nan and inf pixels are left out, np.histogram raises on a non finite range
+    finite = img[np.isfinite(img)]
+    if finite.size == 0:
+      finite = np.zeros(1, dtype=img.dtype)
+    min_value, max_value = float(finite.min()), float(finite.max())
+    mean = float(finite.mean())
+    percentiles = {str(q): float(p) for q, p in zip(INTENSITY_PERCENTILES, np.percentile(finite, INTENSITY_PERCENTILES))}
+    histogram = np.histogram(finite, bins=INTENSITY_HISTOGRAM_BINS, range=(min_value, max_value))[0]
+
+  return {'min': float(min_value),
+          'max': float(max_value),
+          'mean': mean,
+          'dtype': str(img.dtype),
+          'percentiles': percentiles,
+          'histogram': histogram.tolist()}
+
+def to_gray(img):
+  # same as cv2.imread with cv2.IMREAD_ANYDEPTH
+  if img.ndim == 2:
+    return img
+  if img.shape[2] == 4:
+    return cv2.cvtColor(img, cv2.COLOR_BGRA2GRAY)
+  return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+def to_8bit_color(img):
+  # same as cv2.imread with default flag (cv2.IMREAD_COLOR)
+  if img.dtype == np.uint16 and img.ndim == 2:
+    # imread drops the low byte of gray images
+    img = (img >> 8).astype(np.uint8)
+  elif img.dtype == np.uint16:
+    # and scales color images to 255 with rounding
+    img = cv2.convertScaleAbs(img, alpha=255/65535)
+  elif img.dtype != np.uint8:
+    img = cv2.convertScaleAbs(img)
+
+  if img.ndim == 2:
+    return cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+  if img.shape[2] == 4:
+    return cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
+  return img
+
 def tif2png_recursive(in_path, out_path):
   exts = ['.tif', '.tiff']
   files = [p for p in Path(in_path).rglob('*') if p.suffix in exts]
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+
+#
+# Measures image-monitor ingest throughput on a synthetic tree (see synthetic_acquisitions.py)
+# with a throwaway database, reports images/sec, poll latency and db round trips.
+#
+# Postgres in a docker container (started and removed by the benchmark):
+#   python3 ingest-benchmark.py --docker
+# Existing postgres server (a temporary database is created and dropped):
+#   python3 ingest-benchmark.py -dh localhost -dp 5432 -du postgres -dpw example
+#
+
+import logging
+import argparse
+import json
+import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+import psycopg2
+
+import synthetic_acquisitions
+
+CLI_DIR = os.path.dirname(os.path.abspath(__file__))
+SCHEMA_FILE = os.path.join(CLI_DIR, '..', 'db', 'db_commands.sql')
+
+# tables used by image-monitor, their definitions (tables, columns, constraints and indexes) are taken from SCHEMA_FILE
+MONITOR_TABLES = ('images', 'plate_acquisition', 'new_plate_acquisition', 'thumb_job', 'poll_checkpoint',
+                  'folder_lease', 'dir_scan_state', 'dir_quarantine', 'channel_map', 'channel_map_mapping',
+                  'acquisition_protocol', 'image_file_meta', 'plate', 'plate_layout')
+
+# benchmark's own queries are marked so they are not counted as image-monitor round trips
+BENCH_MARK = '/* ingest-benchmark */'
+
+
+def get_free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_docker_postgres(port, password):
+    container = f"imagedb-bench-{os.getpid()}"
+    subprocess.run(['docker', 'run', '-d', '--rm',
+                    '--name', container,
+                    '-p', f'127.0.0.1:{port}:5432',
+                    '-e', f'POSTGRES_PASSWORD={password}',
+                    'postgres:14',
+                    '-c', 'shared_preload_libraries=pg_stat_statements'],
+                   check=True, stdout=subprocess.DEVNULL)
+    return container
+
+
+def wait_for_postgres(db_args, timeout=60):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            psycopg2.connect(database='postgres', **db_args).close()
+            return
+        except psycopg2.OperationalError:
+            if time.time() > deadline:
+                raise
+            time.sleep(1)
+
+
+def read_monitor_schema(schema_file=SCHEMA_FILE):
+    """
+    Returns the CREATE TABLE, ALTER TABLE and CREATE INDEX statements of MONITOR_TABLES in schema_file,
+    db_commands.sql is a collection of commands (queries, data, views of other tables) and not run as a whole
+    """
+    with open(schema_file) as f:
+        sql = re.sub(r'--[^\n]*', '', f.read())
+
+    pattern = re.compile(r'^(?:CREATE TABLE|ALTER TABLE|CREATE (?:UNIQUE )?INDEX\s+\w+\s+ON)\s+(\w+)', re.IGNORECASE)
+    statements = []
+    for statement in sql.split(';'):
+        statement = statement.strip()
+        match = pattern.match(statement)
+        if match and match.group(1) in MONITOR_TABLES:
+            statements.append(statement)
+    return statements
+
+
+def create_database(db_args, db_name):
+    """
+    Creates db_name with image-monitor tables.
+    Returns True if pg_stat_statements is available for counting round trips
+    """
+    conn = psycopg2.connect(database='postgres', **db_args)
+    conn.autocommit = True
+    cursor = conn.cursor()
+    cursor.execute(f'CREATE DATABASE "{db_name}"')
+    conn.close()
+
+    conn = psycopg2.connect(database=db_name, **db_args)
+    cursor = conn.cursor()
+    for statement in read_monitor_schema():
+        cursor.execute(statement)
+    conn.commit()
+
+    has_stat_statements = True
+    try:
+        cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_stat_statements")
+        cursor.execute(f"{BENCH_MARK} SELECT pg_stat_statements_reset()")
+        conn.commit()
+    except psycopg2.Error as e:
+        logging.warning(f"pg_stat_statements not available, db round trips are not counted: {e}")
+        conn.rollback()
+        has_stat_statements = False
+
+    conn.close()
+    return has_stat_statements
+
+
+def drop_database(db_args, db_name):
+    conn = psycopg2.connect(database='postgres', **db_args)
+    conn.autocommit = True
+    cursor = conn.cursor()
+    # monitor is terminated but its connections can still be open (DROP ... WITH (FORCE) needs pg 13)
+    cursor.execute("SELECT pg_terminate_backend(pid) FROM pg_stat_activity WHERE datname = %s AND pid <> pg_backend_pid()", (db_name,))
+    cursor.execute(f'DROP DATABASE IF EXISTS "{db_name}"')
+    conn.close()
+
+
+def count_images(conn):
+    cursor = conn.cursor()
+    cursor.execute(f"{BENCH_MARK} SELECT count(*) FROM images")
+    count = cursor.fetchone()[0]
+    cursor.close()
+    conn.commit()
+    return count
+
+
+def count_meta_bytes(conn):
+    """
+    Returns bytes of stored image metadata (images rows and interned tiff headers, incl. toast and indexes)
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"{BENCH_MARK} SELECT pg_total_relation_size('images') + pg_total_relation_size('image_file_meta')")
+    nbytes = cursor.fetchone()[0]
+    cursor.close()
+    conn.commit()
+    return nbytes
+
+
+def count_db_round_trips(conn, db_name):
+    """
+    Returns number of statements executed in db_name (by image-monitor), None if not available
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"{BENCH_MARK} SELECT coalesce(sum(calls), 0) FROM pg_stat_statements "
+                   "WHERE dbid = (SELECT oid FROM pg_database WHERE datname = %s) "
+                   "AND query NOT LIKE %s",
+                   (db_name, '%' + BENCH_MARK + '%'))
+    count = int(cursor.fetchone()[0])
+    cursor.close()
+    conn.commit()
+    return count
+
+
+def read_metrics(metrics_port):
+    """
+    Returns dict with metric name (without labels) as key and value from image-monitor metrics endpoint
+    """
+    text = urllib.request.urlopen(f"http://127.0.0.1:{metrics_port}/metrics", timeout=5).read().decode()
+    values = dict()
+    for line in text.splitlines():
+        if line.startswith('#') or '{' in line:
+            continue
+        name, value = line.split(' ', 1)
+        values[name] = float(value)
+    return values
+
+
+def wait_for_polls(metrics_port, n_polls, timeout):
+    """
+    Waits until image-monitor has observed n_polls polls, returns the metrics then
+    """
+    deadline = time.time() + timeout
+    while True:
+        try:
+            values = read_metrics(metrics_port)
+            if values.get('imagedb_monitor_poll_duration_seconds_count', 0) >= n_polls:
+                return values
+        except OSError:
+            pass # endpoint not up yet
+        if time.time() > deadline:
+            raise TimeoutError(f"image-monitor did not finish {n_polls} polls within {timeout} sec")
+        time.sleep(0.2)
+
+
+def write_monitor_conf(conf_file, work_dir, tree_root, db_args, db_name, poll_interval, metrics_port):
+    conf = {
+        "IMAGES_CACHE_DIR": os.path.join(work_dir, 'cache'),
+        "IMAGES_THUMB_DIR": os.path.join(work_dir, 'thumbs'),
+        "ERROR_LOG_DIR": work_dir,
+        "DB_USER": db_args['user'],
+        "DB_PASS": db_args['password'],
+        "DB_PORT": db_args['port'],
+        "DB_HOSTNAME": db_args['host'],
+        "DB_NAME": db_name,
+        "EXHAUSTIVE_INITIAL_POLL": "false",
+        "POLL_DIRS_MARGIN_DAYS": 3,
+        "POLL_INTERVAL": poll_interval,
+        # acquisitions must not be finished during the benchmark
+        "LATEST_FILE_CHANGE_MARGIN": 7200,
+        "PROJ_ROOT_DIRS": [tree_root],
+        "CONTINUOUS_POLLING": "true",
+        "WATCH_MODE": "poll",
+        # generated files are complete when written
+        "IMAGE_STABLE_AGE": 0,
+        "METRICS_PORT": metrics_port
+    }
+    with open(conf_file, 'w') as f:
+        json.dump(conf, f, indent=2)
+
+
+def run_benchmark(args):
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='imagedb-bench-')
+    os.makedirs(work_dir, exist_ok=True)
+
+    tree_root = args.tree
+    n_acquisitions = None
+    if tree_root is None:
+        tree_root = os.path.join(work_dir, 'share')
+        schemes = list(synthetic_acquisitions.SCHEMES) if args.schemes == 'all' else args.schemes.split(',')
+        acquisitions = synthetic_acquisitions.generate_tree(tree_root, schemes, args.plates, args.wells, args.sites, args.channels)
+        n_acquisitions = len(acquisitions)
+        expected_images = sum(acquisitions.values())
+    else:
+        expected_images = args.expected_images
+
+    logging.info(f"tree: {tree_root}, acquisitions: {n_acquisitions}, images: {expected_images}")
+
+    container = None
+    if args.docker:
+        db_args = {'host': '127.0.0.1', 'port': get_free_port(), 'user': 'postgres', 'password': 'bench'}
+        container = start_docker_postgres(db_args['port'], db_args['password'])
+    else:
+        db_args = {'host': args.db_host, 'port': args.db_port, 'user': args.db_user, 'password': args.db_pass}
+
+    db_name = f"imagedb_bench_{os.getpid()}"
+    monitor = None
+    db_created = False
+    try:
+        wait_for_postgres(db_args)
+        has_stat_statements = create_database(db_args, db_name)
+        db_created = True
+
+        metrics_port = get_free_port()
+        conf_file = os.path.join(work_dir, 'monitor-conf.json')
+        write_monitor_conf(conf_file, work_dir, tree_root, db_args, db_name, args.poll_interval, metrics_port)
+
+        conn = psycopg2.connect(database=db_name, **db_args)
+
+        # Ingest, from process start until all images are in db
+        monitor_log = open(os.path.join(work_dir, 'image-monitor.log'), 'w')
+        start = time.time()
+        monitor = subprocess.Popen([sys.executable, 'image-monitor.py'],
+                                   cwd=CLI_DIR,
+                                   env=dict(os.environ, CONF_FILE=conf_file),
+                                   stdout=monitor_log,
+                                   stderr=subprocess.STDOUT)
+
+        while count_images(conn) < expected_images:
+            if monitor.poll() is not None:
+                raise Exception(f"image-monitor exited, see {monitor_log.name}")
+            if time.time() - start > args.timeout:
+                raise TimeoutError(f"not all images ingested within {args.timeout} sec")
+            time.sleep(0.2)
+        ingest_time = time.time() - start
+
+        initial = wait_for_polls(metrics_port, 1, args.timeout)
+        round_trips_ingest = count_db_round_trips(conn, db_name) if has_stat_statements else None
+        meta_bytes = count_meta_bytes(conn)
+
+        # Steady state, polls with nothing new to import
+        steady = wait_for_polls(metrics_port, 1 + args.steady_polls, args.timeout + args.steady_polls * (args.poll_interval + 60))
+        n_steady = steady['imagedb_monitor_poll_duration_seconds_count'] - initial['imagedb_monitor_poll_duration_seconds_count']
+        steady_poll_time = (steady['imagedb_monitor_poll_duration_seconds_sum'] - initial['imagedb_monitor_poll_duration_seconds_sum']) / n_steady
+        round_trips_steady = None
+        if has_stat_statements:
+            round_trips_steady = (count_db_round_trips(conn, db_name) - round_trips_ingest) / n_steady
+
+        conn.close()
+
+        result = {
+            'acquisitions': n_acquisitions,
+            'images': expected_images,
+            'ingest_seconds': round(ingest_time, 3),
+            'images_per_second': round(expected_images / ingest_time, 1),
+            'initial_poll_seconds': round(initial['imagedb_monitor_poll_duration_seconds_sum'], 3),
+            'steady_poll_seconds': round(steady_poll_time, 3),
+            'dirs_listed_total': steady.get('imagedb_monitor_dirs_listed_total'),
+            'meta_bytes_per_image': round(meta_bytes / expected_images, 1),
+            'db_round_trips_ingest': round_trips_ingest,
+            'db_round_trips_per_image': round(round_trips_ingest / expected_images, 3) if round_trips_ingest is not None else None,
+            'db_round_trips_per_steady_poll': round_trips_steady,
+        }
+        return result
+
+    finally:
+        if monitor is not None:
+            monitor.terminate()
+            monitor.wait()
+        if container is not None:
+            subprocess.run(['docker', 'rm', '-f', container], stdout=subprocess.DEVNULL)
+        elif db_created and not args.keep:
+            drop_database(db_args, db_name)
+        if not args.keep and args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+#
+#  Main entry for script
+#
+if __name__ == '__main__':
+
+    logging.basicConfig(format='%(asctime)s,%(msecs)d %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
+                        datefmt='%H:%M:%S',
+                        level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description='Ingest benchmark of image-monitor on synthetic acquisitions')
+
+    parser.add_argument('--docker', help='Start a throwaway postgres container', action='store_true')
+    parser.add_argument('-dh', '--db-host', default='localhost')
+    parser.add_argument('-dp', '--db-port', type=int, default=5432)
+    parser.add_argument('-du', '--db-user', default='postgres')
+    parser.add_argument('-dpw', '--db-pass', default='example')
+    parser.add_argument('-s', '--schemes', help='Comma separated schemes or all: ' + ','.join(synthetic_acquisitions.SCHEMES), default='all')
+    parser.add_argument('-p', '--plates', help='Acquisitions per scheme', type=int, default=2)
+    parser.add_argument('-w', '--wells', help='Wells per plate', type=int, default=24)
+    parser.add_argument('-si', '--sites', help='Sites per well', type=int, default=4)
+    parser.add_argument('-c', '--channels', help='Channels per site', type=int, default=5)
+    parser.add_argument('-t', '--tree', help='Use existing tree instead of generating one (needs --expected-images)')
+    parser.add_argument('-ei', '--expected-images', type=int)
+    parser.add_argument('-pi', '--poll-interval', help='image-monitor poll interval (sec)', type=int, default=1)
+    parser.add_argument('-sp', '--steady-polls', help='Polls measured after ingest is complete', type=int, default=3)
+    parser.add_argument('-to', '--timeout', help='Max seconds for ingest', type=int, default=1800)
+    parser.add_argument('-wd', '--work-dir', help='Dir for tree, conf and log (default temp dir, removed after run)')
+    parser.add_argument('--keep', help='Keep work dir and database', action='store_true')
+    parser.add_argument('--min-images-per-sec', help='Exit with error if throughput is lower (regression check)', type=float)
+
+    args = parser.parse_args()
+
+    if args.tree is not None and args.expected_images is None:
+        parser.error('--tree needs --expected-images')
+
+    result = run_benchmark(args)
+
+    print(json.dumps(result, indent=2))
+
+    if args.min_images_per_sec is not None and result['images_per_second'] < args.min_images_per_sec:
+        raise SystemExit(f"images/sec {result['images_per_second']} below {args.min_images_per_sec}")
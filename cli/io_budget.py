@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+#
+# Rate limits and latency backoff for reads of backfill images (image-monitor and thumb-worker),
+# so a big backfill doesn't saturate the file server the microscopes are writing to.
+# Images of live acquisitions are never throttled, see is_backfill
+#
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+# max slowdown when latency is above target, and how fast it recovers
+MAX_BACKOFF_FACTOR = 64
+BACKOFF_RECOVERY = 0.9
+# weight of new latency observation in moving average
+LATENCY_EWMA_WEIGHT = 0.2
+MAX_PAUSE = 10 # sec
+
+
+class TokenBucket:
+    """
+    Allows rate units per second on average with bursts of max one second of units, rate 0 is unlimited
+    """
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self.tokens = self.rate
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, amount, slowdown=1.0):
+        """
+        Takes amount units and returns seconds to wait before using them
+        """
+        if self.rate <= 0:
+            return 0.0
+        rate = self.rate / slowdown
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.tokens + (now - self.last) * rate, rate)
+            self.last = now
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / rate
+
+
+class LatencyBackoff:
+    """
+    Moving average of a latency, the slowdown factor doubles for every observation above target
+    and decays back to 1 when latency is below target again. Target 0 disables backoff
+    """
+    def __init__(self, name, target):
+        self.name = name
+        self.target = float(target)
+        self.latency = 0.0
+        self.factor = 1.0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+        if self.target <= 0:
+            return
+        with self.lock:
+            self.latency = (1 - LATENCY_EWMA_WEIGHT) * self.latency + LATENCY_EWMA_WEIGHT * seconds
+            if self.latency > self.target:
+                if self.factor < MAX_BACKOFF_FACTOR:
+                    logging.info(f"{self.name} latency {self.latency:.3f} sec above target {self.target} sec, backing off")
+                self.factor = min(self.factor * 2, MAX_BACKOFF_FACTOR)
+            else:
+                self.factor = max(self.factor * BACKOFF_RECOVERY, 1.0)
+        metrics.IO_BACKOFF_FACTOR.labels(self.name).set(self.factor)
+
+    def pause(self):
+        """
+        Extra pause when backing off, proportional to the latency we cause
+        """
+        if self.factor <= 1.0:
+            return 0.0
+        return min((self.factor - 1) * self.latency, MAX_PAUSE)
+
+
+class IoBudget:
+    """
+    Budget for reading backfill images: bytes and files per second (0 = unlimited) and max concurrent decodes.
+    Rates are lowered and pauses added while file read (stat) latency or db commit latency is above target
+    """
+    def __init__(self, bytes_per_sec, files_per_sec, max_concurrent_decodes, read_latency_target, commit_latency_target):
+        self.bytes = TokenBucket(bytes_per_sec)
+        self.files = TokenBucket(files_per_sec)
+        self.max_concurrent_decodes = max(1, int(max_concurrent_decodes))
+        self.decode_slots = threading.BoundedSemaphore(self.max_concurrent_decodes)
+        self.read_latency = LatencyBackoff('read', read_latency_target)
+        self.commit_latency = LatencyBackoff('commit', commit_latency_target)
+
+    def slowdown(self):
+        return max(self.read_latency.factor, self.commit_latency.factor)
+
+    def acquire(self, files=1, nbytes=0):
+        """
+        Blocks until files and nbytes may be read
+        """
+        slowdown = self.slowdown()
+        wait = max(self.files.reserve(files, slowdown), self.bytes.reserve(nbytes, slowdown))
+        wait += max(self.read_latency.pause(), self.commit_latency.pause())
+        if wait > 0:
+            metrics.IO_THROTTLED_SECONDS.inc(wait)
+            time.sleep(wait)
+
+    @contextmanager
+    def decode(self):
+        with self.decode_slots:
+            yield
+
+    def observe_read(self, seconds):
+        self.read_latency.observe(seconds)
+
+    def observe_commit(self, seconds):
+        self.commit_latency.observe(seconds)
+
+
+def is_backfill(mtime, backfill_min_age):
+    """
+    Files (or dirs) not modified for backfill_min_age sec are backfill, newer ones belong to a live acquisition
+    """
+    return time.time() - mtime > backfill_min_age
+
+
+def from_settings(settings):
+    return IoBudget(settings.IO_BYTES_PER_SEC,
+                    settings.IO_FILES_PER_SEC,
+                    settings.IO_MAX_CONCURRENT_DECODES,
+                    settings.IO_READ_LATENCY_TARGET,
+                    settings.IO_COMMIT_LATENCY_TARGET)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+#
+# Prometheus metrics of image-monitor and thumb-worker, served as text format on
+# http://<host>:<port>/metrics by start_metrics_server
+#
+
+import logging
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+# a poll can take hours on a large share (initial poll)
+SCAN_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 7200)
+
+#
+# image-monitor
+#
+POLL_DURATION = Histogram('imagedb_monitor_poll_duration_seconds', 'Duration of a whole poll (scan and import)', buckets=SCAN_BUCKETS)
+SCAN_DURATION = Histogram('imagedb_monitor_scan_duration_seconds', 'Duration of the directory scan part of a poll', buckets=SCAN_BUCKETS)
+DIRS_SCANNED = Counter('imagedb_monitor_dirs_scanned_total', 'Directories stat:ed by the scanner')
+DIRS_LISTED = Counter('imagedb_monitor_dirs_listed_total', 'Directories listed by the scanner (mtime changed since last scan)')
+DIRS_PRUNED = Counter('imagedb_monitor_dirs_pruned_total', 'Image directories not imported in a poll', ['reason'])
+DIRS_IMPORTED = Counter('imagedb_monitor_dirs_imported_total', 'Image directories imported')
+IMAGES_INSERTED = Counter('imagedb_monitor_images_inserted_total', 'Images inserted into images table')
+IMAGES_PER_SECOND = Gauge('imagedb_monitor_last_poll_images_per_second', 'Images inserted per second in last poll')
+
+DB_INSERT_SECONDS = Histogram('imagedb_monitor_db_insert_seconds', 'Bulk insert of the new images of one directory (one transaction)')
+DB_EXISTING_SECONDS = Histogram('imagedb_monitor_db_existing_paths_seconds', 'Query for images of one directory already in db')
+TIFF_META_SECONDS = Histogram('imagedb_monitor_tiff_meta_read_seconds', 'TIFF metadata read of the new images of one directory')
+
+PENDING_IMAGES = Gauge('imagedb_monitor_pending_images', 'Images waiting to be completely written')
+THUMB_QUEUE_DEPTH = Gauge('imagedb_thumb_job_queue_depth', 'Jobs in thumb_job table', ['state'])
+ACTIVE_ACQUISITIONS = Gauge('imagedb_monitor_active_acquisitions', 'Acquisition folders in activity index')
+ACQUISITIONS_FINISHED = Counter('imagedb_monitor_acquisitions_finished_total', 'Acquisitions set to finished', ['reason'])
+QUARANTINED_DIRS = Gauge('imagedb_monitor_quarantined_dirs', 'Directories in quarantine (failed import)')
+
+#
+# staged pipelines (both), throughput of a stage is units / busy seconds per worker
+#
+PIPELINE_UNITS = Counter('imagedb_pipeline_units_total', 'Units (images) processed by pipeline stage', ['pipeline', 'stage'])
+PIPELINE_BUSY_SECONDS = Counter('imagedb_pipeline_busy_seconds_total', 'Time workers of pipeline stage were busy', ['pipeline', 'stage'])
+PIPELINE_QUEUE_DEPTH = Gauge('imagedb_pipeline_queue_depth', 'Items waiting in input queue of pipeline stage', ['pipeline', 'stage'])
+
+#
+# io budget of backfill reads (both)
+#
+IO_THROTTLED_SECONDS = Counter('imagedb_io_throttled_seconds_total', 'Time backfill reads waited for io budget')
+IO_BACKOFF_FACTOR = Gauge('imagedb_io_backoff_factor', 'Slowdown of backfill reads because of high latency, 1 is no slowdown', ['signal'])
+
+#
+# thumb-worker
+#
+THUMB_SECONDS = Histogram('imagedb_thumb_worker_thumb_seconds', 'Thumbnail generation (decode, thumb, copy and stats) of one image')
+THUMBS_DONE = Counter('imagedb_thumb_worker_thumbs_done_total', 'Thumbnails made')
+THUMBS_FAILED = Counter('imagedb_thumb_worker_thumbs_failed_total', 'Failed thumbnail attempts')
+
+
+def start_metrics_server(port):
+    """
+    Serves metrics in a background thread, port 0 disables the endpoint.
+    A port already in use (e.g. another monitor or worker on the host) only disables the endpoint
+    """
+    if int(port) <= 0:
+        logging.info("metrics endpoint disabled")
+        return
+
+    try:
+        start_http_server(int(port))
+    except OSError as e:
+        logging.warning(f"metrics endpoint disabled, could not listen on port {port}: {e}")
+        return
+    logging.info(f"metrics endpoint on port: {port}")
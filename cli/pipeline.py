@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+#
+# Staged pipeline with bounded queues between stages, used by image-monitor (discovery -> parse ->
+# tiff meta -> db write) and thumb-worker (claim -> derivatives -> db write).
+# Every stage has its own worker threads, a full queue blocks the stage before it (backpressure),
+# so slow decodes overlap with db writes and dir listings without unbounded memory.
+# The items of the last stage are returned to the calling thread, which can own all shared state.
+#
+
+import logging
+import queue
+import threading
+import time
+import traceback
+
+import metrics
+
+# end of items marker between stages
+_END = object()
+
+
+class StageFailure:
+    """
+    Passed on instead of the result when a stage raised, later stages skip it
+    """
+    def __init__(self, stage, item, error):
+        self.stage = stage
+        self.item = item
+        self.error = error
+        self.traceback = traceback.format_exc()
+
+
+class Stage:
+    """
+    func is called with every item in workers threads, its return value is the item of next stage
+    """
+    def __init__(self, name, func, workers=1, queue_size=4):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.queue_size = max(1, int(queue_size))
+        self.items = 0
+        self.units = 0
+        self.busy_seconds = 0.0
+
+
+class Aborted(Exception):
+    pass
+
+
+class Pipeline:
+    """
+    Runs items from a source iterator (in a feeder thread, stage source_name) through the stages,
+    the caller processes the items out of the last stage (stage sink_name, see sink_done).
+    weight(item) is the number of units (e.g. images) in an item for throughput metrics
+    """
+    def __init__(self, name, stages, source_name='source', sink_name='sink', weight=None, output_queue_size=4):
+        self.name = name
+        self.stages = stages
+        self.source_stage = Stage(source_name, None)
+        self.sink_stage = Stage(sink_name, None)
+        self.weight = weight if weight is not None else (lambda item: 1)
+        self.queues = [queue.Queue(maxsize=stage.queue_size) for stage in stages]
+        self.queues.append(queue.Queue(maxsize=output_queue_size))
+        self.stop_event = threading.Event()
+        self.abort_event = threading.Event()
+        self.lock = threading.Lock()
+        self.threads = []
+
+    def stop(self):
+        """
+        Source stops giving new items, items already in the pipeline are still processed
+        """
+        self.stop_event.set()
+
+    def is_stopped(self):
+        return self.stop_event.is_set()
+
+    def _put(self, q, item):
+        while True:
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                if self.abort_event.is_set():
+                    raise Aborted()
+
+    def _get(self, q):
+        while True:
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                if self.abort_event.is_set():
+                    raise Aborted()
+
+    def _record(self, stage, units, elapsed):
+        with self.lock:
+            stage.items += 1
+            stage.units += units
+            stage.busy_seconds += elapsed
+        metrics.PIPELINE_UNITS.labels(self.name, stage.name).inc(units)
+        metrics.PIPELINE_BUSY_SECONDS.labels(self.name, stage.name).inc(elapsed)
+
+    def sink_done(self, item, elapsed, units=None):
+        """
+        Called by the caller after processing an item out of the pipeline (or units of many items
+        written together), for throughput of last stage
+        """
+        self._record(self.sink_stage, self.weight(item) if units is None else units, elapsed)
+
+    def _feed(self, source):
+        try:
+            source = iter(source)
+            while not self.stop_event.is_set():
+                start = time.time()
+                try:
+                    item = next(source)
+                except StopIteration:
+                    break
+                self._record(self.source_stage, self.weight(item), time.time() - start)
+                self._put(self.queues[0], item)
+        except Aborted:
+            return
+        except Exception as e:
+            logging.exception(f"Exception in {self.source_stage.name} of pipeline {self.name}")
+            self._put_no_raise(self.queues[0], StageFailure(self.source_stage.name, None, e))
+        for _ in range(self.stages[0].workers):
+            self._put_no_raise(self.queues[0], _END)
+
+    def _put_no_raise(self, q, item):
+        try:
+            self._put(q, item)
+        except Aborted:
+            pass
+
+    def _work(self, index, remaining):
+        stage = self.stages[index]
+        in_queue = self.queues[index]
+        out_queue = self.queues[index + 1]
+        try:
+            while True:
+                item = self._get(in_queue)
+                if item is _END:
+                    break
+
+                if isinstance(item, StageFailure):
+                    self._put(out_queue, item)
+                    continue
+
+                start = time.time()
+                try:
+                    result = stage.func(item)
+                except Exception as e:
+                    logging.exception(f"Exception in stage {stage.name} of pipeline {self.name}")
+                    result = StageFailure(stage.name, item, e)
+                elapsed = time.time() - start
+
+                self._record(stage, self.weight(item), elapsed)
+                metrics.PIPELINE_QUEUE_DEPTH.labels(self.name, stage.name).set(in_queue.qsize())
+
+                self._put(out_queue, result)
+        except Aborted:
+            return
+
+        # last worker of stage ends the next stage
+        with self.lock:
+            remaining[index] -= 1
+            last = remaining[index] == 0
+        if last:
+            next_workers = self.stages[index + 1].workers if index + 1 < len(self.stages) else 1
+            for _ in range(next_workers):
+                self._put_no_raise(out_queue, _END)
+
+    def run(self, source, idle_timeout=None):
+        """
+        Generator of the items (or StageFailure) out of the last stage, in the calling thread.
+        With idle_timeout, None is yielded when no item came out within idle_timeout sec
+        (so the caller can do other work while waiting)
+        """
+        remaining = [stage.workers for stage in self.stages]
+        self.threads = [threading.Thread(target=self._feed, args=(source,), name=f"{self.name}-source", daemon=True)]
+        for index, stage in enumerate(self.stages):
+            for i in range(stage.workers):
+                self.threads.append(threading.Thread(target=self._work, args=(index, remaining),
+                                                     name=f"{self.name}-{stage.name}-{i}", daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+        start = time.time()
+        out_queue = self.queues[-1]
+        try:
+            while True:
+                try:
+                    item = out_queue.get(timeout=idle_timeout)
+                except queue.Empty:
+                    yield None
+                    continue
+                if item is _END:
+                    break
+                yield item
+        finally:
+            # caller stopped early, threads blocked on a full queue give up
+            self.stop_event.set()
+            self.abort_event.set()
+            self.log_throughput(time.time() - start)
+
+    def log_throughput(self, elapsed):
+        """
+        Logs items, units per busy sec of one worker and utilization of every stage,
+        the stage with highest utilization limits the pipeline
+        """
+        for stage in [self.source_stage] + self.stages + [self.sink_stage]:
+            utilization = stage.busy_seconds / (stage.workers * elapsed) if elapsed > 0 else 0
+            units_per_sec = stage.units / stage.busy_seconds if stage.busy_seconds > 0 else 0
+            logging.info(f"pipeline {self.name}, stage {stage.name}: items: {stage.items}, units: {stage.units}, "
+                         f"units/sec per worker: {units_per_sec:.1f}, workers: {stage.workers}, utilization: {utilization:.0%}")
@@ -22,3 +22,42 @@ with open(conf_file) as json_file:
   LATEST_FILE_CHANGE_MARGIN = os.getenv('LATEST_FILE_CHANGE_MARGIN', js_conf["LATEST_FILE_CHANGE_MARGIN"]) # sec (always try insert images within this time from latest_filedate_last_poll)
   PROJ_ROOT_DIRS = os.getenv('PROJ_ROOT_DIRS', js_conf["PROJ_ROOT_DIRS"])
   CONTINUOUS_POLLING = os.getenv('CONTINUOUS_POLLING', js_conf["CONTINUOUS_POLLING"]).lower() == 'true'
+  WATCH_MODE = os.getenv('WATCH_MODE', js_conf.get("WATCH_MODE", "poll")) # poll or inotify
+  ACQ_END_MARKERS = os.getenv('ACQ_END_MARKERS', js_conf.get("ACQ_END_MARKERS", [])) # files written by microscope when acquisition is done, in acquisition folder
+  if isinstance(ACQ_END_MARKERS, str):
+    ACQ_END_MARKERS = [marker for marker in ACQ_END_MARKERS.split(',') if marker]
+  FOLDER_LEASE_TIMEOUT = int(os.getenv('FOLDER_LEASE_TIMEOUT', js_conf.get("FOLDER_LEASE_TIMEOUT", 600))) # sec (folders of a stopped monitor are taken over after this time)
+  IMAGE_STABLE_AGE = float(os.getenv('IMAGE_STABLE_AGE', js_conf.get("IMAGE_STABLE_AGE", 30))) # sec (images modified more recently are checked for unchanged size before import)
+
+  IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', js_conf.get("IMPORT_BATCH_SIZE", 1000))) # images per dir and turn
+  IMPORT_TIME_BUDGET = float(os.getenv('IMPORT_TIME_BUDGET', js_conf.get("IMPORT_TIME_BUDGET", 600))) # sec of importing per poll
+  IMPORT_PARSE_WORKERS = int(os.getenv('IMPORT_PARSE_WORKERS', js_conf.get("IMPORT_PARSE_WORKERS", 2))) # threads of filename parsing stage of import pipeline
+  IMPORT_META_WORKERS = int(os.getenv('IMPORT_META_WORKERS', js_conf.get("IMPORT_META_WORKERS", 2))) # threads of tiff meta stage of import pipeline (each reads a batch in parallel)
+  IMPORT_QUEUE_SIZE = int(os.getenv('IMPORT_QUEUE_SIZE', js_conf.get("IMPORT_QUEUE_SIZE", 4))) # batches waiting between stages of import pipeline
+  QUARANTINE_BASE_DELAY = float(os.getenv('QUARANTINE_BASE_DELAY', js_conf.get("QUARANTINE_BASE_DELAY", 300))) # sec before first retry of a failed dir, doubles every attempt
+  QUARANTINE_MAX_DELAY = float(os.getenv('QUARANTINE_MAX_DELAY', js_conf.get("QUARANTINE_MAX_DELAY", 3600 * 24 * 7))) # sec
+  ROOT_POLICIES = os.getenv('ROOT_POLICIES', js_conf.get("ROOT_POLICIES", {})) # root dir as key, overrides POLL_INTERVAL, POLL_DIRS_MARGIN_DAYS, CRAWL_CONCURRENCY and enabled per root
+  if isinstance(ROOT_POLICIES, str):
+    ROOT_POLICIES = json.loads(ROOT_POLICIES)
+  CRAWL_CONCURRENCY = int(os.getenv('CRAWL_CONCURRENCY', js_conf.get("CRAWL_CONCURRENCY", 16))) # dirs listed in parallel on network filesystems (NFS round trips)
+  CRAWL_CONCURRENCY_LOCAL = int(os.getenv('CRAWL_CONCURRENCY_LOCAL', js_conf.get("CRAWL_CONCURRENCY_LOCAL", 4))) # dirs listed in parallel on local disks
+  BACKFILL_MIN_AGE = float(os.getenv('BACKFILL_MIN_AGE', js_conf.get("BACKFILL_MIN_AGE", 3600))) # sec, images (dirs) not modified for this long are backfill and read within io budget
+  IO_BYTES_PER_SEC = float(os.getenv('IO_BYTES_PER_SEC', js_conf.get("IO_BYTES_PER_SEC", 0))) # backfill bytes read per sec, 0 is unlimited
+  IO_FILES_PER_SEC = float(os.getenv('IO_FILES_PER_SEC', js_conf.get("IO_FILES_PER_SEC", 0))) # backfill files read per sec, 0 is unlimited
+  IO_MAX_CONCURRENT_DECODES = int(os.getenv('IO_MAX_CONCURRENT_DECODES', js_conf.get("IO_MAX_CONCURRENT_DECODES", 4))) # backfill files read at the same time
+  IO_READ_LATENCY_TARGET = float(os.getenv('IO_READ_LATENCY_TARGET', js_conf.get("IO_READ_LATENCY_TARGET", 0.05))) # sec (file stat), backfill backs off above, 0 disables
+  IO_COMMIT_LATENCY_TARGET = float(os.getenv('IO_COMMIT_LATENCY_TARGET', js_conf.get("IO_COMMIT_LATENCY_TARGET", 1.0))) # sec (db commit), backfill backs off above, 0 disables
+  METRICS_PORT = int(os.getenv('METRICS_PORT', js_conf.get("METRICS_PORT", 0))) # 0 disables metrics endpoint, set a port per monitor on the host
+
+  # thumb-worker, new keys have defaults so older conf files still work
+  THUMB_WORKER_BATCH_SIZE = int(os.getenv('THUMB_WORKER_BATCH_SIZE', js_conf.get("THUMB_WORKER_BATCH_SIZE", 50)))
+  THUMB_WORKER_POLL_INTERVAL = int(os.getenv('THUMB_WORKER_POLL_INTERVAL', js_conf.get("THUMB_WORKER_POLL_INTERVAL", 5))) # sec
+  THUMB_WORKER_MAX_ATTEMPTS = int(os.getenv('THUMB_WORKER_MAX_ATTEMPTS', js_conf.get("THUMB_WORKER_MAX_ATTEMPTS", 5)))
+  THUMB_WORKER_CLAIM_TIMEOUT = int(os.getenv('THUMB_WORKER_CLAIM_TIMEOUT', js_conf.get("THUMB_WORKER_CLAIM_TIMEOUT", 600))) # sec
+  THUMB_WORKER_DECODE_WORKERS = int(os.getenv('THUMB_WORKER_DECODE_WORKERS', js_conf.get("THUMB_WORKER_DECODE_WORKERS", 4))) # threads decoding images and writing thumbs
+  THUMB_WORKER_METRICS_PORT = int(os.getenv('THUMB_WORKER_METRICS_PORT', js_conf.get("THUMB_WORKER_METRICS_PORT", 0))) # 0 disables metrics endpoint, set a port per worker on the host
+  THUMB_WORKER_STATS_REFRESH_INTERVAL = int(os.getenv('THUMB_WORKER_STATS_REFRESH_INTERVAL', js_conf.get("THUMB_WORKER_STATS_REFRESH_INTERVAL", 60))) # sec between refreshes of channel_intensity_stats of acquisitions with new stats
+  # also write a png copy of every original while it is decoded for the thumb, under IMAGES_COMPRESSED_ROOT_DIR
+  MAKE_COMPRESSED_COPY = str(os.getenv('MAKE_COMPRESSED_COPY', js_conf.get("MAKE_COMPRESSED_COPY", "false"))).lower() == 'true'
+  IMAGES_ORIG_ROOT_DIR = os.getenv('IMAGES_ORIG_ROOT_DIR', js_conf.get("IMAGES_ORIG_ROOT_DIR", "/share/mikro/"))
+  IMAGES_COMPRESSED_ROOT_DIR = os.getenv('IMAGES_COMPRESSED_ROOT_DIR', js_conf.get("IMAGES_COMPRESSED_ROOT_DIR", "/share/mikro-compressed/"))
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+
+#
+# Generates directory trees of small synthetic TIFF images named like the microscopes
+# (and external datasets) that the parsers in cli/filenames understand, e.g. for ingest-benchmark.py
+#
+# python3 synthetic_acquisitions.py -o /tmp/imagedb-bench/share -s all -p 2 -w 8
+#
+
+import logging
+import argparse
+import importlib
+import os
+import string
+import uuid
+import cv2
+import numpy as np
+
+WAVELENGTHS = [405, 488, 561, 638, 730]
+# channel names known by pharmbio_nikon_filename_v1
+NIKON_CHANNELS = ['Blue', 'YFP', 'Red', 'Far Red Single', 'FITC']
+
+#
+# Every scheme is (parser module, acquisition dir, filename), the formats get
+# p (plate number), well ('B02'), row ('B'), col (2), site, ch (channel 1..n), seq, wl, chname and guid
+#
+SCHEMES = {
+    'squid_v1': ('pharmbio_squid_filename_v1',
+                 'mikro/squid/bench-squid-v1/plate{p:04d}_2023-03-08_16.19.17/0',
+                 '{well}_{site}_1_1_Fluorescence_{wl}_nm_Ex.tiff'),
+    'squid_v2': ('pharmbio_squid_filename_v2_standard',
+                 'mikro/squid/bench-squid-v2/plate{p:04d}_2023-03-08_16.19.17',
+                 '{well}_s{site}_x1_y1_Fluorescence_{wl}_nm_Ex.tiff'),
+    'nikon_v1': ('pharmbio_nikon_filename_v1',
+                 'mikro/nikon/bench-nikon-v1/plate{p:04d}',
+                 '20230223_183729_719__Well{well}_Point{well}_{site:04d}_Channel{chname}_Seq{seq:04d}.tiff'),
+    'nikon_v2': ('pharmbio_nikon_filename_v2_exported',
+                 'mikro/nikon/bench-nikon-v2/plate{p:04d}',
+                 '20230303_200618_678__Well{well}_ChannelMITO,PHAandWGA,SYTO,CONC,HOECHST_Seq{seq:04d}xy{site}c{ch}.tif'),
+    'nikon_v3': ('pharmbio_nikon_filename_v3_multi',
+                 'mikro/nikon/bench-nikon-v3/plate{p:04d}',
+                 '20230303_200618_678__Well{well}_Point{well}_{site:04d}_ChannelMITO,PHAandWGA,SYTO,CONC,HOECHST_Seq{seq:04d}c{ch}.tif'),
+    'nikon_v4': ('pharmbio_nikon_filename_v4_multi',
+                 'mikro/nikon/bench-nikon-v4/plate{p:04d}',
+                 'plate{p:04d}_Wells{well}_Points{site:03d}c{ch}.tif'),
+    'nikon_v5': ('pharmbio_nikon_filename_v5_multi',
+                 'mikro/nikon/bench-nikon-v5/plate{p:04d}',
+                 'plate{p:04d}_Points{site:03d}_Wells{well}c{ch}.tif'),
+    'imx_standard': ('pharmbio_IMX_filename_standard',
+                     'mikro/IMX/MDC_pharmbio/bench-imx/bench-20X-P{p:06d}/2022-01-31/{p}',
+                     'bench-20X-P{p:06d}_{well}_s{site}_w{ch}{guid}.tif'),
+    'imx_timepoint': ('pharmbio_IMX_filename_standard',
+                      'mikro/IMX/MDC_pharmbio/bench-imx-tp/bench-20X-T{p:06d}/2019-03-27/{p}/TimePoint_1',
+                      'bench-20X-T{p:06d}_{well}_s{site}_w{ch}{guid}.tif'),
+    'imx_relaxed': ('pharmbio_IMX_filename_relaxed',
+                    'mikro/IMX/MDC_pharmbio/bench-imx-relaxed/plate{p:04d}-4x/2020-08-21/{p}',
+                    'plate{p:04d}-4x_{well}_w{ch}{guid}.tif'),
+    'opera': ('external_filename_opera_rXcXfXpX_chXskXfkXflX',
+              'data/external-datasets/bench-opera/collection/plate{p:04d}/Images',
+              'r{row_num:02d}c{col:02d}f{site:02d}p01-ch{ch}sk1fk1fl1.tiff'),
+    'cpjump': ('external_filename_cpjump',
+               'data/external-datasets/bench-cpjump/images/BR{p:08d}__2020-11-05T21_31_31-Measurement1/Images',
+               'r{row_num:02d}c{col:02d}f{site:02d}p01-ch{ch}sk1fk1fl1.tiff'),
+}
+
+# schemes without site in filename only get one image per well and channel
+SCHEMES_WITHOUT_SITE = ('imx_relaxed',)
+
+
+def make_tiff_bytes(width, height, seed):
+    """
+    Returns an encoded 16 bit gray tiff with noise, all images in an acquisition share the same bytes
+    (ingest does not look at pixel values and writing is much faster than encoding)
+    """
+    rng = np.random.default_rng(seed)
+    img = rng.integers(100, 4000, size=(height, width), dtype=np.uint16)
+    ok, buf = cv2.imencode('.tif', img)
+    if not ok:
+        raise Exception('could not encode tiff')
+    return buf.tobytes()
+
+
+def iter_wells(n_wells):
+    # 384 plate order, A01, A02, ... P24
+    for i in range(n_wells):
+        row_num = i // 24 + 1
+        col = i % 24 + 1
+        yield string.ascii_uppercase[row_num - 1], row_num, col
+
+
+def acquisition_images(scheme, plate, n_wells, n_sites, n_channels):
+    """
+    Yields (acquisition dir, filename) of all images of one plate, relative to tree root
+    """
+    parser_module, dir_format, file_format = SCHEMES[scheme]
+
+    if scheme in SCHEMES_WITHOUT_SITE:
+        n_sites = 1
+
+    acq_dir = dir_format.format(p=plate)
+    seq = 0
+    for row, row_num, col in iter_wells(n_wells):
+        for site in range(1, n_sites + 1):
+            for ch in range(1, n_channels + 1):
+                filename = file_format.format(p=plate,
+                                              well=f'{row}{col:02d}',
+                                              row=row,
+                                              row_num=row_num,
+                                              col=col,
+                                              site=site,
+                                              ch=ch,
+                                              seq=seq,
+                                              wl=WAVELENGTHS[(ch - 1) % len(WAVELENGTHS)],
+                                              chname=NIKON_CHANNELS[(ch - 1) % len(NIKON_CHANNELS)],
+                                              guid=str(uuid.uuid4()).upper())
+                seq += 1
+                yield acq_dir, filename
+
+
+def generate_tree(out_root, schemes, n_plates, n_wells, n_sites, n_channels, image_size=64, first_plate=1):
+    """
+    Writes images of n_plates acquisitions per scheme under out_root.
+    Returns dict with acquisition dir as key and number of images as value
+    """
+    acquisitions = dict()
+    for scheme in schemes:
+        for plate in range(first_plate, first_plate + n_plates):
+
+            tiff_bytes = make_tiff_bytes(image_size, image_size, seed=plate)
+
+            for acq_dir, filename in acquisition_images(scheme, plate, n_wells, n_sites, n_channels):
+                abs_dir = os.path.join(out_root, acq_dir)
+                if abs_dir not in acquisitions:
+                    os.makedirs(abs_dir, exist_ok=True)
+                    acquisitions[abs_dir] = 0
+                with open(os.path.join(abs_dir, filename), 'wb') as f:
+                    f.write(tiff_bytes)
+                acquisitions[abs_dir] += 1
+
+            logging.info(f"generated {scheme} plate {plate}")
+
+    return acquisitions
+
+
+def verify_schemes(out_root, schemes):
+    """
+    Parses first image of every generated scheme with the parser the scheme is made for.
+    Returns list of schemes that did not parse
+    """
+    failed = []
+    for scheme in schemes:
+        parser_module, dir_format, file_format = SCHEMES[scheme]
+        parser = importlib.import_module('filenames.' + parser_module)
+
+        acq_dir, filename = next(acquisition_images(scheme, 1, 1, 1, 1))
+        abs_dir = os.path.join(out_root, acq_dir)
+        if not os.path.isdir(abs_dir):
+            continue
+
+        # guid in filename is random, use a file that is on disk
+        path = os.path.join(abs_dir, sorted(os.listdir(abs_dir))[0])
+
+        metadata = parser.parse_path_and_file(path)
+        if metadata is None or metadata.get('well') is None:
+            logging.error(f"scheme {scheme} not parsed by {parser_module}: {path}")
+            failed.append(scheme)
+        else:
+            logging.info(f"scheme {scheme} ok, well: {metadata['well']}, site: {metadata.get('wellsample')}, channel: {metadata.get('channel')}")
+
+    return failed
+
+
+if __name__ == '__main__':
+
+    logging.basicConfig(format='%(asctime)s,%(msecs)d %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
+                        datefmt='%H:%M:%S',
+                        level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description='Generates synthetic acquisitions for all filename schemes in cli/filenames')
+
+    parser.add_argument('-o', '--out-root', help='Root dir of generated tree', required=True)
+    parser.add_argument('-s', '--schemes', help='Comma separated schemes or all: ' + ','.join(SCHEMES), default='all')
+    parser.add_argument('-p', '--plates', help='Acquisitions per scheme', type=int, default=2)
+    parser.add_argument('-w', '--wells', help='Wells per plate', type=int, default=8)
+    parser.add_argument('-si', '--sites', help='Sites per well', type=int, default=2)
+    parser.add_argument('-c', '--channels', help='Channels per site', type=int, default=5)
+    parser.add_argument('-is', '--image-size', help='Width and height in pixels', type=int, default=64)
+
+    args = parser.parse_args()
+
+    schemes = list(SCHEMES) if args.schemes == 'all' else args.schemes.split(',')
+
+    acquisitions = generate_tree(args.out_root, schemes, args.plates, args.wells, args.sites, args.channels, args.image_size)
+    logging.info(f"acquisitions: {len(acquisitions)}, images: {sum(acquisitions.values())}")
+
+    failed = verify_schemes(args.out_root, schemes)
+    if failed:
+        raise SystemExit(f"schemes not parsed: {failed}")
@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+
+import logging
+import argparse
+import os
+import socket
+import time
+import traceback
+import json
+import psycopg2
+from psycopg2 import pool
+import psycopg2.extras
+
+import image_tools
+import io_budget
+import metrics
+import pipeline
+import settings as imgdb_settings
+
+__connection_pool = None
+
+# rate limits and latency backoff of backfill reads
+thumb_budget = io_budget.from_settings(imgdb_settings)
+
+def get_connection():
+
+    global __connection_pool
+    if __connection_pool is None:
+        # threaded pool, jobs are claimed in the pipeline source thread
+        __connection_pool = pool.ThreadedConnectionPool(1, 4, user=imgdb_settings.DB_USER,
+                                                               password=imgdb_settings.DB_PASS,
+                                                               host=imgdb_settings.DB_HOSTNAME,
+                                                               port=imgdb_settings.DB_PORT,
+                                                               database=imgdb_settings.DB_NAME)
+    return __connection_pool.getconn()
+
+
+def put_connection(pooled_connection):
+
+    global __connection_pool
+    if __connection_pool:
+        __connection_pool.putconn(pooled_connection)
+
+
+def claim_thumb_jobs(worker_id: str, batch_size: int, claim_timeout: int):
+    """
+    Claims up to batch_size queued jobs for this worker.
+    FOR UPDATE SKIP LOCKED makes it safe to run any number of workers on any number of hosts,
+    jobs claimed by a worker that died (claimed longer than claim_timeout sec ago) are claimed again
+    """
+
+    conn = None
+    try:
+        query = ("UPDATE thumb_job "
+                 "SET state = 'running', claimed_by = %s, claimed_at = now(), attempts = attempts + 1 "
+                 "WHERE id IN ( "
+                 "  SELECT id FROM thumb_job "
+                 "  WHERE (state = 'queued' AND not_before <= now()) "
+                 "     OR (state = 'running' AND claimed_at < now() - %s * interval '1 second') "
+                 "  ORDER BY id "
+                 "  LIMIT %s "
+                 "  FOR UPDATE SKIP LOCKED) "
+                 "RETURNING id, image_id, path, attempts")
+
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(query, (worker_id, claim_timeout, batch_size))
+        jobs = cursor.fetchall()
+        cursor.close()
+        conn.commit()
+
+        return jobs
+
+    except Exception as err:
+        logging.exception("Message")
+        raise err
+    finally:
+        put_connection(conn)
+
+
+def finish_thumb_jobs(done_jobs):
+    """
+    Sets thumb_ready, intensity_stats, content_hash and file_size of the images and deletes the jobs,
+    all done_jobs (list of (job_id, image_id, derivatives)) in one transaction.
+    Returns set of plate_acquisition ids of the images (their channel_intensity_stats are stale)
+    """
+
+    conn = None
+    try:
+        query = ("UPDATE images SET thumb_ready = now(), intensity_stats = v.intensity_stats::jsonb, "
+                 "content_hash = v.content_hash, file_size = v.file_size::bigint "
+                 "FROM (VALUES %s) AS v(image_id, intensity_stats, content_hash, file_size) "
+                 "WHERE images.id = v.image_id "
+                 "RETURNING images.plate_acquisition_id")
+
+        rows = [(image_id,
+                 json.dumps(derivatives['intensity_stats']),
+                 derivatives['content_hash'],
+                 derivatives['file_size']) for job_id, image_id, derivatives in done_jobs]
+
+        conn = get_connection()
+        cursor = conn.cursor()
+        updated = psycopg2.extras.execute_values(cursor, query, rows, page_size=1000, fetch=True)
+        cursor.execute("DELETE FROM thumb_job WHERE id = ANY(%s)", ([job_id for job_id, image_id, derivatives in done_jobs],))
+        cursor.close()
+        start_commit = time.time()
+        conn.commit()
+        thumb_budget.observe_commit(time.time() - start_commit)
+
+        return set(row[0] for row in updated)
+
+    except Exception as err:
+        if conn is not None:
+            conn.rollback()
+        logging.exception("Message")
+        raise err
+    finally:
+        put_connection(conn)
+
+
+def refresh_channel_intensity_stats(plate_acq_ids):
+    """
+    Stores channel_intensity_stats_view of the acquisitions in table channel_intensity_stats,
+    the view only aggregates the images of these acquisitions
+    """
+
+    conn = None
+    try:
+        query = ("INSERT INTO channel_intensity_stats(plate_acquisition_id, channel, image_count, min, max, mean, "
+                 "p0_1, p0_6, p1, p50, p99, p99_4, p99_9, updated) "
+                 "SELECT plate_acquisition_id, channel, image_count, min, max, mean, "
+                 "p0_1, p0_6, p1, p50, p99, p99_4, p99_9, now() "
+                 "FROM channel_intensity_stats_view "
+                 "WHERE plate_acquisition_id = ANY(%s) "
+                 "ON CONFLICT (plate_acquisition_id, channel) DO UPDATE "
+                 "SET image_count = EXCLUDED.image_count, min = EXCLUDED.min, max = EXCLUDED.max, mean = EXCLUDED.mean, "
+                 "p0_1 = EXCLUDED.p0_1, p0_6 = EXCLUDED.p0_6, p1 = EXCLUDED.p1, p50 = EXCLUDED.p50, "
+                 "p99 = EXCLUDED.p99, p99_4 = EXCLUDED.p99_4, p99_9 = EXCLUDED.p99_9, updated = EXCLUDED.updated")
+
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(query, (list(plate_acq_ids),))
+        cursor.close()
+        conn.commit()
+
+    except Exception as err:
+        logging.exception("Message")
+        raise err
+    finally:
+        put_connection(conn)
+
+
+def fail_thumb_job(job_id: int, attempts: int, max_attempts: int, error: str):
+    """
+    Puts job back in queue with a delay that doubles every attempt (image could still be uploading),
+    after max_attempts the job is left with state 'failed'
+    """
+
+    conn = None
+    try:
+        if attempts < max_attempts:
+            state = 'queued'
+        else:
+            state = 'failed'
+        retry_delay = 10 * 2 ** (attempts - 1) # sec
+
+        query = ("UPDATE thumb_job "
+                 "SET state = %s, not_before = now() + %s * interval '1 second', error = %s "
+                 "WHERE id = %s")
+
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute(query, (state, retry_delay, error, job_id))
+        cursor.close()
+        conn.commit()
+
+    except Exception as err:
+        logging.exception("Message")
+        raise err
+    finally:
+        put_connection(conn)
+
+
+def make_compressed_copy_path(path):
+    if not path.startswith(imgdb_settings.IMAGES_ORIG_ROOT_DIR):
+        return None
+    rel_path = os.path.relpath(path, imgdb_settings.IMAGES_ORIG_ROOT_DIR)
+    return os.path.splitext(os.path.join(imgdb_settings.IMAGES_COMPRESSED_ROOT_DIR, rel_path))[0] + '.png'
+
+
+def make_job_derivatives(job):
+    """
+    Derivatives stage of thumb pipeline (decode workers): makes thumb (and compressed copy), intensity stats
+    and content hash. Returns (job, derivatives, error), a corrupted image gives an error instead of stopping it all
+    """
+
+    job_id, image_id, path, attempts = job
+
+    thumb_path = image_tools.make_thumb_path(path, imgdb_settings.IMAGES_THUMB_FOLDER)
+    logging.debug(thumb_path)
+
+    compressed_path = None
+    if imgdb_settings.MAKE_COMPRESSED_COPY:
+        compressed_path = make_compressed_copy_path(path)
+
+    # make inside try-catch so a corrupted image doesn't stop it all
+    # the image is only read once for thumb, compressed copy and stats
+    try:
+        # stat is a round trip to the file server, latency tells how loaded it is
+        start_stat = time.time()
+        stat = os.stat(path)
+        thumb_budget.observe_read(time.time() - start_stat)
+
+        # backfill images wait for io budget, images of live acquisitions are never throttled
+        if io_budget.is_backfill(stat.st_mtime, imgdb_settings.BACKFILL_MIN_AGE):
+            thumb_budget.acquire(1, stat.st_size)
+
+        with metrics.THUMB_SECONDS.time(), thumb_budget.decode():
+            derivatives = image_tools.make_derivatives(path, thumb_path, compressed_path, False)
+    except Exception as e:
+        logging.error("Exception making thumb image: %s", e)
+        logging.error("image: " + str(path))
+        return job, None, e
+
+    return job, derivatives, None
+
+
+def iter_claimed_thumb_jobs(worker_id, batch_size, sleep_time, claim_timeout):
+    """
+    Claim stage of thumb pipeline (pipeline source thread), only sleeps when queue is empty
+    """
+    while True:
+        jobs = claim_thumb_jobs(worker_id, batch_size, claim_timeout)
+        if len(jobs) == 0:
+            time.sleep(sleep_time)
+            continue
+        yield from jobs
+
+
+def write_done_jobs(thumb_pipeline, done_jobs, start):
+    """
+    DB write stage of thumb pipeline (worker_loop thread), returns plate_acquisition ids with stale
+    channel_intensity_stats. If the write fails the worker goes on, the jobs are still running
+    in db and are claimed again after claim_timeout
+    """
+    start_write = time.time()
+    try:
+        stale_plate_acq_ids = finish_thumb_jobs(done_jobs)
+    except Exception:
+        logging.error(f"writing {len(done_jobs)} finished thumb jobs failed, they are claimed again after claim timeout")
+        return set()
+
+    thumb_pipeline.sink_done(None, time.time() - start_write, len(done_jobs))
+    logging.info(f"thumbs done: {len(done_jobs)}, elapsed: {time.time() - start} sek")
+    return stale_plate_acq_ids
+
+
+def worker_loop(batch_size, sleep_time, max_attempts, claim_timeout, decode_workers=imgdb_settings.THUMB_WORKER_DECODE_WORKERS,
+                stats_refresh_interval=imgdb_settings.THUMB_WORKER_STATS_REFRESH_INTERVAL):
+    """
+    Thumb pipeline: claim jobs -> make derivatives (decode_workers threads) -> db write of finished jobs
+    in batches (this thread), with bounded queues so decodes overlap with claims and db writes.
+    channel_intensity_stats of acquisitions with new stats are refreshed every stats_refresh_interval sec
+    """
+
+    # unique per process so it is possible to see in db which worker has a job
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+    logging.info("worker_id: " + worker_id)
+
+    stale_plate_acq_ids = set()
+    next_stats_refresh = time.time() + stats_refresh_interval
+
+    # the claim stage ends when claiming fails (e.g. db restarted), then a new pipeline is started after sleep_time
+    while True:
+        thumb_pipeline = pipeline.Pipeline('thumb',
+                                           [pipeline.Stage('derivatives', make_job_derivatives, decode_workers, batch_size)],
+                                           source_name='claim',
+                                           sink_name='db_write',
+                                           output_queue_size=batch_size)
+
+        done_jobs = []
+        start = time.time()
+        for result in thumb_pipeline.run(iter_claimed_thumb_jobs(worker_id, batch_size, sleep_time, claim_timeout), idle_timeout=1):
+
+            if isinstance(result, pipeline.StageFailure) and result.item is None:
+                # jobs claimed before the failure still come out of the pipeline
+                logging.error(f"claiming thumb jobs failed, retry in {sleep_time} sek: {result.error}")
+                continue
+
+            if isinstance(result, pipeline.StageFailure):
+                job, derivatives, error = result.item, None, result.error
+            elif result is not None:
+                job, derivatives, error = result
+
+            if result is not None:
+                job_id, image_id, path, attempts = job
+                if error is None:
+                    done_jobs.append((job_id, image_id, derivatives))
+                    metrics.THUMBS_DONE.inc()
+                else:
+                    metrics.THUMBS_FAILED.inc()
+                    logging.error(f"attempt {attempts} of {max_attempts}, image: {path}")
+                    fail_thumb_job(job_id, attempts, max_attempts, str(error))
+
+            # finished jobs are written a batch at a time, or when no more jobs are coming right now
+            if len(done_jobs) >= batch_size or (result is None and len(done_jobs) > 0):
+                stale_plate_acq_ids |= write_done_jobs(thumb_pipeline, done_jobs, start)
+                done_jobs = []
+                start = time.time()
+
+            # one aggregation per acquisition and interval, not per batch
+            if len(stale_plate_acq_ids) > 0 and time.time() >= next_stats_refresh:
+                refresh_channel_intensity_stats(stale_plate_acq_ids)
+                stale_plate_acq_ids = set()
+                next_stats_refresh = time.time() + stats_refresh_interval
+
+        if len(done_jobs) > 0:
+            stale_plate_acq_ids |= write_done_jobs(thumb_pipeline, done_jobs, start)
+
+        time.sleep(sleep_time)
+
+#
+#  Main entry for script
+#
+try:
+    #
+    # Configure logging
+    #
+    logging.basicConfig(format='%(asctime)s,%(msecs)d %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
+                        datefmt='%H:%M:%S',
+                        level=logging.INFO)
+
+    rootLogger = logging.getLogger()
+
+    parser = argparse.ArgumentParser(description='Makes thumbnails for jobs in the thumb_job table, enqueued by image-monitor')
+
+    parser.add_argument('-bs', '--batch-size', help='Number of jobs claimed per db round trip',
+                        type=int, default=imgdb_settings.THUMB_WORKER_BATCH_SIZE)
+    parser.add_argument('-pi', '--poll-interval', help='Seconds to sleep when queue is empty',
+                        type=int, default=imgdb_settings.THUMB_WORKER_POLL_INTERVAL)
+    parser.add_argument('-ma', '--max-attempts', help='Attempts before a job is left as failed',
+                        type=int, default=imgdb_settings.THUMB_WORKER_MAX_ATTEMPTS)
+    parser.add_argument('-ct', '--claim-timeout', help='Seconds before a job claimed by a dead worker is claimed again',
+                        type=int, default=imgdb_settings.THUMB_WORKER_CLAIM_TIMEOUT)
+    parser.add_argument('-dw', '--decode-workers', help='Threads decoding images and writing thumbnails',
+                        type=int, default=imgdb_settings.THUMB_WORKER_DECODE_WORKERS)
+    parser.add_argument('-mp', '--metrics-port', help='Port of Prometheus metrics endpoint, 0 to disable',
+                        type=int, default=imgdb_settings.THUMB_WORKER_METRICS_PORT)
+    parser.add_argument('-sri', '--stats-refresh-interval', help='Seconds between refreshes of channel intensity stats of acquisitions with new images',
+                        type=int, default=imgdb_settings.THUMB_WORKER_STATS_REFRESH_INTERVAL)
+
+    args = parser.parse_args()
+
+    logging.debug(args)
+
+    metrics.start_metrics_server(args.metrics_port)
+
+    worker_loop(args.batch_size,
+                args.poll_interval,
+                args.max_attempts,
+                args.claim_timeout,
+                args.decode_workers,
+                args.stats_refresh_interval)
+
+except Exception as e:
+    print(traceback.format_exc())
+    logging.info("Exception out of script")
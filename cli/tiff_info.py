@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import logging
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+# In process replacement for `tiffinfo -i <path>` + image_tools.colon_delimited_to_dict.
+# Only the header and the IFD (tag) blocks are read, never any pixel data.
+# Each directory is rendered as the lines libtiff's TIFFPrintDirectory prints and then
+# split the same way as the tiffinfo output was, so the resulting dict has the same
+# keys and values as before (tags libtiff doesn't know are printed as "Tag <number>")
+
+# type: (struct format char, size in bytes)
+TIFF_TYPES = {
+    1: ('B', 1),   # BYTE
+    2: ('s', 1),   # ASCII
+    3: ('H', 2),   # SHORT
+    4: ('I', 4),   # LONG
+    5: ('II', 8),  # RATIONAL
+    6: ('b', 1),   # SBYTE
+    7: ('B', 1),   # UNDEFINED
+    8: ('h', 2),   # SSHORT
+    9: ('i', 4),   # SLONG
+    10: ('ii', 8), # SRATIONAL
+    11: ('f', 4),  # FLOAT
+    12: ('d', 8),  # DOUBLE
+    13: ('I', 4),  # IFD
+    16: ('Q', 8),  # LONG8
+    17: ('q', 8),  # SLONG8
+    18: ('Q', 8),  # IFD8
+}
+
+# Tags that are not printed by tiffinfo (without -s/-j flags) so their values are never read
+NOT_PRINTED_TAGS = (255, 273, 279, 324, 325, 347, 513, 514)
+
+# Tags printed by libtiff as "  <name>: <value>"
+NAMED_TAGS = {
+    269: 'DocumentName',
+    270: 'ImageDescription',
+    271: 'Make',
+    272: 'Model',
+    285: 'PageName',
+    305: 'Software',
+    306: 'DateTime',
+    315: 'Artist',
+    316: 'HostComputer',
+    319: 'PrimaryChromaticities',
+    337: 'TargetPrinter',
+    33432: 'Copyright',
+    34665: 'EXIFIFDOffset',
+    34853: 'GPSIFDOffset',
+}
+
+COMPRESSION_NAMES = {
+    1: 'None', 2: 'CCITT RLE', 3: 'CCITT Group 3', 4: 'CCITT Group 4', 5: 'LZW',
+    6: 'Old-style JPEG', 7: 'JPEG', 8: 'AdobeDeflate', 32766: 'NeXT', 32771: 'CCITT RLE/W',
+    32773: 'PackBits', 32809: 'ThunderScan', 32909: 'PixarLog', 32946: 'Deflate',
+    34661: 'ISO JBIG', 34676: 'SGILog', 34677: 'SGILog24', 34925: 'LZMA', 50000: 'ZSTD', 50001: 'WEBP',
+}
+
+PHOTOMETRIC_NAMES = {
+    0: 'min-is-white', 1: 'min-is-black', 2: 'RGB color', 3: 'palette color (RGB from colormap)',
+    4: 'transparency mask', 5: 'separated', 6: 'YCbCr', 8: 'CIE L*a*b*', 9: 'ICC L*a*b*',
+    10: 'ITU L*a*b*', 32844: 'CIE Log2(L)', 32845: "CIE Log2(L) (u',v')",
+}
+
+SAMPLE_FORMAT_NAMES = {
+    1: 'unsigned integer', 2: 'signed integer', 3: 'IEEE floating point', 4: 'void',
+    5: 'complex signed integer', 6: 'complex IEEE floating point',
+}
+
+ORIENTATION_NAMES = {
+    1: 'row 0 top, col 0 lhs', 2: 'row 0 top, col 0 rhs', 3: 'row 0 bottom, col 0 rhs',
+    4: 'row 0 bottom, col 0 lhs', 5: 'row 0 lhs, col 0 top', 6: 'row 0 rhs, col 0 top',
+    7: 'row 0 rhs, col 0 bottom', 8: 'row 0 lhs, col 0 bottom',
+}
+
+# Max number of directories read from one file, protects against looping IFD chains
+MAX_DIRECTORIES = 100000
+
+# Tag values larger than this are skipped (corrupt count would otherwise allocate huge buffers)
+MAX_TAG_DATA_SIZE = 16 * 1024 * 1024
+
+
+def read_tiff_info(path):
+    """
+    Returns dict of tiff tags in same format as the previous `tiffinfo -i` output parsing.
+    For multi-page tiffs a later directory overwrites keys of earlier ones, like before.
+    Returns empty dict if file is not a tiff
+    """
+    return colon_delimited_to_dict("\n".join(read_tiff_info_lines(path)))
+
+
+def read_tiff_info_many(paths, max_workers=8, before_read=None):
+    """
+    Batch variant of read_tiff_info, returns dict with path as key.
+    Files are read in a thread pool so NFS latency is overlapped.
+    before_read is called (in the pool thread) before each file is read, e.g. to rate limit.
+    A file that can't be read gets an empty string as value (so a bad image doesn't stop a batch)
+    """
+    def read_no_raise(path):
+        if before_read is not None:
+            before_read()
+        try:
+            return read_tiff_info(path)
+        except Exception as e:
+            logging.error("Exception reading tiff meta: %s", e)
+            logging.error("image: " + str(path))
+            return ""
+
+    paths = list(paths)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(paths, executor.map(read_no_raise, paths)))
+
+
+def colon_delimited_to_dict(inputString):
+    # for each line in result, split into key-val on delimiter(colon)
+    splitted = inputString.splitlines()
+    result = {}
+    for line in splitted:
+        key_val = line.split(':')
+        # only process lines with delimiter
+        if len(key_val) == 2:
+            result[key_val[0].strip()] = key_val[1].strip()
+
+    return result
+
+
+def file_meta_hash(file_meta):
+    """
+    Hash of a tiff info dict independent of key order, identifies an interned header set
+    """
+    return hashlib.md5(json.dumps(file_meta, sort_keys=True).encode()).hexdigest()
+
+
+def diff_file_meta(base, file_meta):
+    """
+    Returns the fields of file_meta that differ from base, fields missing in file_meta as None.
+    base updated with the diff (and None fields removed) is file_meta again
+    """
+    diff = {key: value for key, value in file_meta.items() if base.get(key) != value}
+    for key in base:
+        if key not in file_meta:
+            diff[key] = None
+    return diff
+
+
+def read_tiff_info_lines(path):
+    """
+    Returns list of lines as printed by tiffinfo for all directories in file
+    """
+    lines = []
+    with open(path, 'rb') as f:
+
+        header = f.read(16)
+        if len(header) < 8:
+            return lines
+
+        if header[:2] == b'II':
+            byteorder = '<'
+        elif header[:2] == b'MM':
+            byteorder = '>'
+        else:
+            return lines
+
+        version = struct.unpack(byteorder + 'H', header[2:4])[0]
+        if version == 42:
+            bigtiff = False
+            offset = struct.unpack(byteorder + 'I', header[4:8])[0]
+        elif version == 43 and len(header) >= 16:
+            bigtiff = True
+            offset = struct.unpack(byteorder + 'Q', header[8:16])[0]
+        else:
+            return lines
+
+        seen_offsets = set()
+        while offset != 0 and offset not in seen_offsets and len(seen_offsets) < MAX_DIRECTORIES:
+            seen_offsets.add(offset)
+            try:
+                tags, next_offset = read_directory(f, offset, byteorder, bigtiff)
+            except (struct.error, ValueError, OSError) as e:
+                # truncated or corrupt directory (like tiffinfo -i, keep what was read)
+                logging.debug(f"could not read directory at {offset} in {path}: {e}")
+                break
+            lines.extend(directory_to_lines(offset, tags))
+            offset = next_offset
+
+    return lines
+
+
+def read_directory(f, offset, byteorder, bigtiff):
+    """
+    Returns dict with tag as key and (type, values) as value, and offset of next directory
+    """
+    if bigtiff:
+        count_format, entry_size, inline_size, offset_format = 'Q', 20, 8, 'Q'
+    else:
+        count_format, entry_size, inline_size, offset_format = 'H', 12, 4, 'I'
+
+    f.seek(offset)
+    count_size = struct.calcsize(count_format)
+    entry_count = struct.unpack(byteorder + count_format, read_exactly(f, count_size))[0]
+
+    # read all entries and the next-offset in one read
+    offset_size = struct.calcsize(offset_format)
+    block = read_exactly(f, entry_count * entry_size + offset_size)
+    next_offset = struct.unpack(byteorder + offset_format, block[-offset_size:])[0]
+
+    tags = dict()
+    for i in range(entry_count):
+        entry = block[i * entry_size:(i + 1) * entry_size]
+        if bigtiff:
+            tag, type, count = struct.unpack(byteorder + 'HHQ', entry[:12])
+            value_field = entry[12:20]
+        else:
+            tag, type, count = struct.unpack(byteorder + 'HHI', entry[:8])
+            value_field = entry[8:12]
+
+        if tag in NOT_PRINTED_TAGS or type not in TIFF_TYPES:
+            continue
+
+        value_format, value_size = TIFF_TYPES[type]
+        data_size = value_size * count
+        if data_size > MAX_TAG_DATA_SIZE:
+            continue
+        if data_size <= inline_size:
+            data = value_field[:data_size]
+        else:
+            data_offset = struct.unpack(byteorder + offset_format, value_field[:offset_size])[0]
+            pos = f.tell()
+            f.seek(data_offset)
+            data = read_exactly(f, data_size)
+            f.seek(pos)
+
+        tags[tag] = (type, decode_values(data, type, count, byteorder))
+
+    return tags, next_offset
+
+
+def read_exactly(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise ValueError("unexpected end of file")
+    return data
+
+
+def decode_values(data, type, count, byteorder):
+    if type == 2:
+        # ASCII, printed up to first NUL
+        return data.split(b'\0', 1)[0].decode('latin-1')
+    value_format, value_size = TIFF_TYPES[type]
+    values = struct.unpack(byteorder + value_format * count, data)
+    if type in (5, 10):
+        # rationals are stored as float by libtiff
+        values = tuple(num / den if den != 0 else 0.0 for num, den in zip(values[0::2], values[1::2]))
+    return values
+
+
+def format_value(type, value):
+    if type in (7, 13, 18):
+        return f"0x{value:x}"
+    if type in (5, 10, 11, 12):
+        return f"{value:f}"
+    return f"{value}"
+
+
+def format_name(names, value):
+    name = names.get(value)
+    if name is None:
+        return f"{value} (0x{value:x})"
+    return name
+
+
+def directory_to_lines(offset, tags):
+    """
+    Same lines and order as libtiff TIFFPrintDirectory (the ones that matter for the dict)
+    """
+
+    def first(tag, default=None):
+        if tag in tags:
+            return tags[tag][1][0]
+        return default
+
+    lines = [f"TIFF Directory at offset 0x{offset:x} ({offset})"]
+
+    if 254 in tags:
+        subfile_type = first(254)
+        line = "  Subfile Type:"
+        sep = " "
+        if subfile_type & 1:
+            line += sep + "reduced-resolution image"
+            sep = "/"
+        if subfile_type & 2:
+            line += sep + "multi-page document"
+            sep = "/"
+        if subfile_type & 4:
+            line += sep + "transparency mask"
+        lines.append(line + f" ({subfile_type} = 0x{subfile_type:x})")
+
+    if 256 in tags or 257 in tags:
+        line = f"  Image Width: {first(256, 0)} Image Length: {first(257, 0)}"
+        if 32997 in tags:
+            line += f" Image Depth: {first(32997)}"
+        lines.append(line)
+
+    if 322 in tags or 323 in tags:
+        line = f"  Tile Width: {first(322, 0)} Tile Length: {first(323, 0)}"
+        if 32998 in tags:
+            line += f" Tile Depth: {first(32998)}"
+        lines.append(line)
+
+    if 282 in tags or 283 in tags:
+        line = f"  Resolution: {first(282, 0.0):g}, {first(283, 0.0):g}"
+        if 296 in tags:
+            unit = first(296)
+            if unit == 1:
+                line += " (unitless)"
+            elif unit == 2:
+                line += " pixels/inch"
+            elif unit == 3:
+                line += " pixels/cm"
+            else:
+                line += f" (unit {unit} = 0x{unit:x})"
+        lines.append(line)
+
+    if 286 in tags or 287 in tags:
+        lines.append(f"  Position: {first(286, 0.0):g}, {first(287, 0.0):g}")
+
+    if 258 in tags:
+        lines.append(f"  Bits/Sample: {first(258)}")
+
+    if 339 in tags:
+        lines.append("  Sample Format: " + format_name(SAMPLE_FORMAT_NAMES, first(339)))
+
+    # libtiff always sets compression (None if tag is missing)
+    lines.append("  Compression Scheme: " + format_name(COMPRESSION_NAMES, first(259, 1)))
+
+    if 262 in tags:
+        lines.append("  Photometric Interpretation: " + format_name(PHOTOMETRIC_NAMES, first(262)))
+
+    if 338 in tags:
+        extra_names = {0: 'unspecified', 1: 'assoc-alpha', 2: 'unassoc-alpha'}
+        values = tags[338][1]
+        lines.append(f"  Extra Samples: {len(values)}<" + ", ".join(format_name(extra_names, v) for v in values) + ">")
+
+    if 263 in tags:
+        lines.append("  Thresholding: " + format_name({1: 'bilevel art scan', 2: 'halftone or dithered scan', 3: 'error diffused'}, first(263)))
+
+    if 266 in tags:
+        lines.append("  FillOrder: " + format_name({1: 'msb-to-lsb', 2: 'lsb-to-msb'}, first(266)))
+
+    if 530 in tags:
+        values = tags[530][1]
+        lines.append(f"  YCbCr Subsampling: {values[0]}, {values[-1]}")
+
+    if 531 in tags:
+        lines.append("  YCbCr Positioning: " + format_name({1: 'centered', 2: 'cosited'}, first(531)))
+
+    if 321 in tags:
+        values = tags[321][1]
+        lines.append(f"  Halftone Hints: light {values[0]} dark {values[-1]}")
+
+    if 274 in tags:
+        lines.append("  Orientation: " + format_name(ORIENTATION_NAMES, first(274)))
+
+    if 277 in tags:
+        lines.append(f"  Samples/Pixel: {first(277)}")
+
+    if 278 in tags:
+        rows_per_strip = first(278)
+        if rows_per_strip == 0xffffffff:
+            lines.append("  Rows/Strip: (infinite)")
+        else:
+            lines.append(f"  Rows/Strip: {rows_per_strip}")
+
+    if 280 in tags:
+        lines.append(f"  Min Sample Value: {first(280)}")
+
+    if 281 in tags:
+        lines.append(f"  Max Sample Value: {first(281)}")
+
+    if 340 in tags:
+        lines.append(f"  SMin Sample Value: {first(340):g}")
+
+    if 341 in tags:
+        lines.append(f"  SMax Sample Value: {first(341):g}")
+
+    # libtiff always sets planar config (contig if tag is missing)
+    lines.append("  Planar Configuration: " + format_name({1: 'single image plane', 2: 'separate image planes'}, first(284, 1)))
+
+    if 297 in tags:
+        values = tags[297][1]
+        lines.append(f"  Page Number: {values[0]}-{values[-1]}")
+
+    if 320 in tags:
+        lines.append("  Color Map: (present)")
+
+    if 301 in tags:
+        lines.append("  Transfer Function: (present)")
+
+    if 330 in tags:
+        lines.append("  SubIFD Offsets:" + "".join(f" {v:5d}" for v in tags[330][1]))
+
+    # Custom fields
+    for tag in sorted(tags):
+        type, values = tags[tag]
+
+        if tag < 32768 and tag not in NAMED_TAGS and tag not in (317, 318, 532, 700, 33723, 34377, 34675):
+            # baseline tag handled above (or not printed by libtiff)
+            continue
+        if tag in (32997, 32998):
+            continue
+
+        if tag == 318:
+            lines.append(f"  White Point: {values[0]:g}-{values[-1]:g}")
+        elif tag == 532:
+            lines.append("  Reference Black/White:")
+            for i in range(min(3, len(values) // 2)):
+                lines.append(f"    {i:2d}: {values[2 * i]:5g} {values[2 * i + 1]:5g}")
+        elif tag == 700:
+            lines.append("  XMLPacket (XMP Metadata):")
+            lines.extend(bytes(values).decode('latin-1').splitlines())
+        elif tag == 33723:
+            lines.append(f"  RichTIFFIPTC Data: <present>, {len(values) * TIFF_TYPES[type][1]} bytes")
+        elif tag == 34377:
+            lines.append(f"  Photoshop Data: <present>, {len(values)} bytes")
+        elif tag == 34675:
+            lines.append(f"  ICC Profile: <present>, {len(values)} bytes")
+        elif tag == 317:
+            # printed by the codec (only for codecs with predictor support)
+            if first(259, 1) in (5, 8, 32946, 34925, 50000):
+                predictor = values[0]
+                predictor_names = {1: 'none ', 2: 'horizontal differencing ', 3: 'floating point predictor '}
+                lines.append(f"  Predictor: {predictor_names.get(predictor, '')}{predictor} (0x{predictor:x})")
+        else:
+            name = NAMED_TAGS.get(tag, f"Tag {tag}")
+            if type == 2:
+                # multi-line strings (e.g. ImageDescription) end up as several lines, like in tiffinfo
+                lines.extend(f"  {name}: {values}".splitlines())
+            elif tag in (34665, 34853):
+                # libtiff reads the sub-IFD offsets as IFD8, printed in hex
+                lines.append(f"  {name}: " + ",".join(format_value(18, v) for v in values))
+            else:
+                lines.append(f"  {name}: " + ",".join(format_value(type, v) for v in values))
+
+    return lines
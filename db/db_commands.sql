@@ -20,6 +20,7 @@ DROP TABLE IF EXISTS images CASCADE;
 CREATE TABLE images (
     id                      bigserial PRIMARY KEY,
     plate_acquisition_id    serial,
+    project                 text,
     plate_barcode           text,
     timepoint               int,
     well                    text,
@@ -44,6 +45,26 @@ CREATE INDEX  ix_images_plate_acquisition_name ON images(plate_acquisition_name)
 CREATE INDEX  ix_images_plate_barcode_textsearch ON images USING GIN (to_tsvector('english', plate_barcode));
 CREATE INDEX  ix_images_plate_acquisition_name_textsearch ON images USING GIN (to_tsvector('english', plate_acquisition_name));
 
+-- path must be unique so image-monitor can bulk insert with ON CONFLICT (path) DO NOTHING
+-- (remove duplicates first, e.g. with dbscripts deal_with_dupes, before adding constraint to existing db)
+ALTER TABLE images ADD CONSTRAINT constr_unique_images_path UNIQUE (path);
+
+-- z-plane of image, set by image-monitor from the filename (0 when not a z-stack)
+ALTER TABLE images ADD COLUMN z int;
+
+-- set by thumb-worker when the thumbnail of the image has been written (NULL until then)
+ALTER TABLE images ADD COLUMN thumb_ready timestamp;
+-- min/max/mean, percentiles and 256 bin histogram (over min..max) of original pixel values,
+-- set by thumb-worker from the same decode as the thumb
+ALTER TABLE images ADD COLUMN intensity_stats jsonb;
+-- xxh3-128 hex digest and size of the bytes thumb-worker read (and decoded), for verification and dedup
+ALTER TABLE images ADD COLUMN content_hash text;
+ALTER TABLE images ADD COLUMN file_size bigint;
+CREATE INDEX  ix_images_content_hash ON images(content_hash);
+-- interned tiff header set of the image (image_file_meta), file_meta then only holds the fields that
+-- differ from it (removed fields as null), see images_file_meta_view for the complete header
+ALTER TABLE images ADD COLUMN file_meta_id bigint;
+
 -- ALTER TABLE images ADD COLUMN plate_acquisition_name text;
 -- UPDATE images SET plate_acquisition_name=plate_barcode;
 
@@ -56,7 +77,7 @@ CREATE TABLE plate_acquisition (
   microscope        text,
   channel_map_id    int,
   timepoint         int,
-  folder            text
+  folder            text,
   name              text,
   project           text,
   finished          timestamp
@@ -70,6 +91,14 @@ CREATE INDEX ix_plate_acquisition_project ON plate_acquisition(project);
 CREATE INDEX ix_plate_acquisition_imaged ON plate_acquisition(imaged);
 CREATE INDEX ix_plate_acquisition_finished ON plate_acquisition(finished);
 
+-- one acquisition per folder, image-monitor inserts with ON CONFLICT (folder) DO NOTHING
+-- so two monitors racing on a new folder get the same plate_acquisition
+ALTER TABLE plate_acquisition ADD CONSTRAINT constr_unique_plate_acquisition_folder UNIQUE (folder);
+
+-- number of images of complete acquisition, image-monitor sets acquisition finished as soon as this many
+-- images are in db. When NULL it is computed from plate layout, channel_map and acquisition_protocol
+ALTER TABLE plate_acquisition ADD COLUMN expected_images int;
+
 
 CREATE OR REPLACE VIEW plate_acquisition_v1 AS
   SELECT
@@ -102,6 +131,87 @@ CREATE TABLE new_plate_acquisition (
 CREATE INDEX ix_new_plate_acquisition_folder ON new_plate_acquisition(folder);
 
 
+-- Thumbnail jobs, enqueued by image-monitor and claimed by any number of thumb-worker
+-- processes with SELECT ... FOR UPDATE SKIP LOCKED
+DROP TABLE IF EXISTS thumb_job CASCADE;
+CREATE TABLE thumb_job (
+  id                bigserial PRIMARY KEY,
+  image_id          bigint,
+  path              text,
+  state             text DEFAULT 'queued',
+  attempts          int DEFAULT 0,
+  not_before        timestamp DEFAULT now(),
+  claimed_by        text,
+  claimed_at        timestamp,
+  error             text,
+  created           timestamp DEFAULT now()
+);
+CREATE INDEX ix_thumb_job_state_not_before ON thumb_job(state, not_before);
+CREATE INDEX ix_thumb_job_image_id ON thumb_job(image_id);
+
+
+-- Start time of last completed poll per root dir of image-monitor, after a restart only dirs modified
+-- since then (minus poll margin) are imported instead of an exhaustive initial poll
+DROP TABLE IF EXISTS poll_checkpoint CASCADE;
+CREATE TABLE poll_checkpoint (
+  root_dir          text PRIMARY KEY,
+  last_poll         double precision,
+  updated           timestamp DEFAULT now()
+);
+
+
+-- Dirs where import failed, image-monitor retries them after next_retry (epoch sec),
+-- the delay doubles with every failed attempt
+DROP TABLE IF EXISTS dir_quarantine CASCADE;
+CREATE TABLE dir_quarantine (
+  path              text PRIMARY KEY,
+  reason            text,
+  attempts          int,
+  next_retry        double precision,
+  first_failed      timestamp DEFAULT now(),
+  last_failed       timestamp DEFAULT now()
+);
+
+
+-- Folder leases of image-monitor, only the monitor holding the lease imports the folder so several
+-- monitors can share the work. Leases not renewed before expires (monitor died) are claimed by others
+DROP TABLE IF EXISTS folder_lease CASCADE;
+CREATE TABLE folder_lease (
+  folder            text PRIMARY KEY,
+  owner             text NOT NULL,
+  expires           timestamp NOT NULL
+);
+CREATE INDEX ix_folder_lease_owner ON folder_lease(owner);
+
+
+-- Directory scan state of image-monitor, a dir is only listed again when its mtime changed
+-- and an image dir is only imported again when its mtime differs from imported_mtime
+DROP TABLE IF EXISTS dir_scan_state CASCADE;
+CREATE TABLE dir_scan_state (
+  path              text PRIMARY KEY,
+  mtime             double precision,
+  entry_count       int,
+  subdirs           text[],
+  is_img_dir        boolean,
+  has_single_images boolean,
+  imported_mtime    double precision,
+  imported          double precision,
+  updated           timestamp DEFAULT now()
+);
+
+
+-- Tiff header sets (file_meta) of image-monitor, each distinct one stored once per acquisition
+-- and referenced by images.file_meta_id instead of repeated in every image row
+DROP TABLE IF EXISTS image_file_meta CASCADE;
+CREATE TABLE image_file_meta (
+  id                    bigserial PRIMARY KEY,
+  plate_acquisition_id  int,
+  hash                  text,
+  file_meta             jsonb
+);
+ALTER TABLE image_file_meta ADD CONSTRAINT constr_unique_image_file_meta UNIQUE (plate_acquisition_id, hash);
+
+
 DROP TABLE IF EXISTS  channel_map CASCADE;
 CREATE TABLE channel_map (
   map_id       int,
@@ -179,7 +289,7 @@ CREATE TABLE channel_map_mapping (
 );
 CREATE INDEX  ix_channel_map_mapping_plate_acquisition_name ON channel_map_mapping(plate_acquisition_name);
 CREATE INDEX  ix_channel_map_mapping_channel_map ON channel_map_mapping(channel_map);
-CREATE INDEX  ix_channel_map_mapping_project ON channel_map_mapping(channprojectel_map);
+CREATE INDEX  ix_channel_map_mapping_project ON channel_map_mapping(project);
 
 INSERT INTO "channel_map_mapping" ("plate_acquisition_name", "channel_map") VALUES
 ('exp180-subset', 8);
@@ -197,6 +307,18 @@ INSERT INTO "channel_map_mapping" ("plate_acquisition_name", "channel_map") VALU
 ('Bluewasher-FA-U2OS-24h', 11);
 
 
+-- Sites per well and z-planes of acquisitions, (project, '*') for whole project as in channel_map_mapping.
+-- image-monitor computes expected images of an acquisition as wells in plate layout x sites x channels x z
+DROP TABLE IF EXISTS acquisition_protocol CASCADE;
+CREATE TABLE acquisition_protocol (
+  project                 text,
+  plate_acquisition_name  text,
+  sites_per_well          int,
+  z_planes                int DEFAULT 1
+);
+CREATE INDEX  ix_acquisition_protocol_project ON acquisition_protocol(project);
+
+
 ---> Import channel-map map
 ---> Then Update:
 UPDATE plate_acquisition
@@ -257,6 +379,62 @@ CREATE OR REPLACE VIEW images_all_view AS
      LEFT JOIN plate_layout ON (((plate.layout_id = plate_layout.layout_id) AND (plate_layout.well_id = images.well))))
      LEFT JOIN compound ON ((plate_layout.batch_id = compound.batchid)));
 
+-- Complete tiff header of images, interned header set with the per image fields applied
+-- (images imported before file_meta_id was added have the whole header in images.file_meta)
+CREATE OR REPLACE VIEW images_file_meta_view AS
+SELECT images.id AS image_id,
+    images.path,
+    jsonb_strip_nulls(COALESCE(image_file_meta.file_meta, '{}'::jsonb) ||
+                      CASE WHEN jsonb_typeof(images.file_meta) = 'object' THEN images.file_meta ELSE '{}'::jsonb END) AS file_meta
+   FROM (images
+     LEFT JOIN image_file_meta ON ((images.file_meta_id = image_file_meta.id)));
+
+-- Intensity stats of images (set by thumb-worker) rolled up per channel per acquisition,
+-- percentiles are medians over the images so a few saturated images don't move them.
+-- Used by the viewer to normalize all images of a channel in a plate the same way
+CREATE OR REPLACE VIEW channel_intensity_stats_view AS
+SELECT images.plate_acquisition_id,
+    images.channel,
+    count(*) AS image_count,
+    min((images.intensity_stats ->> 'min')::double precision) AS min,
+    max((images.intensity_stats ->> 'max')::double precision) AS max,
+    avg((images.intensity_stats ->> 'mean')::double precision) AS mean,
+    percentile_cont(0.5) WITHIN GROUP (ORDER BY (images.intensity_stats -> 'percentiles' ->> '0.1')::double precision) AS p0_1,
+    percentile_cont(0.5) WITHIN GROUP (ORDER BY (images.intensity_stats -> 'percentiles' ->> '0.6')::double precision) AS p0_6,
+    percentile_cont(0.5) WITHIN GROUP (ORDER BY (images.intensity_stats -> 'percentiles' ->> '1')::double precision) AS p1,
+    percentile_cont(0.5) WITHIN GROUP (ORDER BY (images.intensity_stats -> 'percentiles' ->> '50')::double precision) AS p50,
+    percentile_cont(0.5) WITHIN GROUP (ORDER BY (images.intensity_stats -> 'percentiles' ->> '99')::double precision) AS p99,
+    percentile_cont(0.5) WITHIN GROUP (ORDER BY (images.intensity_stats -> 'percentiles' ->> '99.4')::double precision) AS p99_4,
+    percentile_cont(0.5) WITHIN GROUP (ORDER BY (images.intensity_stats -> 'percentiles' ->> '99.9')::double precision) AS p99_9
+   FROM images
+  WHERE (images.intensity_stats ? 'percentiles')
+  GROUP BY images.plate_acquisition_id, images.channel;
+
+-- channel_intensity_stats_view stored per channel per acquisition, read by the viewer instead of
+-- aggregating all images of the plate per request. Refreshed by thumb-worker for the acquisitions
+-- it wrote stats of (at most every THUMB_WORKER_STATS_REFRESH_INTERVAL sec)
+DROP TABLE IF EXISTS channel_intensity_stats;
+CREATE TABLE channel_intensity_stats (
+    plate_acquisition_id    int,
+    channel                 int,
+    image_count             bigint,
+    min                     double precision,
+    max                     double precision,
+    mean                    double precision,
+    p0_1                    double precision,
+    p0_6                    double precision,
+    p1                      double precision,
+    p50                     double precision,
+    p99                     double precision,
+    p99_4                   double precision,
+    p99_9                   double precision,
+    updated                 timestamp DEFAULT now(),
+    PRIMARY KEY (plate_acquisition_id, channel)
+);
+
+-- fill from images already processed by thumb-worker (existing db)
+-- INSERT INTO channel_intensity_stats SELECT * FROM channel_intensity_stats_view;
+
 DROP VIEW images_minimal_view;
 CREATE OR REPLACE VIEW images_minimal_view AS
 SELECT images.id,
@@ -281,7 +459,8 @@ SELECT images.id,
     plate_acquisition.microscope,
     plate_acquisition.channel_map_id,
     channel_map.map_id,
-    channel_map.dye
+    channel_map.dye,
+    images.thumb_ready
    FROM ((((images
      LEFT JOIN plate_acquisition ON ((images.plate_acquisition_id = plate_acquisition.id)))
      LEFT JOIN channel_map ON (((plate_acquisition.channel_map_id = channel_map.map_id) AND (images.channel = channel_map.channel))))
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# the cli scripts import their modules (settings, pipeline, filenames, ...) from cli
+CLI_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'cli')
+sys.path.insert(0, CLI_DIR)
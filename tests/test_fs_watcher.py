@@ -0,0 +1,81 @@
+import os
+
+import pytest
+from inotify_simple import Event, flags
+
+import fs_watcher
+
+
+@pytest.fixture
+def watcher(tmp_path):
+    w = fs_watcher.ImageDirWatcher(('.tif', '.tiff'), ('.ome.tiff.not.used.anymore',))
+    w.add_tree(str(tmp_path))
+    yield w
+    w.inotify.close()
+
+
+def wd_of(watcher, path):
+    return next(wd for wd, dir_path in watcher.dirs.items() if dir_path == str(path))
+
+
+def test_images_from_events(watcher, tmp_path):
+    wd = wd_of(watcher, tmp_path)
+    events = [Event(wd, flags.CLOSE_WRITE, 0, 'a.tif'),
+              Event(wd, flags.MOVED_TO, 0, 'b.TIFF'),
+              Event(wd, flags.CLOSE_WRITE, 0, 'notes.txt'),
+              Event(wd, flags.CREATE, 0, 'c.tif'),
+              Event(wd + 1000, flags.CLOSE_WRITE, 0, 'unknown-wd.tif')]
+
+    assert watcher.new_images_from_events(events) == {str(tmp_path): [str(tmp_path / 'a.tif'), str(tmp_path / 'b.TIFF')]}
+
+
+def test_new_dir_is_watched_and_walked(watcher, tmp_path):
+    (tmp_path / 'plate' / 'sub').mkdir(parents=True)
+    (tmp_path / 'plate' / 'sub' / 'img.tif').write_bytes(b'')
+    wd = wd_of(watcher, tmp_path)
+
+    new_images = watcher.new_images_from_events([Event(wd, flags.CREATE | flags.ISDIR, 0, 'plate')])
+
+    assert new_images == {str(tmp_path / 'plate' / 'sub'): [str(tmp_path / 'plate' / 'sub' / 'img.tif')]}
+    assert str(tmp_path / 'plate' / 'sub') in watcher.dirs.values()
+
+
+def test_overflow_is_taken_once(watcher):
+    assert watcher.new_images_from_events([Event(-1, flags.Q_OVERFLOW, 0, '')]) == {}
+    assert watcher.take_overflow()
+    assert not watcher.take_overflow()
+
+
+def test_moved_from_and_ignored_remove_watches(watcher, tmp_path):
+    (tmp_path / 'plate' / 'sub').mkdir(parents=True)
+    (tmp_path / 'other').mkdir()
+    watcher.add_tree(str(tmp_path))
+    wd = wd_of(watcher, tmp_path)
+    other_wd = wd_of(watcher, tmp_path / 'other')
+
+    watcher.new_images_from_events([Event(wd, flags.MOVED_FROM | flags.ISDIR, 0, 'plate')])
+    assert set(watcher.dirs.values()) == {str(tmp_path), str(tmp_path / 'other')}
+
+    watcher.new_images_from_events([Event(other_wd, flags.IGNORED, 0, '')])
+    assert set(watcher.dirs.values()) == {str(tmp_path)}
+
+
+def test_real_events(watcher, tmp_path):
+    (tmp_path / 'plate').mkdir()
+    with open(tmp_path / 'top.tif', 'wb') as f:
+        f.write(b'x')
+
+    new_images = watcher.read_new_images(1)
+    assert new_images[str(tmp_path)] == [str(tmp_path / 'top.tif')]
+
+    # files in the new dir are reported after its watch is added
+    with open(tmp_path / 'plate' / 'a.tif', 'wb') as f:
+        f.write(b'x')
+    assert watcher.read_new_images(1) == {str(tmp_path / 'plate'): [str(tmp_path / 'plate' / 'a.tif')]}
+
+    # a renamed dir is watched with its new path only
+    os.rename(tmp_path / 'plate', tmp_path / 'plate-renamed')
+    watcher.read_new_images(1)
+    with open(tmp_path / 'plate-renamed' / 'b.tif', 'wb') as f:
+        f.write(b'x')
+    assert watcher.read_new_images(1) == {str(tmp_path / 'plate-renamed'): [str(tmp_path / 'plate-renamed' / 'b.tif')]}
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+import image_tools
+
+
+def test_intensity_stats_of_16bit():
+    rng = np.random.default_rng(1)
+    img = rng.integers(100, 4000, size=(64, 64), dtype=np.uint16)
+
+    stats = image_tools.intensity_stats(img)
+
+    assert stats['dtype'] == 'uint16'
+    assert stats['min'] == img.min()
+    assert stats['max'] == img.max()
+    assert stats['mean'] == pytest.approx(img.mean())
+    for q in image_tools.INTENSITY_PERCENTILES:
+        # value below which (or equal) q percent of the pixels are
+        assert stats['percentiles'][str(q)] == np.percentile(img, q, method='inverted_cdf')
+    assert len(stats['histogram']) == image_tools.INTENSITY_HISTOGRAM_BINS
+    assert sum(stats['histogram']) == img.size
+
+
+def test_intensity_stats_of_float_skip_non_finite():
+    rng = np.random.default_rng(2)
+    img = rng.random((32, 32)).astype(np.float32)
+    finite = img.copy()
+    img[0, 0] = np.nan
+    img[1, 1] = np.inf
+    img[2, 2] = -np.inf
+
+    stats = image_tools.intensity_stats(img)
+
+    values = finite[np.isfinite(img)]
+    assert stats['min'] == pytest.approx(values.min())
+    assert stats['max'] == pytest.approx(values.max())
+    assert stats['percentiles']['50'] == pytest.approx(np.percentile(values, 50))
+    assert sum(stats['histogram']) == values.size
+
+
+def test_intensity_stats_of_constant_image():
+    stats = image_tools.intensity_stats(np.full((4, 4), 7, dtype=np.uint8))
+    assert stats['min'] == stats['max'] == 7
+    assert stats['histogram'][0] == 16
@@ -0,0 +1,57 @@
+import argparse
+import importlib.util
+import os
+
+import pytest
+
+import synthetic_acquisitions
+from filenames import filename_parser
+
+CLI_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'cli')
+
+
+def load_benchmark():
+    # ingest-benchmark.py is a script, not an importable module name
+    spec = importlib.util.spec_from_file_location('ingest_benchmark', os.path.join(CLI_DIR, 'ingest-benchmark.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_schema_has_all_monitor_tables():
+    benchmark = load_benchmark()
+    statements = benchmark.read_monitor_schema()
+    created = {statement.split()[2] for statement in statements if statement.upper().startswith('CREATE TABLE')}
+    assert created == set(benchmark.MONITOR_TABLES)
+
+
+def test_synthetic_acquisitions_parse(tmp_path):
+    schemes = list(synthetic_acquisitions.SCHEMES)
+    acquisitions = synthetic_acquisitions.generate_tree(str(tmp_path), schemes, 1, 2, 2, 2, image_size=8)
+
+    assert synthetic_acquisitions.verify_schemes(str(tmp_path), schemes) == []
+
+    # every image parses with the parsers image-monitor uses, not only the one the scheme is made for
+    n_images = 0
+    for acq_dir in acquisitions:
+        for filename in os.listdir(acq_dir):
+            metadata = filename_parser.parse_path_and_file(os.path.join(acq_dir, filename))
+            assert metadata is not None and metadata['well'] is not None, filename
+            n_images += 1
+    assert n_images == sum(acquisitions.values())
+
+
+@pytest.mark.skipif('IMAGEDB_BENCH_DB_HOST' not in os.environ, reason='needs a postgres server, set IMAGEDB_BENCH_DB_HOST')
+def test_benchmark_runs():
+    benchmark = load_benchmark()
+    args = argparse.Namespace(docker=False,
+                              db_host=os.environ['IMAGEDB_BENCH_DB_HOST'],
+                              db_port=int(os.getenv('IMAGEDB_BENCH_DB_PORT', 5432)),
+                              db_user=os.getenv('IMAGEDB_BENCH_DB_USER', 'postgres'),
+                              db_pass=os.getenv('IMAGEDB_BENCH_DB_PASS', 'example'),
+                              schemes='all', plates=1, wells=2, sites=1, channels=2,
+                              tree=None, expected_images=None,
+                              poll_interval=1, steady_polls=1, timeout=300,
+                              work_dir=None, keep=False)
+    result = benchmark.run_benchmark(args)
+    assert result['images_per_second'] > 0
@@ -0,0 +1,66 @@
+import pytest
+
+import io_budget
+
+
+def test_token_bucket_burst_then_wait():
+    bucket = io_budget.TokenBucket(10)
+    # a burst of one second of units is free
+    assert bucket.reserve(10) == 0.0
+    # the next units wait for the rate
+    assert bucket.reserve(5) == pytest.approx(0.5, abs=0.01)
+    assert bucket.reserve(5) == pytest.approx(1.0, abs=0.01)
+
+
+def test_token_bucket_slowdown_lowers_rate():
+    bucket = io_budget.TokenBucket(10)
+    bucket.reserve(10)
+    assert bucket.reserve(5, slowdown=2) == pytest.approx(1.0, abs=0.01)
+
+
+def test_token_bucket_unlimited():
+    bucket = io_budget.TokenBucket(0)
+    assert bucket.reserve(10 ** 9) == 0.0
+
+
+def test_backoff_doubles_above_target_and_recovers():
+    backoff = io_budget.LatencyBackoff('test', 0.1)
+    for _ in range(20):
+        backoff.observe(1.0)
+    assert backoff.factor == io_budget.MAX_BACKOFF_FACTOR
+    assert 0 < backoff.pause() <= io_budget.MAX_PAUSE
+
+    for _ in range(200):
+        backoff.observe(0.0)
+    assert backoff.factor == 1.0
+    assert backoff.pause() == 0.0
+
+
+def test_backoff_disabled_with_target_0():
+    backoff = io_budget.LatencyBackoff('test', 0)
+    backoff.observe(100.0)
+    assert backoff.factor == 1.0
+
+
+def test_budget_slowdown_is_max_of_read_and_commit():
+    budget = io_budget.IoBudget(0, 0, 2, 0.1, 0.1)
+    budget.observe_read(1.0)
+    budget.observe_read(1.0)
+    budget.observe_commit(1.0)
+    assert budget.slowdown() == 4.0
+
+
+def test_acquire_sleeps_when_over_budget(monkeypatch):
+    slept = []
+    monkeypatch.setattr(io_budget.time, 'sleep', slept.append)
+
+    budget = io_budget.IoBudget(1000, 0, 1, 0, 0)
+    budget.acquire(files=1, nbytes=1000)
+    assert slept == []
+    budget.acquire(files=1, nbytes=500)
+    assert slept == [pytest.approx(0.5, abs=0.01)]
+
+
+def test_is_backfill():
+    assert io_budget.is_backfill(0, 3600)
+    assert not io_budget.is_backfill(io_budget.time.time(), 3600)
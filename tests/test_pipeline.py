@@ -0,0 +1,106 @@
+import threading
+
+import pipeline
+
+
+def run_to_list(p, source, idle_timeout=None):
+    return [item for item in p.run(source, idle_timeout=idle_timeout)]
+
+
+def test_items_pass_all_stages():
+    p = pipeline.Pipeline('test', [pipeline.Stage('double', lambda x: x * 2, workers=3),
+                                   pipeline.Stage('inc', lambda x: x + 1, workers=2)])
+    assert sorted(run_to_list(p, range(20))) == sorted(x * 2 + 1 for x in range(20))
+
+
+def test_stage_failure_is_passed_on():
+    def fail_on_3(x):
+        if x == 3:
+            raise ValueError('bad item')
+        return x
+
+    later_stage_items = []
+    p = pipeline.Pipeline('test', [pipeline.Stage('check', fail_on_3),
+                                   pipeline.Stage('record', lambda x: later_stage_items.append(x) or x)])
+    results = run_to_list(p, range(5))
+
+    failures = [r for r in results if isinstance(r, pipeline.StageFailure)]
+    assert len(failures) == 1
+    assert failures[0].stage == 'check'
+    assert failures[0].item == 3
+    assert isinstance(failures[0].error, ValueError)
+    assert 'bad item' in failures[0].traceback
+    # later stages skip the failure
+    assert sorted(later_stage_items) == [0, 1, 2, 4]
+    assert sorted(r for r in results if not isinstance(r, pipeline.StageFailure)) == [0, 1, 2, 4]
+
+
+def test_source_failure_ends_pipeline():
+    def source():
+        yield 1
+        raise RuntimeError('source broke')
+
+    p = pipeline.Pipeline('test', [pipeline.Stage('same', lambda x: x)], source_name='claim')
+    results = run_to_list(p, source())
+
+    assert results[0] == 1
+    assert isinstance(results[1], pipeline.StageFailure)
+    assert results[1].stage == 'claim'
+    assert results[1].item is None
+    assert len(results) == 2
+
+
+def test_idle_timeout_yields_none():
+    release = threading.Event()
+
+    def source():
+        yield 1
+        release.wait(5)
+        yield 2
+
+    p = pipeline.Pipeline('test', [pipeline.Stage('same', lambda x: x)])
+    results = []
+    for item in p.run(source(), idle_timeout=0.05):
+        results.append(item)
+        if item is None:
+            release.set()
+
+    assert results[0] == 1
+    assert None in results
+    assert [r for r in results if r is not None] == [1, 2]
+
+
+def test_stop_ends_source():
+    def source():
+        n = 0
+        while True:
+            yield n
+            n += 1
+
+    p = pipeline.Pipeline('test', [pipeline.Stage('same', lambda x: x)])
+    results = []
+    for item in p.run(source(), idle_timeout=1):
+        results.append(item)
+        if len(results) == 3:
+            p.stop()
+
+    assert p.is_stopped()
+    # items already in the pipeline are still processed
+    assert results[:3] == [0, 1, 2]
+    assert results == list(range(len(results)))
+
+
+def test_caller_leaving_early_aborts_threads():
+    def source():
+        n = 0
+        while True:
+            yield n
+            n += 1
+
+    p = pipeline.Pipeline('test', [pipeline.Stage('same', lambda x: x, queue_size=1)], output_queue_size=1)
+    for item in p.run(source()):
+        break
+
+    for thread in p.threads:
+        thread.join(timeout=2)
+        assert not thread.is_alive()
@@ -0,0 +1,50 @@
+import cv2
+import numpy as np
+
+import tiff_info
+
+
+def write_tiff(path, img):
+    ok, buf = cv2.imencode('.tif', img)
+    assert ok
+    path.write_bytes(buf.tobytes())
+    return str(path)
+
+
+def test_header_of_16bit_gray(tmp_path):
+    path = write_tiff(tmp_path / 'gray.tif', np.zeros((30, 20), dtype=np.uint16))
+
+    lines = tiff_info.read_tiff_info_lines(path)
+    assert lines[0].startswith('TIFF Directory at offset')
+    assert '  Image Width: 20 Image Length: 30' in lines
+
+    info = tiff_info.read_tiff_info(path)
+    assert info['Bits/Sample'] == '16'
+    assert info['Samples/Pixel'] == '1'
+    assert info['Sample Format'] == 'unsigned integer'
+    assert info['Photometric Interpretation'] == 'min-is-black'
+    assert info['Compression Scheme'] == 'LZW'
+
+
+def test_header_of_8bit_color(tmp_path):
+    path = write_tiff(tmp_path / 'color.tif', np.zeros((4, 4, 3), dtype=np.uint8))
+
+    info = tiff_info.read_tiff_info(path)
+    assert info['Bits/Sample'] == '8'
+    assert info['Samples/Pixel'] == '3'
+    assert info['Photometric Interpretation'] == 'RGB color'
+
+
+def test_not_a_tiff(tmp_path):
+    path = tmp_path / 'image.tif'
+    path.write_bytes(b'not a tiff')
+    assert tiff_info.read_tiff_info(str(path)) == {}
+
+
+def test_many_with_unreadable_file(tmp_path):
+    path = write_tiff(tmp_path / 'gray.tif', np.zeros((2, 2), dtype=np.uint8))
+    missing = str(tmp_path / 'missing.tif')
+
+    infos = tiff_info.read_tiff_info_many([path, missing], max_workers=2)
+    assert infos[path]['Bits/Sample'] == '8'
+    assert infos[missing] == ""
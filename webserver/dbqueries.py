@@ -49,7 +49,8 @@ def get_plate(plate_name):
                        'z',
                        'channel',
                        'dye',
-                       'cell_line'
+                       'cell_line',
+                       'thumb_ready'
                        ]
 
         query = ("SELECT " + ",".join(return_cols) +
@@ -178,6 +179,84 @@ def list_all_plates():
             put_connection(conn)
 
 
+def select_intensity_stats(paths):
+    """
+    Returns dict with path as key and intensity_stats (set by thumb-worker at ingest) as value,
+    images without stats yet are not in the dict
+    """
+
+    conn = None
+    try:
+
+        conn = get_connection()
+
+        query = ("SELECT path, intensity_stats "
+                 " FROM images "
+                 " WHERE path = ANY(%s) AND intensity_stats IS NOT NULL")
+
+        cursor = conn.cursor()
+        cursor.execute(query, (list(paths), ))
+
+        stats = {row[0]: row[1] for row in cursor.fetchall()}
+
+        # Close/Release connection
+        cursor.close()
+        put_connection(conn)
+        conn = None
+
+        return stats
+
+    except (Exception, psycopg2.DatabaseError) as err:
+        logging.exception("Message")
+        raise err
+    finally:
+        if conn is not None:
+            put_connection(conn)
+
+
+def select_channel_intensity_stats(paths):
+    """
+    Returns dict with path as key and the intensity stats of its channel in its plate acquisition
+    (rolled up over all images, stored in channel_intensity_stats by thumb-worker) as value
+    """
+
+    conn = None
+    try:
+
+        conn = get_connection()
+
+        cursor = conn.cursor(cursor_factory = psycopg2.extras.RealDictCursor)
+
+        query = ("SELECT path, plate_acquisition_id, channel "
+                 " FROM images "
+                 " WHERE path = ANY(%s)")
+        cursor.execute(query, (list(paths), ))
+        images = cursor.fetchall()
+
+        query = ("SELECT * "
+                 " FROM channel_intensity_stats "
+                 " WHERE plate_acquisition_id = ANY(%s)")
+        cursor.execute(query, (list(set(image['plate_acquisition_id'] for image in images)), ))
+        channel_stats = {(row['plate_acquisition_id'], row['channel']): row for row in cursor.fetchall()}
+
+        stats = {image['path']: channel_stats[(image['plate_acquisition_id'], image['channel'])]
+                 for image in images if (image['plate_acquisition_id'], image['channel']) in channel_stats}
+
+        # Close/Release connection
+        cursor.close()
+        put_connection(conn)
+        conn = None
+
+        return stats
+
+    except (Exception, psycopg2.DatabaseError) as err:
+        logging.exception("Message")
+        raise err
+    finally:
+        if conn is not None:
+            put_connection(conn)
+
+
 ###
 ### From pipelinegui
 ###
@@ -9,7 +9,7 @@ import os
 
 import tornado.web
 import tornado.escape
-from imageutils import (merge_channels, tif2png)
+from imageutils import (merge_channels, tif2png, get_intensity_stats)
 import settings as imgdb_settings
 
 
@@ -38,11 +38,15 @@ class ImageMergeHandler(tornado.web.RequestHandler): #pylint: disable=abstract-m
 
         logging.debug(channels)
 
+        # normalize with stats stored at ingest instead of min/max and percentiles of the pixels,
+        # images are always written again since the cached file doesn't depend on normalization
+        intensity_stats = get_intensity_stats(channels.values(), normalization)
+
         img_path = None
         if len(channels) == 1:
-            img_path = tif2png(channels, imgdb_settings.IMAGES_CACHE_FOLDER, normalization)
+            img_path = tif2png(channels, imgdb_settings.IMAGES_CACHE_FOLDER, True, intensity_stats)
         else:
-            img_path = await merge_channels(channels, imgdb_settings.IMAGES_CACHE_FOLDER, normalization)
+            img_path = await merge_channels(channels, imgdb_settings.IMAGES_CACHE_FOLDER, True, intensity_stats)
 
         logging.debug(img_path)
 
@@ -6,13 +6,14 @@ from PIL import Image
 import numpy as np
 import os
 import settings as imgdb_settings
+import dbqueries
 
 from fileutils import create_merged_filepath, create_pngconverted_filepath
 
-def tif2png(channels, outdir, overwrite_existing=False):
-    return tif2png_opencv(channels, outdir, overwrite_existing )
+def tif2png(channels, outdir, overwrite_existing=False, intensity_stats=None):
+    return tif2png_opencv(channels, outdir, overwrite_existing, intensity_stats=intensity_stats)
 
-def tif2png_opencv(channels, outdir, overwrite_existing=False, normalize=True):
+def tif2png_opencv(channels, outdir, overwrite_existing=False, normalize=True, intensity_stats=None):
 
     #logging.debug(channels)
 
@@ -28,7 +29,7 @@ def tif2png_opencv(channels, outdir, overwrite_existing=False, normalize=True):
 
         if normalize:
             img = cv2.imread(tiff_path, cv2.IMREAD_ANYDEPTH)
-            img = cv2.normalize(img, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+            img = normalize_to_8bit(img, (intensity_stats or {}).get(tiff_path))
         else:
             img = cv2.imread(tiff_path) # Possibly cv2.IMREAD_GRAYSCALE is default for 8-bit images
 
@@ -67,27 +68,95 @@ def count_unique_colors(image_path):
     img = Image.open(image_path)
     return len(np.unique(image))
 
-def auto_white_balance(im, p=.6):
+def get_intensity_stats(paths, normalization):
+    '''Intensity stats stored at ingest of the original images in paths, dict with path as key.
+       With normalization 'plate' min and max are the 0.1 and 99.9 percentiles of the channel
+       in the whole plate acquisition, so all images of a plate are shown the same way'''
+
+    if normalization == 'plate':
+        return {path: {'min': row['p0_1'], 'max': row['p99_9'], 'plate': True}
+                for path, row in dbqueries.select_channel_intensity_stats(paths).items()}
+
+    return dbqueries.select_intensity_stats(paths)
+
+def normalize_to_8bit(img, stats=None):
+    '''Same as cv2.normalize with NORM_MINMAX to 8 bit, but with min and max from stats stored at ingest
+       instead of a pass over the pixels. Values outside min and max (plate range) are clipped'''
+
+    if stats is None:
+        return cv2.normalize(img, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+
+    lo, hi = stats['min'], stats['max']
+    scale = 255.0 / (hi - lo) if hi > lo else 0.0
+
+    if img.dtype in (np.uint8, np.uint16):
+        # one lookup per pixel
+        lut = np.clip(np.rint((np.arange(np.iinfo(img.dtype).max + 1) - lo) * scale), 0, 255).astype(np.uint8)
+        return lut[img]
+
+    return np.clip(np.rint((img - lo) * scale), 0, 255).astype(np.uint8)
+
+def histogram_percentile(histogram, q):
+    '''Value below which (or equal) q percent of the counts in histogram (one bin per value) are'''
+    cumulative = np.cumsum(histogram)
+    return float(np.searchsorted(cumulative, q / 100 * cumulative[-1]))
+
+def white_balance_percentiles(channel_stats, pixel_count, p=.6):
+    '''Percentiles for auto_white_balance of the merged image from stats stored at ingest,
+       channel_stats in merged (bgr) order with None for a channel without image (all zeros).
+       The stored histograms are histograms of the normalized channels, so no pass over the pixels is needed.
+       Returns None if any stats are missing'''
+
+    merged_histogram = np.zeros(256, dtype=np.int64)
+    channel_percentiles = []
+    for stats in channel_stats:
+        if stats is None:
+            merged_histogram[0] += pixel_count
+            channel_percentiles.append((0.0, 0.0))
+            continue
+
+        if 'histogram' not in stats or str(p) not in stats.get('percentiles', {}) or str(100-p) not in stats['percentiles']:
+            return None
+
+        merged_histogram += np.array(stats['histogram'], dtype=np.int64)
+
+        lo, hi = stats['min'], stats['max']
+        scale = 255.0 / (hi - lo) if hi > lo else 0.0
+        channel_percentiles.append(((stats['percentiles'][str(p)] - lo) * scale,
+                                    (stats['percentiles'][str(100-p)] - lo) * scale))
+
+    return histogram_percentile(merged_histogram, p), histogram_percentile(merged_histogram, 100-p), channel_percentiles
+
+def auto_white_balance(im, p=.6, percentiles=None):
     '''https://stackoverflow.com/questions/48268068/how-do-i-do-the-equivalent-of-gimps-colors-auto-white-balance-in-python-fu'''
-    '''Stretch each channel histogram to same percentile as mean.'''
+    '''Stretch each channel histogram to same percentile as mean.
+       percentiles (see white_balance_percentiles) are used instead of computing them from im'''
 
     # get mean values
-    p0, p1 = np.percentile(im, p), np.percentile(im, 100-p)
+    if percentiles is None:
+        p0, p1 = np.percentile(im, p), np.percentile(im, 100-p)
+    else:
+        p0, p1, channel_percentiles = percentiles
 
     for i in range(3):
         ch = im[:,:,i]
         # get channel values
-        pc0, pc1 = np.percentile(ch, p), np.percentile(ch, 100-p)
+        if percentiles is None:
+            pc0, pc1 = np.percentile(ch, p), np.percentile(ch, 100-p)
+        else:
+            pc0, pc1 = channel_percentiles[i]
         # stretch channel to same range as mean
         ch = (p1 - p0) * (ch - pc0) / (pc1 - pc0) + p0
         im[:,:,i] = ch
 
     return im
 
-async def merge_channels(channels, outdir, overwrite_existing=True):
+async def merge_channels(channels, outdir, overwrite_existing=True, intensity_stats=None):
     ''' For now in image veiewer read image as 8 bit grayscale cv2.IMREAD_GRAYSCALE
         instead of 16 bit cv2.IMREAD_UNCHANGED (can't see difference in img viewer and saves 90% of size)
-        and also dont create np array with np.uint16'''
+        and also dont create np array with np.uint16.
+        intensity_stats (see get_intensity_stats) has the stored stats of the images with path as key,
+        images without stats are normalized and white balanced from their pixels as before'''
 
     #logging.info("Inside async merge")
 
@@ -124,7 +193,8 @@ async def merge_channels(channels, outdir, overwrite_existing=True):
 
         # Add the channels to the needed image one by one
         # opencv uses bgr format instead of rgb
-        b = cv2.normalize(b, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+        intensity_stats = intensity_stats or {}
+        b = normalize_to_8bit(b, intensity_stats.get(paths[0]))
         merged_img[:, :, 0] = b
 
         if len(paths) > 1:
@@ -132,7 +202,7 @@ async def merge_channels(channels, outdir, overwrite_existing=True):
             if r is None:
                 raise Exception('image read returned NONE, path: ' + str(paths[1]))
 
-            r = cv2.normalize(r, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+            r = normalize_to_8bit(r, intensity_stats.get(paths[1]))
             merged_img[:, :, 2] = r
 
         if len(channels) > 2:
@@ -140,12 +210,20 @@ async def merge_channels(channels, outdir, overwrite_existing=True):
             if g is None:
                 raise Exception('image read returned NONE, path: ' + str(paths[2]))
 
-            g = cv2.normalize(g, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+            g = normalize_to_8bit(g, intensity_stats.get(paths[2]))
             merged_img[:, :, 1] = g
 
         # normalize colors
         # not needed any longer because each channel is normalized
-        merged_img = auto_white_balance(merged_img)
+        # (and not done with plate normalization, it would make images of the plate different again)
+        channel_stats = [intensity_stats.get(paths[0]),
+                         intensity_stats.get(paths[2]) if len(paths) > 2 else None,
+                         intensity_stats.get(paths[1]) if len(paths) > 1 else None]
+        if not any(stats is not None and stats.get('plate') for stats in channel_stats):
+            percentiles = None
+            if all(path in intensity_stats for path in paths):
+                percentiles = white_balance_percentiles(channel_stats, b.size)
+            merged_img = auto_white_balance(merged_img, percentiles=percentiles)
 
         # Save the merged image
         if not os.path.exists(os.path.dirname(merged_file)):
@@ -76,9 +76,12 @@ class Channel:
         self.id = id
         self.dye = dye
         self.path = ''
+        self.thumb_ready = False
         #self.image_meta = dict()
 
     def add_data(self, image_meta):
         self.path = image_meta['path']
+        # thumb_ready is NULL in db until thumb-worker has made the thumbnail
+        self.thumb_ready = image_meta.get('thumb_ready') is not None
         #self.image_meta = image_meta
 
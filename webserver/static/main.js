@@ -1206,7 +1206,8 @@ function drawPlatesListSidebar(origPlatesList){
   }
 
   function getSelectedNormalizationValue() {
-    return document.getElementById('normalization-cb').checked;
+    let elem = document.getElementById('normalization-select');
+    return elem.options[elem.selectedIndex].value;
   }
 
   function getSelectedShowHiddenValue() {
@@ -1227,8 +1228,11 @@ function drawPlatesListSidebar(origPlatesList){
   }
 
   function selectNormalizationFromStoredValue(){
-    let value = getNormalizationFromStore();
-    document.getElementById('normalization-cb').checked = value;
+    // stored value can be true/false from the old checkbox, false was never applied so it selects image
+    let value = String(getNormalizationFromStore());
+    let elem = document.getElementById('normalization-select');
+    let index = getIndexFromValue(elem.options, value);
+    elem.selectedIndex = index;
   }
 
   function selectShowHiddenFromStoredValue(){
@@ -1857,6 +1861,12 @@ function drawPlatesListSidebar(origPlatesList){
     redrawImageViewer();
   }
 
+  function viewerNormalizationSelectChanged() {
+    let value = getSelectedNormalizationValue();
+    setNormalizationInStore(value);
+    redrawImageViewer();
+  }
+
   function viewerAcquisitionSelectChanged() {
     redrawImageViewer(false);
   }
@@ -2241,7 +2251,7 @@ function drawPlatesListSidebar(origPlatesList){
   }
 
   function getDefaultNormalization(){
-    return true;
+    return "true";
   }
 
   function getDefaultShowHidden(){